@@ -2,7 +2,24 @@ import pygame
 import random
 import math
 import sys
+import os
+import json
+import hashlib
+import heapq
+import bisect
+from array import array
+import time
+import queue
+import struct
+import threading
+import weakref
+import zlib
+from collections import OrderedDict, deque
 from enum import Enum, auto
+try:
+    import numpy as np
+except ImportError:  # Weather falls back to plain Python lists; noise terrain needs NumPy
+    np = None
 import sys; print(sys.version)
 
 # Tile Types
@@ -40,6 +57,11 @@ class Tile(Enum):
     TREE_PINE = 35
     TREE_OAK = 36
     TREE_MUSHROOM = 37
+    FARMLAND = 38
+
+# Replays run without a window; SDL reads the video driver when it initialises
+if __name__ == '__main__' and '--replay' in sys.argv:
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
 
 # Initialize Pygame
 pygame.init()
@@ -56,8 +78,83 @@ pygame.font.init()
 clock = pygame.time.Clock()
 
 # Asset Loading
-def load_image(path, scale=1, colorkey=None):
-    """Load an image with optional scaling and colorkey transparency."""
+ASSET_SURFACES = weakref.WeakValueDictionary()  # path -> loaded Surface, for memory accounting
+SURFACE_FORMATS = {}  # path -> (format, estimated blit cost, alpha blit cost), from optimize_surface
+LOG_SURFACE_FORMATS = False  # Print each image's format as it loads; a summary is printed either way
+ALPHA_BLIT_COST = 4   # Per-pixel cost of an alpha blend relative to a plain copy in software SDL
+COLORKEY_CANDIDATES = [(255, 0, 255), (0, 255, 255), (1, 2, 3), (254, 1, 253)]
+
+
+def surface_format(image):
+    """(format, opaque pixels, visible pixels) for a per-pixel alpha surface.
+
+    'opaque' when every pixel is fully opaque, 'colorkey' when every pixel
+    is either fully opaque or fully transparent, 'alpha' otherwise.
+    """
+    size = image.get_width() * image.get_height()
+    opaque = pygame.mask.from_surface(image, 254).count()
+    if opaque == size:
+        return 'opaque', opaque, size
+    visible = pygame.mask.from_surface(image, 0).count()
+    return 'colorkey' if visible == opaque else 'alpha', opaque, visible
+
+
+def keyed_surface(image, opaque):
+    """image without its alpha channel, transparent pixels set to an unused colorkey; None if every key is taken."""
+    transparent = image.get_width() * image.get_height() - opaque
+    for key in COLORKEY_CANDIDATES:
+        keyed = pygame.Surface(image.get_size()).convert()
+        keyed.fill(key)
+        keyed.blit(image, (0, 0))
+        # Opaque pixels that happen to be the key colour would turn transparent
+        if pygame.mask.from_threshold(keyed, key, (1, 1, 1, 255)).count() == transparent:
+            keyed.set_colorkey(key, pygame.RLEACCEL)
+            return keyed
+    return None
+
+
+def optimize_surface(image, path):
+    """Swap a per-pixel alpha surface for the cheapest format that blits the same pixels.
+
+    Opaque images are converted to the display format and binary-alpha
+    images to an RLE colorkey. Real translucency keeps its alpha channel,
+    RLE encoded so SDL skips transparent runs and copies opaque ones, which
+    matters because nearly every sprite has antialiased edges.
+    """
+    fmt, opaque, visible = surface_format(image)
+    optimized = None
+    if fmt == 'opaque':
+        optimized = image.convert()
+    elif fmt == 'colorkey':
+        optimized = keyed_surface(image, opaque)
+    if optimized is None:
+        fmt, optimized = 'alpha', image
+        optimized.set_alpha(255, pygame.RLEACCEL)
+    size = image.get_width() * image.get_height()
+    cost = {'opaque': size, 'colorkey': opaque, 'alpha': opaque + (visible - opaque) * ALPHA_BLIT_COST}[fmt]
+    SURFACE_FORMATS[path] = (fmt, cost, size * ALPHA_BLIT_COST)
+    if LOG_SURFACE_FORMATS:
+        print(f'Format: {path}: {fmt}, ~{1 - cost / (size * ALPHA_BLIT_COST):.0%} cheaper blits')
+    return optimized
+
+
+def surface_format_summary():
+    """One line on what optimize_surface chose for the images loaded so far."""
+    counts = {}
+    for fmt, _, _ in SURFACE_FORMATS.values():
+        counts[fmt] = counts.get(fmt, 0) + 1
+    cost = sum(cost for _, cost, _ in SURFACE_FORMATS.values())
+    alpha_cost = sum(alpha_cost for _, _, alpha_cost in SURFACE_FORMATS.values()) or 1
+    formats = ', '.join(f'{count} {fmt}' for fmt, count in sorted(counts.items()))
+    return f'Optimized {len(SURFACE_FORMATS)} images ({formats}), ~{1 - cost / alpha_cost:.0%} cheaper blits'
+
+
+def load_image(path, scale=1, colorkey=None, optimize=True):
+    """Load an image with optional scaling and colorkey transparency.
+
+    The image is passed through optimize_surface unless optimize is False,
+    for callers that smoothscale it afterwards and need the alpha channel.
+    """
     try:
         image = pygame.image.load(path).convert_alpha()
         if scale != 1:
@@ -66,7 +163,14 @@ def load_image(path, scale=1, colorkey=None):
         if colorkey is not None:
             if colorkey == -1:
                 colorkey = image.get_at((0, 0))
-            image.set_colorkey(colorkey, pygame.RLEACCEL)
+            # Fold the colorkey into the alpha channel so one analysis covers both
+            image.set_colorkey(colorkey)
+            folded = pygame.Surface(image.get_size(), pygame.SRCALPHA)
+            folded.blit(image, (0, 0))
+            image = folded
+        if optimize:
+            image = optimize_surface(image, path)
+        ASSET_SURFACES[path] = image
         return image
     except pygame.error as e:
         print(f'Cannot load image: {path}')
@@ -92,47 +196,102 @@ def load_animation_frames(folder_path, scale=1, colorkey=None):
         print(f'Error loading animation from {folder_path}: {e}')
         return []
 
+def frame_paths(folder_path, prefix):
+    """Paths of '<prefix> (1).png', '<prefix> (2).png', ... in a folder holding several animations, in number order."""
+    try:
+        names = os.listdir(folder_path)
+    except OSError as e:
+        print(f'Error loading animation from {folder_path}: {e}')
+        return []
+    numbered = []
+    for name in names:
+        stem, ext = os.path.splitext(name)
+        number = stem[len(prefix) + 2:-1]
+        if stem.startswith(prefix + ' (') and stem.endswith(')') and number.isdigit() and ext.lower() == '.png':
+            numbered.append((int(number), os.path.join(folder_path, name)))
+    return [path for _, path in sorted(numbered)]
+
+
+def fit_to_tile(image, size):
+    """Scale image to fit a size x size square, keeping its shape, standing on the square's bottom edge."""
+    scale = size / max(image.get_width(), image.get_height())
+    width, height = max(1, round(image.get_width() * scale)), max(1, round(image.get_height() * scale))
+    fitted = pygame.Surface((size, size), pygame.SRCALPHA)
+    fitted.blit(pygame.transform.smoothscale(image, (width, height)), ((size - width) // 2, size - height))
+    return fitted
+
+
 # Load player animations (Jack the Knight)
+PLAYER_ANIMATIONS = ['idle', 'walk', 'run', 'jump', 'attack', 'dead']
+
+
 class PlayerAnimations:
+    """The knight's frames, scaled to a tile and mirrored once at load.
+
+    Every animation is kept for both facings, so turning round or
+    switching between idle, walk and run only picks another prepared list.
+    """
+
     def __init__(self):
         base_path = 'assets/sprites/characters/player/knight'
-        self.idle = load_animation_frames(f'{base_path}/idle', scale=2)
-        self.walk = load_animation_frames(f'{base_path}/walk', scale=2)
-        self.run = load_animation_frames(f'{base_path}/run', scale=2)
-        self.jump = load_animation_frames(f'{base_path}/jump', scale=2)
-        self.attack = load_animation_frames(f'{base_path}/attack', scale=2)
-        self.dead = load_animation_frames(f'{base_path}/dead', scale=2)
-        self.current_animation = self.idle
+        self.frames = {}  # (animation, facing_right) -> [Surface]
+        for name in PLAYER_ANIMATIONS:
+            right, left = [], []
+            for path in frame_paths(base_path, name.capitalize()):
+                # Flip before optimizing: flipping an RLE surface gives back a plain one
+                fitted = fit_to_tile(load_image(path, optimize=False), TILE_SIZE)
+                flipped = pygame.transform.flip(fitted, True, False)
+                right.append(optimize_surface(fitted, path))
+                left.append(optimize_surface(flipped, path + '#flipped'))
+                ASSET_SURFACES[path] = right[-1]
+                ASSET_SURFACES[path + '#flipped'] = left[-1]
+            self.frames[(name, True)] = right
+            self.frames[(name, False)] = left
+        self.animation = 'idle'
         self.animation_frame = 0
-        self.animation_speed = 0.15  # Slightly slower for knight animations
-        self.current_time = 0
+        self.animation_speed = 0.15  # Seconds per frame, slightly slower for knight animations
         self.facing_right = True  # Track which way Jack is facing
+        self.current_animation = self.frames[('idle', True)]
 
-    def update(self, dt):
+    def play(self, animation, dx=0):
+        """Switch to an animation, turning to face dx when it is non-zero."""
+        if dx:
+            self.facing_right = dx > 0
+        if animation != self.animation:
+            self.animation = animation
+            self.animation_frame = 0
+        self.current_animation = self.frames[(animation, self.facing_right)]
+
+    def next_frame(self):
+        """Advance one frame; called by the game scheduler every animation_speed seconds."""
         if not self.current_animation:
             return
-        self.current_time += dt
-        frame_duration = 1.0 / len(self.current_animation) * 1000  # ms per frame
-        self.animation_frame = int((self.current_time * self.animation_speed * 1000) / frame_duration) % len(self.current_animation)
+        self.animation_frame = (self.animation_frame + 1) % len(self.current_animation)
     
     def get_current_frame(self):
         if not self.current_animation:
             return None
         return self.current_animation[self.animation_frame]
 
-# NPC Types
+# NPC Types; NPCSprites only adds the types missing here
 NPC_TYPES = {
     'MERCHANT': {'name': 'Merchant', 'icon': '🧙', 'color': (245, 158, 11), 'dialogue': [
         "Welcome! Rare items for sale.", "Health potion: 20 coins?", "Treasures from all dimensions!", "Deal?"
     ]},
-    'EXPLORER': {'name': 'Explorer', 'icon': '🧭', 'color': (139, 69, 19), 'dialogue': [
-        "I've traveled far and wide.", "The world is full of wonders!", "Be careful in the caves!"
+    'EXPLORER': {'name': 'Explorer', 'icon': '🧑‍🚀', 'color': (59, 130, 246), 'dialogue': [
+        "I've mapped these lands!", "Hidden portals everywhere.", "Crystal Cave has rare loot.", "Map knowledge: 15 coins."
+    ]},
+    'WIZARD': {'name': 'Wizard', 'icon': '🧙‍♂️', 'color': (139, 92, 246), 'dialogue': [
+        "Magic flows here...", "I sense power in you.", "Teleport spell: 30 coins.", "Portals need courage."
+    ]},
+    'FARMER': {'name': 'Farmer', 'icon': '👨‍🌾', 'color': (22, 163, 74), 'dialogue': [
+        "Good crops in grasslands!", "Trade supplies: 10 coins.", "Perfect weather.", "Hard work pays!"
     ]},
-    'WIZARD': {'name': 'Wizard', 'icon': '🧙', 'color': (138, 43, 226), 'dialogue': [
-        "I sense great magic in you.", "The crystals hold great power.", "Beware the dark caves!"
+    'KNIGHT': {'name': 'Knight', 'icon': '⚔️', 'color': (220, 38, 38), 'dialogue': [
+        "Stay alert at night!", "I guard these lands.", "You're brave.", "Protection charm: 25 coins."
     ]},
-    'FARMER': {'name': 'Farmer', 'icon': '👨‍🌾', 'color': (34, 139, 34), 'dialogue': [
-        "My crops grow well here.", "The soil is rich in this valley.", "Need any supplies?"
+    'SCIENTIST': {'name': 'Scientist', 'icon': '🔬', 'color': (6, 182, 212), 'dialogue': [
+        "Fascinating physics!", "Studying portals.", "Crystals hold energy!", "Upgrade: 40 coins."
     ]},
     'CUTE_GIRL': {'name': 'Cute Girl', 'icon': '👧', 'color': (255, 182, 193), 'dialogue': [
         "Hello there, traveler!", "The forest is beautiful today.", "Watch out for the dark caves!"
@@ -157,11 +316,11 @@ NPC_TYPES = {
     ]},
     'ROBOT': {'name': 'Robot', 'icon': '🤖', 'color': (150, 150, 150), 'dialogue': [
         "BEEP BOOP. GREETINGS, FLESHY HUMAN.", "DO NOT WORRY, I AM NOT PLANNING WORLD DOMINATION.", "YET."
-    ]},
-    'SCIENTIST': {'name': 'Mad Scientist', 'icon': '👨‍🔬', 'color': (0, 0, 255), 'dialogue': [
-        "The results are... inconclusive.", "Fascinating! Let me take notes.", "It's alive! IT'S ALIVE!"
     ]}
 }
+# Which type spawns on an NPC tile: (type, cumulative chance)
+NPC_SPAWN = [('MERCHANT', 0.17), ('EXPLORER', 0.34), ('WIZARD', 0.51), ('FARMER', 0.68), ('KNIGHT', 0.85),
+             ('SCIENTIST', 1.0)]
 
 # Load NPC sprites
 class NPCSprites:
@@ -351,23 +510,15 @@ class NPCSprites:
             # Create a simple animation with just the placeholder
             self.animations[npc_type] = {
                 'idle': [self.placeholder],
-                'current_frame': 0,
-                'animation_speed': 0.1,
-                'current_time': 0
+                'current_frame': 0
             }
             
-            # Update NPC_TYPES with the loaded data
-            if npc_type in NPC_TYPES:
-                NPC_TYPES[npc_type].update({
-                    'name': data['name'],
-                    'color': data['color']
-                })
-            else:
-                NPC_TYPES[npc_type] = {
-                    'name': data['name'],
-                    'color': data['color'],
-                    'dialogue': data['dialogue']
-                }
+            # NPC_TYPES stays the one definition of names and colours; only fill in missing types
+            NPC_TYPES.setdefault(npc_type, {
+                'name': data['name'],
+                'color': data['color'],
+                'dialogue': data['dialogue']
+            })
                 
             # Try to load actual assets if available
             folder = data.get('folder')
@@ -393,23 +544,18 @@ class NPCSprites:
                         self.sprites[npc_type] = idle_frames[0]
                         self.animations[npc_type] = {
                             'idle': idle_frames,
-                            'current_frame': 0,
-                            'animation_speed': 0.1,
-                            'current_time': 0
+                            'current_frame': 0
                         }
                 except Exception as e:
                     # Silently handle missing assets, we already have placeholders
                     pass
         
-    def update(self, dt):
-        # Update animation frames for all NPCs
+    def next_frame(self):
+        # Advance every NPC's idle animation; called by the game scheduler every NPC_FRAME_MS
         for npc_type, anim in self.animations.items():
-            anim['current_time'] += dt
-            if anim['current_time'] >= anim['animation_speed']:
-                anim['current_time'] = 0
-                anim['current_frame'] = (anim['current_frame'] + 1) % len(anim['idle'])
-                # Update the main sprite with the current frame
-                self.sprites[npc_type] = anim['idle'][anim['current_frame']]
+            anim['current_frame'] = (anim['current_frame'] + 1) % len(anim['idle'])
+            # Update the main sprite with the current frame
+            self.sprites[npc_type] = anim['idle'][anim['current_frame']]
         
     def get(self, npc_type):
         return self.sprites.get(npc_type.upper())
@@ -419,6 +565,14 @@ class TileSprites:
     def __init__(self):
         self.sprites = {}
         self.load_tiles()
+
+    @staticmethod
+    def load(path):
+        # Scaled to a tile once here; scaling an RLE surface in draw_tile would decode it every call
+        image = pygame.transform.scale(load_image(path, optimize=False), (TILE_SIZE, TILE_SIZE))
+        image = optimize_surface(image, path)
+        ASSET_SURFACES[path] = image
+        return image
     
     def load_tiles(self):
         # Load mushroom forest tiles
@@ -431,7 +585,7 @@ class TileSprites:
             for i in range(1, 5):
                 bush_path = f'{mushroom_forest_path}/Bush ({i}).png'
                 print(f"Loading: {bush_path}")
-                bush_img = load_image(bush_path)
+                bush_img = self.load(bush_path)
                 if bush_img:
                     bush_frames.append(bush_img)
             if bush_frames:
@@ -441,23 +595,23 @@ class TileSprites:
             # Load crate
             crate_path = f'{mushroom_forest_path}/Crate.png'
             print(f"Loading: {crate_path}")
-            self.sprites[Tile.CRATE] = load_image(crate_path)
+            self.sprites[Tile.CRATE] = self.load(crate_path)
             
             # Load mushrooms
             mushroom_red_path = f'{mushroom_forest_path}/Mushroom_1.png'
             print(f"Loading: {mushroom_red_path}")
-            self.sprites[Tile.MUSHROOM_RED] = load_image(mushroom_red_path)
+            self.sprites[Tile.MUSHROOM_RED] = self.load(mushroom_red_path)
             
             mushroom_blue_path = f'{mushroom_forest_path}/Mushroom_2.png'
             print(f"Loading: {mushroom_blue_path}")
-            self.sprites[Tile.MUSHROOM_BLUE] = load_image(mushroom_blue_path)
+            self.sprites[Tile.MUSHROOM_BLUE] = self.load(mushroom_blue_path)
             
             # Load signs
             sign_frames = []
             for i in range(1, 3):
                 sign_path = f'{mushroom_forest_path}/Sign_{i}.png'
                 print(f"Loading: {sign_path}")
-                sign_img = load_image(sign_path)
+                sign_img = self.load(sign_path)
                 if sign_img:
                     sign_frames.append(sign_img)
             if sign_frames:
@@ -467,14 +621,14 @@ class TileSprites:
             # Load stone block
             stone_path = f'{mushroom_forest_path}/Stone.png'
             print(f"Loading: {stone_path}")
-            self.sprites[Tile.STONE_BLOCK] = load_image(stone_path)
+            self.sprites[Tile.STONE_BLOCK] = self.load(stone_path)
             
             # Load tree variants
             tree_frames = []
             for i in range(1, 4):
                 tree_path = f'{mushroom_forest_path}/Tree_{i}.png'
                 print(f"Loading: {tree_path}")
-                tree_img = load_image(tree_path)
+                tree_img = self.load(tree_path)
                 if tree_img:
                     tree_frames.append(tree_img)
             if tree_frames:
@@ -497,22 +651,24 @@ class TileSprites:
             return tile
         return None
 
-# Initialize sprites
-player_animations = PlayerAnimations()
-npc_sprites = NPCSprites()
-tile_sprites = TileSprites()
-
-# For backward compatibility
-PLAYER_SPRITE = player_animations.get_current_frame() or pygame.Surface((32, 32), pygame.SRCALPHA)
-NPC_SPRITES = npc_sprites.sprites
-
 # Constants
 TILE_SIZE = 40
 VIEWPORT_WIDTH = 16
 VIEWPORT_HEIGHT = 12
+CHUNK_SIZE = 16  # Tiles per side of a chunk, the unit for streaming and bulk work
 SCREEN_WIDTH = VIEWPORT_WIDTH * TILE_SIZE
 SCREEN_HEIGHT = VIEWPORT_HEIGHT * TILE_SIZE + 150  # Extra for HUD
 
+# Initialize sprites; player frames are scaled to TILE_SIZE, so this comes after the constants
+player_animations = PlayerAnimations()
+npc_sprites = NPCSprites()
+tile_sprites = TileSprites()
+
+print(surface_format_summary())
+
+# For backward compatibility
+NPC_SPRITES = npc_sprites.sprites
+
 # Creature Types and Stats
 CREATURE_TYPES = {
     'FIRE': {'name': 'Fire', 'color': (255, 100, 0), 'strong_against': 'GRASS', 'weak_against': 'WATER'},
@@ -531,18 +687,18 @@ CREATURE_NAMES = {
 }
 
 class Creature:
-    def __init__(self, ctype=None):
+    def __init__(self, ctype=None, rng=random):
         if ctype is None:
-            ctype = random.choice(list(CREATURE_TYPES.keys()))
+            ctype = rng.choice(list(CREATURE_TYPES.keys()))
         
         self.type = ctype
-        self.name = random.choice(CREATURE_NAMES[ctype])
-        self.level = random.randint(1, 10)
+        self.name = rng.choice(CREATURE_NAMES[ctype])
+        self.level = rng.randint(1, 10)
         self.health = 20 + (self.level * 5)
         self.max_health = self.health
         self.attack = 5 + self.level
         self.defense = 5 + self.level
-        self.speed = random.randint(1, 10)
+        self.speed = rng.randint(1, 10)
         self.experience = 0
         self.experience_to_level = self.level * 10
         self.moves = [
@@ -551,15 +707,15 @@ class Creature:
         ]
         
         # Random chance for a special move
-        if random.random() < 0.3:
+        if rng.random() < 0.3:
             special_moves = [
                 {'name': 'Quick Attack', 'power': 8, 'type': 'NORMAL', 'pp': 20, 'priority': 1},
                 {'name': 'Defense Curl', 'power': 0, 'type': 'NORMAL', 'pp': 20, 'effect': 'defense_up'},
                 {'name': 'Growl', 'power': 0, 'type': 'NORMAL', 'pp': 20, 'effect': 'attack_down'}
             ]
-            self.moves.append(random.choice(special_moves))
+            self.moves.append(rng.choice(special_moves))
     
-    def attack_move(self, move_index, target):
+    def attack_move(self, move_index, target, rng=random):
         if move_index >= len(self.moves):
             return "Invalid move!"
             
@@ -595,7 +751,7 @@ class Creature:
         damage = max(1, damage)  # Minimum 1 damage
         
         # Add some randomness to damage (85-100% of calculated damage)
-        damage = int(damage * (0.85 + 0.15 * random.random()))
+        damage = int(damage * (0.85 + 0.15 * rng.random()))
         
         target.health = max(0, target.health - damage)
         message += f"Dealt {damage} damage!"
@@ -663,43 +819,652 @@ BIOMES = {
     'WASTELAND': {'name': 'Wasteland', 'color': (120, 113, 108), 'icon': '💀', 'bg': (90, 80, 70)}
 }
 
-# Tile enum has been moved to the top of the file
+# Creature type found in the wild in each biome
+BIOME_CREATURE_TYPES = {
+    'GRASSLAND': 'GRASS',
+    'DESERT': 'GROUND',
+    'SNOW': 'WATER',
+    'FOREST': 'GRASS',
+    'LAVA': 'FIRE',
+    'OCEAN': 'WATER',
+    'SWAMP': 'GRASS',
+    'MOUNTAIN': 'GROUND',
+    'JUNGLE': 'GRASS',
+    'MUSHROOM': 'GRASS',
+    'CRYSTAL': 'ELECTRIC',
+    'WASTELAND': 'GROUND'
+}
 
-WALKABLE = [
-    Tile.GRASS, Tile.DIRT, Tile.FLOWER, Tile.TREASURE, Tile.KEY_ITEM,
-    Tile.QUESTION_BLOCK, Tile.SNOW, Tile.SAND, Tile.PORTAL, Tile.CRYSTAL,
-    Tile.ICE, Tile.MUSHROOM_BLOCK, Tile.LILY_PAD, Tile.DARK_STONE, Tile.NPC,
-    Tile.BRICK, Tile.OBSIDIAN, Tile.MUSHROOM_RED, Tile.MUSHROOM_BLUE, 
-    Tile.BUSH, Tile.CRATE, Tile.SIGN, Tile.STONE_BLOCK
+# Biome of each 30-tile block in legacy worlds: (biome, cumulative chance)
+LEGACY_BIOMES = [
+    ('DESERT', 0.10), ('SNOW', 0.20), ('FOREST', 0.35), ('LAVA', 0.40), ('OCEAN', 0.50), ('SWAMP', 0.60),
+    ('MOUNTAIN', 0.70), ('JUNGLE', 0.80), ('MUSHROOM', 0.85), ('WASTELAND', 0.90), ('GRASSLAND', 1.0),
 ]
 
-# NPC Types
-NPC_TYPES = {
-    'MERCHANT': {'name': 'Merchant', 'icon': '🧙', 'color': (245, 158, 11), 'dialogue': [
-        "Welcome! Rare items for sale.", "Health potion: 20 coins?", "Treasures from all dimensions!", "Deal?"
-    ]},
-    'EXPLORER': {'name': 'Explorer', 'icon': '🧑‍🚀', 'color': (59, 130, 246), 'dialogue': [
-        "I've mapped these lands!", "Hidden portals everywhere.", "Crystal Cave has rare loot.", "Map knowledge: 15 coins."
-    ]},
-    'WIZARD': {'name': 'Wizard', 'icon': '🧙‍♂️', 'color': (139, 92, 246), 'dialogue': [
-        "Magic flows here...", "I sense power in you.", "Teleport spell: 30 coins.", "Portals need courage."
-    ]},
-    'FARMER': {'name': 'Farmer', 'icon': '👨‍🌾', 'color': (22, 163, 74), 'dialogue': [
-        "Good crops in grasslands!", "Trade supplies: 10 coins.", "Perfect weather.", "Hard work pays!"
-    ]},
-    'KNIGHT': {'name': 'Knight', 'icon': '⚔️', 'color': (220, 38, 38), 'dialogue': [
-        "Stay alert at night!", "I guard these lands.", "You're brave.", "Protection charm: 25 coins."
-    ]},
-    'SCIENTIST': {'name': 'Scientist', 'icon': '🔬', 'color': (6, 182, 212), 'dialogue': [
-        "Fascinating physics!", "Studying portals.", "Crystals hold energy!", "Upgrade: 40 coins."
-    ]}
+# Tile Definitions
+# Everything the game needs to know about a tile, by type. Missing keys mean no icon,
+# no border, not walkable, no light and not blocking light.
+OUTLINE = (BLACK, 2)
+TILE_DATA = {
+    Tile.GRASS:          {'color': (34, 197, 94), 'walkable': True},
+    Tile.DIRT:           {'color': (146, 64, 14), 'walkable': True},
+    Tile.STONE:          {'color': (156, 163, 175), 'border': OUTLINE, 'blocks_light': True},
+    Tile.WATER:          {'color': (59, 130, 246)},
+    Tile.TREE:           {'color': (34, 197, 94), 'icon': '🌲'},
+    Tile.FLOWER:         {'color': (34, 197, 94), 'icon': '🌸', 'walkable': True},
+    Tile.TREASURE:       {'color': (34, 197, 94), 'icon': '$', 'icon_color': BLACK, 'walkable': True},
+    Tile.KEY_ITEM:       {'color': (34, 197, 94), 'icon': '🔑', 'walkable': True},
+    Tile.BRICK:          {'color': (217, 119, 6), 'border': OUTLINE, 'walkable': True, 'blocks_light': True},
+    Tile.QUESTION_BLOCK: {'color': (251, 191, 36), 'icon': '?', 'icon_color': BLACK, 'border': ((217, 119, 6), 3),
+                          'walkable': True},
+    Tile.ICE:            {'color': (219, 234, 254), 'walkable': True},
+    Tile.SNOW:           {'color': (240, 249, 255), 'walkable': True},
+    Tile.SAND:           {'color': (254, 243, 199), 'walkable': True},
+    Tile.CACTUS:         {'color': (254, 243, 199), 'icon': '🌵'},
+    Tile.LAVA:           {'color': (249, 115, 22), 'icon': '🔥', 'light': 7},
+    Tile.OBSIDIAN:       {'color': (31, 41, 55), 'border': OUTLINE, 'walkable': True, 'blocks_light': True},
+    Tile.PORTAL:         {'color': (139, 92, 246), 'icon': '🌀', 'walkable': True, 'light': 6},
+    Tile.CRYSTAL:        {'color': (34, 197, 94), 'icon': '💎', 'walkable': True, 'light': 5},
+    Tile.MUSHROOM_BLOCK: {'color': (220, 38, 38), 'icon': '🍄', 'walkable': True},
+    Tile.LILY_PAD:       {'color': (59, 130, 246), 'icon': '🪷', 'walkable': True},
+    Tile.VINE:           {'color': (34, 197, 94), 'icon': '🌿'},
+    Tile.DARK_STONE:     {'color': (55, 65, 81), 'border': OUTLINE, 'walkable': True, 'blocks_light': True},
+    Tile.CORAL:          {'color': (59, 130, 246), 'icon': '🪸'},
+    Tile.NPC:            {'color': (34, 197, 94), 'walkable': True},  # Drawn with its NPC's icon
+    # Mushroom forest tiles; the colours and icons stand in when their images fail to load
+    Tile.MUSHROOM_RED:   {'color': (220, 38, 38), 'icon': '🍄', 'walkable': True},
+    Tile.MUSHROOM_BLUE:  {'color': (59, 130, 246), 'icon': '🍄', 'walkable': True},
+    Tile.BUSH:           {'color': (22, 101, 52), 'icon': '🌿', 'walkable': True},
+    Tile.CRATE:          {'color': (146, 64, 14), 'icon': '📦', 'walkable': True},
+    Tile.SIGN:           {'color': (253, 230, 138), 'icon': '📜', 'walkable': True},
+    Tile.STONE_BLOCK:    {'color': (107, 114, 128), 'icon': '🪨', 'walkable': True, 'blocks_light': True},
+    Tile.TREE_PINE:      {'color': (22, 101, 52), 'icon': '🌲'},
+    Tile.TREE_OAK:       {'color': (22, 101, 52), 'icon': '🌳'},
+    Tile.TREE_MUSHROOM:  {'color': (147, 51, 234), 'icon': '🍄'},
+    Tile.FARMLAND:       {'color': (120, 72, 30), 'walkable': True},
 }
+TILE_VALUES = 256  # Tile values fit in a byte, as chunk tile bytes and saves store them
+FALLBACK_TILE_COLOR = (100, 100, 100)
+
+
+def compile_tile_data():
+    """Dense tables indexed by tile value, built once from TILE_DATA.
+
+    Returns colours, icon surfaces and borders as lists, and the walkable,
+    light emission and light blocking tables as bytes, which also suit
+    bytes.translate over whole chunks.
+    """
+    colors = [FALLBACK_TILE_COLOR] * TILE_VALUES
+    icons = [None] * TILE_VALUES
+    borders = [None] * TILE_VALUES
+    walkable, emission, blocking = bytearray(TILE_VALUES), bytearray(TILE_VALUES), bytearray(TILE_VALUES)
+    for tile, data in TILE_DATA.items():
+        value = tile.value
+        colors[value] = data['color']
+        if 'icon' in data:
+            icons[value] = font.render(data['icon'], True, data.get('icon_color', WHITE))
+        borders[value] = data.get('border')
+        walkable[value] = data.get('walkable', False)
+        emission[value] = data.get('light', 0)
+        blocking[value] = data.get('blocks_light', False)
+    return colors, icons, borders, bytes(walkable), bytes(emission), bytes(blocking)
+
+
+def cumulative_table(entries):
+    """(cumulative chances, values) from a [(value, cumulative chance)] list, for pick_from."""
+    return [chance for _, chance in entries], [value for value, _ in entries]
+
+
+def pick_from(table, r):
+    """The value of the first entry whose cumulative chance is above r."""
+    chances, values = table
+    return values[bisect.bisect_right(chances, r)]
+
+
+TILE_COLORS, TILE_ICONS, TILE_BORDERS, WALKABLE_TABLE, EMISSION_TABLE, BLOCKING_TABLE = compile_tile_data()
+WALKABLE = frozenset(tile for tile in Tile if WALKABLE_TABLE[tile.value])
+LEGACY_BIOME_TABLE = cumulative_table(LEGACY_BIOMES)
+NPC_SPAWN_TABLE = cumulative_table(NPC_SPAWN)
+NPC_ICONS = {npc_type: font.render(npc['icon'], True, WHITE) for npc_type, npc in NPC_TYPES.items() if 'icon' in npc}
+
+# Dialogue rendering
+class DialogueRenderer:
+    """Lays out NPC dialogue once and reuses the rendered surfaces every frame."""
+
+    TEXT_COLOR = (240, 240, 240)
+    LINE_HEIGHT = 20
+
+    def __init__(self):
+        self.overlay = None
+        self.prompt = None
+        self.npc_key = None
+        self.panels = {}     # (dialogue_index, show_buttons) -> panel surface
+        self.portraits = {}  # source sprite -> portrait-sized copy
+
+    def resolve_npc(self, active_npc):
+        """Return (npc_type, npc_data) for whatever form active_npc is stored in."""
+        if isinstance(active_npc, dict):
+            npc = active_npc.get('npc', active_npc)
+            npc_type = npc.get('type', str(npc.get('name', '')).upper())
+            return npc_type, {**NPC_TYPES.get(npc_type, {}), **npc}
+        npc_type = str(active_npc)
+        npc = NPC_TYPES.get(npc_type)
+        if npc is None:
+            npc = {'name': npc_type, 'color': (200, 200, 200), 'icon': '?'}
+        return npc_type, npc
+
+    def get_overlay(self):
+        if self.overlay is None:
+            # Uniform alpha blits much faster than a per-pixel SRCALPHA surface
+            self.overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+            self.overlay.fill(BLACK)
+            self.overlay.set_alpha(180)
+        return self.overlay
+
+    def get_prompt(self):
+        if self.prompt is None:
+            self.prompt = small_font.render('Press SPACE to continue...', True, (200, 200, 200))
+        return self.prompt
+
+    def get_portrait(self, sprite):
+        portrait = self.portraits.get(sprite)
+        if portrait is None:
+            portrait = pygame.transform.scale(sprite, (70, 70))
+            self.portraits[sprite] = portrait
+        return portrait
+
+    def wrap_text(self, text, max_width):
+        """Greedy word wrap that measures each word once instead of every prefix."""
+        space_width = small_font.size(' ')[0]
+        lines = []
+        current_line = []
+        line_width = 0
+        for word in text.split(' '):
+            word_width = small_font.size(word)[0]
+            new_width = line_width + space_width + word_width if current_line else word_width
+            if current_line and new_width >= max_width:
+                lines.append(' '.join(current_line))
+                current_line = [word]
+                line_width = word_width
+            else:
+                current_line.append(word)
+                line_width = new_width
+        if current_line:
+            lines.append(' '.join(current_line))
+        return lines
+
+    def build_panel(self, npc, dialogue_index, show_buttons):
+        """Render the dialog box, name plate and wrapped text into one surface."""
+        dialog_height = 250 if show_buttons else 180
+        width = SCREEN_WIDTH - 100
+        panel = pygame.Surface((width + 5, dialog_height + 5), pygame.SRCALPHA)
+        dialog_rect = pygame.Rect(0, 0, width, dialog_height)
+
+        # Shadow effect
+        pygame.draw.rect(panel, BLACK, dialog_rect.move(5, 5), border_radius=12)
+
+        # Main dialog box
+        pygame.draw.rect(panel, (40, 40, 60), dialog_rect, border_radius=10)
+        pygame.draw.rect(panel, (80, 80, 120), dialog_rect, 2, border_radius=10)
+
+        # Portrait area
+        portrait_rect = pygame.Rect(15, 15, 80, 80)
+        pygame.draw.rect(panel, (30, 30, 40), portrait_rect, border_radius=8)
+        pygame.draw.rect(panel, (100, 100, 150), portrait_rect, 2, border_radius=8)
+
+        # Name plate
+        name_bg = pygame.Rect(portrait_rect.right + 10, portrait_rect.y, 200, 25)
+        pygame.draw.rect(panel, npc.get('color', (200, 200, 200)), name_bg, border_radius=4)
+        name_surf = pixel_font.render(npc.get('name', 'Unknown'), True, self.TEXT_COLOR)
+        panel.blit(name_surf, (name_bg.x + 10, name_bg.y + 5))
+
+        # Dialog text with word wrapping
+        dialogue = npc.get('dialogue') or ["..."]
+        text = dialogue[dialogue_index % len(dialogue)]
+        for i, line in enumerate(self.wrap_text(text, width - 150)):
+            text_surf = small_font.render(line, True, self.TEXT_COLOR)
+            panel.blit(text_surf, (portrait_rect.right + 15, 50 + i * self.LINE_HEIGHT))
+        return panel
+
+    def get_panel(self, npc_type, npc, dialogue_index, show_buttons):
+        npc_key = (npc_type, npc.get('name'))
+        if npc_key != self.npc_key:
+            # A different NPC: throw away the previous one's layouts
+            self.npc_key = npc_key
+            self.panels = {}
+        key = (dialogue_index, show_buttons)
+        panel = self.panels.get(key)
+        if panel is None:
+            panel = self.build_panel(npc, dialogue_index, show_buttons)
+            self.panels[key] = panel
+        return panel
+
+# Battle rendering
+BATTLE_LOG_LIMIT = 100  # Battle messages kept for scrolling back
+BATTLE_LOG_LINES = 4    # Messages visible at once
+
+
+def health_color(ratio):
+    return (0, 255, 0) if ratio > 0.5 else (255, 200, 0) if ratio > 0.2 else (255, 0, 0)
+
+
+class BattleRenderer:
+    """Draws the battle screen from a cached static layer and small dynamic layers.
+
+    The background, panels and labels only change when either creature
+    does. HP bars, the move list, the HUD and the message log are each a
+    small surface keyed by the values shown on it and re-rendered only when
+    those values change, so an idle battle frame is a handful of blits.
+    """
+
+    LOG_RECT = pygame.Rect(50, 330, SCREEN_WIDTH - 100, BATTLE_LOG_LINES * 24 + 12)
+
+    def __init__(self):
+        self.static_key = None
+        self.static = None
+        self.layers = {}  # layer name -> (key, surface)
+
+    def layer(self, name, key, build):
+        cached = self.layers.get(name)
+        if cached is None or cached[0] != key:
+            cached = (key, build())
+            self.layers[name] = cached
+        return cached[1]
+
+    def build_static(self, player_creature, wild_creature):
+        surface = pygame.Surface(screen.get_size()).convert()
+        surface.fill((200, 230, 250))  # Light blue background
+
+        # Player creature (right side)
+        pygame.draw.rect(surface, (150, 200, 150), (SCREEN_WIDTH - 200, 200, 150, 100))
+        surface.blit(font.render(player_creature.name, True, BLACK), (SCREEN_WIDTH - 180, 210))
+        surface.blit(font.render(f"Lv{player_creature.level}", True, BLACK), (SCREEN_WIDTH - 100, 210))
+
+        # Wild creature (left side)
+        pygame.draw.rect(surface, (200, 150, 150), (50, 50, 150, 100))
+        surface.blit(font.render(f"Wild {wild_creature.name}", True, BLACK), (70, 60))
+        surface.blit(font.render(f"Lv{wild_creature.level}", True, BLACK), (150, 60))
+
+        pygame.draw.rect(surface, (50, 50, 50), (0, SCREEN_HEIGHT - 40, SCREEN_WIDTH, 40))
+        surface.blit(font.render("R. Run", True, BLACK), (SCREEN_WIDTH - 150, SCREEN_HEIGHT - 60))
+        pygame.draw.rect(surface, (40, 40, 60), self.LOG_RECT, border_radius=8)
+        return surface
+
+    def build_player_health(self, creature):
+        surface = pygame.Surface((130, 20))
+        surface.fill((150, 200, 150))
+        ratio = creature.health / creature.max_health
+        pygame.draw.rect(surface, (100, 100, 100), (0, 0, 120, 15))
+        pygame.draw.rect(surface, health_color(ratio), (0, 0, int(120 * ratio), 15))
+        surface.blit(font.render(f"HP: {creature.health}/{creature.max_health}", True, WHITE), (5, 0))
+        return surface
+
+    def build_wild_health(self, creature):
+        surface = pygame.Surface((120, 10))
+        surface.fill((100, 100, 100))
+        ratio = creature.health / creature.max_health
+        pygame.draw.rect(surface, health_color(ratio), (0, 0, int(120 * ratio), 10))
+        return surface
+
+    def build_hud(self, coins, health, score):
+        surface = pygame.Surface((SCREEN_WIDTH, 40))
+        surface.fill((50, 50, 50))
+        surface.blit(font.render(f'Coins: {coins}', True, YELLOW), (10, 5))
+        surface.blit(font.render(f'Health: {health}', True, RED), (150, 5))
+        surface.blit(font.render(f'Score: {score}', True, WHITE), (300, 5))
+        return surface
+
+    def build_moves(self, moves):
+        surface = pygame.Surface((400, 60), pygame.SRCALPHA)
+        for i, (name, pp) in enumerate(moves):
+            text = font.render(f"{i+1}. {name} ({pp}/{pp})", True, BLACK)
+            surface.blit(text, ((i % 2) * 200, (i // 2) * 30))
+        return surface
+
+    def build_log(self, lines, older, newer):
+        rect = self.LOG_RECT
+        surface = pygame.Surface(rect.size)
+        surface.fill((40, 40, 60))
+        for i, line in enumerate(lines):
+            surface.blit(small_font.render(line, True, WHITE), (12, 6 + i * 24))
+        if older:
+            surface.blit(small_font.render(f"{older} older", True, (180, 180, 200)), (rect.width - 90, 6))
+        if newer:
+            surface.blit(small_font.render(f"{newer} newer", True, (180, 180, 200)), (rect.width - 90, rect.height - 24))
+        return surface
+
+    def draw(self, game):
+        player_creature = game.creatures[game.current_creature]
+        wild_creature = game.wild_creature
+
+        static_key = (id(player_creature), player_creature.name, player_creature.level,
+                      id(wild_creature), wild_creature.name, wild_creature.level)
+        if static_key != self.static_key:
+            self.static_key = static_key
+            self.static = self.build_static(player_creature, wild_creature)
+        screen.blit(self.static, (0, 0))
+
+        player_health = self.layer(
+            'player_health', (static_key, player_creature.health, player_creature.max_health),
+            lambda: self.build_player_health(player_creature))
+        screen.blit(player_health, (SCREEN_WIDTH - 180, 230))
+        wild_health = self.layer(
+            'wild_health', (static_key, wild_creature.health, wild_creature.max_health),
+            lambda: self.build_wild_health(wild_creature))
+        screen.blit(wild_health, (70, 80))
+
+        hud_key = (game.coins, game.health, game.score)
+        screen.blit(self.layer('hud', hud_key, lambda: self.build_hud(*hud_key)), (0, SCREEN_HEIGHT - 40))
+
+        # Show the first 2 moves
+        moves_key = tuple((move['name'], move['pp']) for move in player_creature.moves[:2])
+        screen.blit(self.layer('moves', moves_key, lambda: self.build_moves(moves_key)), (20, SCREEN_HEIGHT - 60))
+
+        messages = game.battle_messages
+        newer = min(game.battle_log_scroll, max(0, len(messages) - BATTLE_LOG_LINES))
+        end = len(messages) - newer
+        start = max(0, end - BATTLE_LOG_LINES)
+        lines = tuple(messages[i] for i in range(start, end))
+        log = self.layer('log', (lines, start, newer), lambda: self.build_log(lines, start, newer))
+        screen.blit(log, self.LOG_RECT.topleft)
+
+# Battle AI
+BATTLE_AI_MS = 3.0                  # Search time per move choice
+BATTLE_AI_PLIES = 2                 # Fixed search depth when replays need repeatable work
+BATTLE_AI_MAX_PLIES = 12
+DAMAGE_ROLLS = (0.0, 0.5, 1.0)      # rng.random() samples standing in for attack_move's damage roll
+BATTLE_WIN_SCORE = 10.0
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class BattleAI:
+    """Expectimax move choice for the wild side of a battle.
+
+    A battle state is two flat tuples, (health, attack, defense, pp tuple)
+    per side, so trying a move builds a new tuple instead of copying
+    Creature objects. Levels, types and moves never change during a search
+    and are read once. The search deepens one ply at a time until
+    BATTLE_AI_MS runs out and uses the deepest finished answer; replays use
+    a fixed depth instead so recordings stay repeatable.
+    """
+
+    def __init__(self):
+        self.deterministic = False
+        self.deadline = 0
+        self.memo = {}  # (state, actor, plies) -> value, for the current search only
+        # Per side, player's creature first: fixed for the length of one search
+        self.moves = self.types = self.levels = self.max_health = ()
+
+    def state_of(self, creature):
+        return (creature.health, creature.attack, creature.defense,
+                tuple(move['pp'] for move in creature.moves))
+
+    def outcomes(self, state, actor, move_index):
+        """[(probability, next state)] after side actor uses one move, as attack_move would."""
+        user, target = state[actor], state[1 - actor]
+        health, attack, defense, pps = user
+        move = self.moves[actor][move_index]
+        if pps[move_index] <= 0:
+            return [(1.0, state)]
+        pps = pps[:move_index] + (pps[move_index] - 1,) + pps[move_index + 1:]
+        user = (health, attack, defense, pps)
+
+        if 'effect' in move:
+            if move['effect'] == 'defense_up':
+                user = (health, attack, defense + 2, pps)
+            elif move['effect'] == 'attack_down':
+                target = (target[0], max(1, target[1] - 2), target[2], target[3])
+            return [(1.0, (user, target) if actor == 0 else (target, user))]
+
+        effectiveness = 1.0
+        if move['type'] in CREATURE_TYPES:
+            if CREATURE_TYPES[move['type']]['strong_against'] == self.types[1 - actor]:
+                effectiveness = 2.0
+            elif CREATURE_TYPES[move['type']]['weak_against'] == self.types[1 - actor]:
+                effectiveness = 0.5
+        level = self.levels[actor]
+        damage = int((((2 * level / 5 + 2) * move['power'] * (attack / target[2])) / 50 + 2) * effectiveness)
+        damage = max(1, damage)
+
+        results = {}
+        for roll in DAMAGE_ROLLS:
+            rolled = int(damage * (0.85 + 0.15 * roll))
+            results[rolled] = results.get(rolled, 0) + 1 / len(DAMAGE_ROLLS)
+        outcomes = []
+        for rolled, probability in results.items():
+            hit = (max(0, target[0] - rolled), target[1], target[2], target[3])
+            outcomes.append((probability, (user, hit) if actor == 0 else (hit, user)))
+        return outcomes
+
+    def evaluate(self, state):
+        """Score from the AI's side (1): positive when it is ahead on health."""
+        return state[1][0] / self.max_health[1] - state[0][0] / self.max_health[0]
+
+    def value(self, state, actor, plies):
+        if state[0][0] == 0:
+            return BATTLE_WIN_SCORE + plies  # Sooner wins score higher
+        if state[1][0] == 0:
+            return -BATTLE_WIN_SCORE - plies
+        if plies == 0:
+            return self.evaluate(state)
+        key = (state, actor, plies)
+        cached = self.memo.get(key)
+        if cached is not None:
+            return cached
+        if not self.deterministic and time.perf_counter() > self.deadline:
+            raise SearchTimeout
+
+        values = [
+            sum(probability * self.value(after, 1 - actor, plies - 1)
+                for probability, after in self.outcomes(state, actor, i))
+            for i in range(len(self.moves[actor]))
+        ]
+        # The AI maximises; it assumes the player answers with their best move
+        result = max(values) if actor == 1 else min(values)
+        self.memo[key] = result
+        return result
+
+    def choose_move(self, creature, opponent):
+        """Index of the move creature should use against opponent."""
+        self.moves = (opponent.moves, creature.moves)
+        self.types = (opponent.type, creature.type)
+        self.levels = (opponent.level, creature.level)
+        self.max_health = (opponent.max_health, creature.max_health)
+        state = (self.state_of(opponent), self.state_of(creature))
+
+        best = 0
+        self.deadline = time.perf_counter() + BATTLE_AI_MS / 1000
+        plies = BATTLE_AI_PLIES if self.deterministic else 1
+        while True:
+            self.memo = {}
+            try:
+                values = [
+                    sum(probability * self.value(after, 0, plies - 1)
+                        for probability, after in self.outcomes(state, 1, i))
+                    for i in range(len(creature.moves))
+                ]
+            except SearchTimeout:
+                break
+            best = values.index(max(values))
+            if self.deterministic or plies >= BATTLE_AI_MAX_PLIES:
+                break
+            plies += 1
+        self.memo = {}
+        return best
+
+# Scheduling
+GAME_CLOCK = 'game'  # Game minutes; stands still in battles and dialogue
+PLAY_CLOCK = 'play'  # Milliseconds of play; also stands still in battles and dialogue
+REAL_CLOCK = 'real'  # Milliseconds, always running, for UI animation
+
+MESSAGE_LIFETIME_MS = 2500
+ANIM_FRAME_MS = 200  # Player bob animation
+RUN_STEP_MS = 200    # Steps closer together than this play the run cycle
+IDLE_AFTER_MS = 400  # The player goes back to idle this long after the last step
+NPC_FRAME_MS = 100
+
+
+class Timer:
+    __slots__ = ('when', 'callback', 'args', 'interval', 'cancelled')
+
+    def __init__(self, when, callback, args, interval):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.interval = interval
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler:
+    """Single place for everything that happens after a delay.
+
+    One heap per clock; scheduling is O(log n) and cancelling is O(1)
+    (cancelled timers are dropped when they reach the top of the heap).
+    """
+
+    def __init__(self):
+        self.now = {GAME_CLOCK: 0, PLAY_CLOCK: 0, REAL_CLOCK: 0}
+        self.queues = {clock: [] for clock in self.now}
+        self.sequence = 0
+        self.paused = False
+
+    def call_at(self, when, callback, *args, clock=PLAY_CLOCK, interval=None):
+        timer = Timer(when, callback, args, interval)
+        self.sequence += 1
+        heapq.heappush(self.queues[clock], (when, self.sequence, timer))
+        return timer
+
+    def call_later(self, delay, callback, *args, clock=PLAY_CLOCK):
+        return self.call_at(self.now[clock] + delay, callback, *args, clock=clock)
+
+    def call_every(self, interval, callback, *args, clock=PLAY_CLOCK):
+        return self.call_at(self.now[clock] + interval, callback, *args, clock=clock, interval=interval)
+
+    def advance(self, dt, game_minutes, paused):
+        """Move the clocks forward and run whatever came due, in time order."""
+        self.paused = paused
+        self.now[REAL_CLOCK] += dt
+        self.run_due(REAL_CLOCK)
+        if not paused:
+            self.now[PLAY_CLOCK] += dt
+            self.now[GAME_CLOCK] = game_minutes
+            self.run_due(PLAY_CLOCK)
+            self.run_due(GAME_CLOCK)
+
+    def run_due(self, clock):
+        queue = self.queues[clock]
+        now = self.now[clock]
+        while queue and queue[0][0] <= now:
+            when, _, timer = heapq.heappop(queue)
+            if timer.cancelled:
+                continue
+            if timer.interval:
+                # Repeat from the scheduled time, but never try to catch up more than one tick
+                timer.when = max(when + timer.interval, now)
+                self.sequence += 1
+                heapq.heappush(queue, (timer.when, self.sequence, timer))
+            timer.callback(*timer.args)
+
+    def pending(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+# Memory Accounting
+DEBUG_KEY = pygame.K_F3
+DEBUG_REFRESH_MS = 500     # The overlay's report is rebuilt this often, not every frame
+DEBUG_ASSET_ROWS = 8       # Asset folders listed in the overlay, largest first
+METRICS_EVERY_MS = 10000
+SIZE_SAMPLE = 64           # Entries measured per container when estimating its bytes
+
+
+class CacheStats:
+    """Hit, miss and eviction counts for one cache."""
+
+    __slots__ = ('hits', 'misses', 'evictions')
+
+    def __init__(self):
+        self.hits = self.misses = self.evictions = 0
+
+
+def lru_get(cache, key, stats):
+    """Look key up in an OrderedDict used as an LRU cache, or None."""
+    value = cache.get(key)
+    if value is None:
+        stats.misses += 1
+    else:
+        stats.hits += 1
+        cache.move_to_end(key)
+    return value
+
+
+def lru_put(cache, key, value, limit, stats):
+    """Store value, dropping the least recently used entries past limit."""
+    cache[key] = value
+    while len(cache) > limit:
+        cache.popitem(last=False)
+        stats.evictions += 1
+    return value
+
+
+def surface_bytes(surface):
+    return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+
+def item_bytes(item):
+    if isinstance(item, pygame.Surface):
+        return surface_bytes(item)
+    if isinstance(item, tuple):
+        return sys.getsizeof(item) + sum(item_bytes(part) for part in item)
+    if isinstance(item, Enum):
+        return 0  # Shared members
+    return sys.getsizeof(item)
+
+
+def estimate_bytes(container):
+    """Container size plus its entries, scaled up from the first SIZE_SAMPLE of them."""
+    if not container:
+        return sys.getsizeof(container)
+    items = container.items() if isinstance(container, dict) else ((item,) for item in container)
+    sample = [sum(item_bytes(part) for part in item) for _, item in zip(range(SIZE_SAMPLE), items)]
+    return sys.getsizeof(container) + len(container) * sum(sample) // len(sample)
+
+
+def asset_memory():
+    """{folder: {'surfaces', 'bytes'}} for images still alive from load_image."""
+    folders = {}
+    for path, surface in list(ASSET_SURFACES.items()):
+        folder = folders.setdefault(os.path.dirname(path), {'surfaces': 0, 'bytes': 0})
+        folder['surfaces'] += 1
+        folder['bytes'] += surface_bytes(surface)
+    return dict(sorted(folders.items(), key=lambda item: -item[1]['bytes']))
 
 # Game State
 class Game:
-    def __init__(self):
+    def __init__(self, seed=None, terrain='legacy', animate=True):
+        # Every random decision in a session comes from this seed so runs can be replayed
+        self.seed = seed if seed is not None else random.randrange(1000000)
+        self.rng = random.Random(self.seed)
+        self.world_cache = {}  # (x, y, dimension) -> generated Tile
+        self.edits = {}        # (x, y, dimension) -> Tile placed by set_tile; wins over world_cache
+        self.cache_stats = {'world_cache': CacheStats(), 'npc_cache': CacheStats()}
+        self.set_terrain(terrain)
+        self.input = InputRecorder()
+        self.scheduler = Scheduler()
+        self.scheduler.call_every(ANIM_FRAME_MS, self.next_anim_frame, clock=REAL_CLOCK)
+        if animate:
+            # The sprite animations are module-wide; games that are never drawn, like the
+            # server's one per player, must not each advance them again
+            self.scheduler.call_every(NPC_FRAME_MS, npc_sprites.next_frame, clock=REAL_CLOCK)
+            self.scheduler.call_every(player_animations.animation_speed * 1000, player_animations.next_frame,
+                                      clock=REAL_CLOCK)
         self.player_x = 0
         self.player_y = 0
+        self.last_step_ms = -IDLE_AFTER_MS  # Real time of the player's last step
         self.coins = 50
         self.health = 3
         self.score = 0
@@ -712,24 +1477,59 @@ class Game:
         self.active_npc = None
         self.show_npc_buttons = False
         self.dialogue_index = 0
+        self.dialogue_renderer = DialogueRenderer()
         self.anim_frame = 0
-        self.world_cache = {}
         self.npc_cache = {}
+        self.dirty_tiles = set()  # set_tile keys not yet written to the save journal
+        self.pathfinder = Pathfinder(self)
+        self.path = []  # Tiles still to walk for click-to-move
+        self.path_timer = None
+        self.wild = WildCreatures(self)
+        self.farm = Farm(self)
+        self.lighting = Lighting(self)
+        self.weather = Weather(self)
+        self.chunk_images = ChunkImages(self)
+        self.zoom = 0  # Index into ZOOM_LEVELS
+        self.warm_up = deque()  # (dimension, 'tiles' | 'light', cx, cy) still to prepare
+        self.warmed_dimensions = set()
+        self.portal_scan = None
+        self.exploration = Exploration()
+        self.explored_view = None
         self.game_time = 0  # 0-2400 minutes (0:00-24:00)
+        self.game_day = 0
         self.time_speed = 0.5  # Game minutes per frame
         
         # Creature collection system
         self.creatures = []  # Player's collected creatures
         self.current_creature = None  # Currently selected creature
+        self.box = CreatureBox()  # Caught creatures that do not fit in the party
+        self.show_box = False
+        self.box_page = 0
+        self.box_sort = 0  # Index into BOX_SORTS
+        self.box_type = None  # Creature type the box listing is filtered to
         self.wild_creature = None  # Current wild creature in battle
         self.in_battle = False  # Whether the player is in a battle
-        self.battle_messages = []  # Messages to display during battle
+        self.battle_messages = deque(maxlen=BATTLE_LOG_LIMIT)  # Messages to display during battle
+        self.battle_log_scroll = 0  # Messages scrolled back from the newest
+        self.battle_renderer = BattleRenderer()
+        self.battle_ai = BattleAI()
         self.battle_turn = 'player'  # 'player' or 'enemy'
         self.battle_won = False  # Track if player won the battle
 
-    def add_message(self, msg):
-        self.messages = self.messages[-1:] + [msg]
-        pygame.time.set_timer(pygame.USEREVENT + 1, 2500, loops=1)
+        self.show_debug = False
+        self.debug_report = None
+        self.debug_timer = None
+        self.metrics_path = None
+
+    def set_terrain(self, generator):
+        """Pick the terrain generator for this world, one of TERRAIN_GENERATORS."""
+        if generator == 'noise' and np is None:
+            print('Noise terrain needs NumPy; using the legacy generator')
+            generator = 'legacy'
+        self.terrain_generator = generator
+        self.terrain = Terrain(self.seed) if generator == 'noise' else None
+        # Generated tiles belong to the old generator; edits are kept
+        self.world_cache = {}
 
     def seeded_random(self, x, y, seed=0):
         n = math.sin(x * 12.9898 + y * 78.233 + seed) * 43758.5453
@@ -749,6 +1549,10 @@ class Game:
         minutes = int(self.game_time % 60)
         return hours, minutes
         
+    def get_total_minutes(self):
+        """Game minutes since the world began; never wraps, unlike game_time."""
+        return self.game_day * 1440 + self.game_time
+
     def get_light_level(self):
         """Calculate the current light level based on time of day."""
         hour = self.game_time / 60  # Convert to hours
@@ -762,164 +1566,124 @@ class Game:
         else:  # Night
             return 0.3
             
-    def get_biome(self, x, y):
-        if self.current_dimension != 'overworld':
-            if self.current_dimension == 'crystal_cave': return 'CRYSTAL'
-            if self.current_dimension == 'nether': return 'LAVA'
-            if self.current_dimension == 'mushroom': return 'MUSHROOM'
-
-        bx = x // 30
-        by = y // 30
-        r = self.seeded_random(bx, by, 12345)
-        if r < 0.10: return 'DESERT'
-        if r < 0.20: return 'SNOW'
-        if r < 0.35: return 'FOREST'
-        if r < 0.40: return 'LAVA'
-        if r < 0.50: return 'OCEAN'
-        if r < 0.60: return 'SWAMP'
-        if r < 0.70: return 'MOUNTAIN'
-        if r < 0.80: return 'JUNGLE'
-        if r < 0.85: return 'MUSHROOM'
-        if r < 0.90: return 'WASTELAND'
-        return 'GRASSLAND'
+    def get_biome(self, x, y, dimension=None):
+        dimension = dimension or self.current_dimension
+        if dimension != 'overworld':
+            if dimension == 'crystal_cave': return 'CRYSTAL'
+            if dimension == 'nether': return 'LAVA'
+            if dimension == 'mushroom': return 'MUSHROOM'
+        if self.terrain:
+            return self.terrain.biome(x, y)
+
+        return pick_from(LEGACY_BIOME_TABLE, self.seeded_random(x // 30, y // 30, 12345))
 
     def get_npc_type(self, x, y):
-        r = self.seeded_random(x, y, 7777)
-        if r < 0.17: return 'MERCHANT'
-        if r < 0.34: return 'EXPLORER'
-        if r < 0.51: return 'WIZARD'
-        if r < 0.68: return 'FARMER'
-        if r < 0.85: return 'KNIGHT'
-        return 'SCIENTIST'
+        return pick_from(NPC_SPAWN_TABLE, self.seeded_random(x, y, 7777))
 
-    def generate_tile(self, x, y, biome):
-        r = self.seeded_random(x, y)
-        if r < 0.008:
-            return Tile.NPC
-
-        match biome:
-            case 'GRASSLAND':
-                if r < 0.05: return Tile.WATER
-                if r < 0.15: return Tile.TREE
-                # Check for nearby paths to connect to
-                nearby_dirt = any([
-                    self.get_tile(x+dx, y+dy) == Tile.DIRT 
-                    for dx, dy in [(-1,0), (1,0), (0,-1), (0,1)]
-                    if self.get_biome(x+dx, y+dy) == 'GRASSLAND'
-                ])
-                
-                # Higher chance for dirt if near existing dirt (creates paths)
-                if nearby_dirt and r < 0.5: return Tile.DIRT
-                
-                # Base chances for tiles
-                if r < 0.20: return Tile.FLOWER
-                if r < 0.40: return Tile.DIRT  # Increased chance for dirt
-                if r < 0.42: return Tile.TREASURE
-                if r < 0.27: return Tile.QUESTION_BLOCK
-                if r < 0.285: return Tile.PORTAL
-                if r < 0.295: return Tile.KEY_ITEM
-                return Tile.GRASS
-            case 'DESERT':
-                if r < 0.15: return Tile.CACTUS
-                if r < 0.20: return Tile.STONE
-                if r < 0.22: return Tile.TREASURE
-                if r < 0.24: return Tile.QUESTION_BLOCK
-                if r < 0.255: return Tile.PORTAL
-                return Tile.SAND
-            case 'SNOW':
-                if r < 0.10: return Tile.WATER
-                if r < 0.20: return Tile.ICE
-                if r < 0.30: return Tile.STONE
-                if r < 0.32: return Tile.TREASURE
-                if r < 0.34: return Tile.QUESTION_BLOCK
-                if r < 0.355: return Tile.PORTAL
-                return Tile.SNOW
-            case 'FOREST':
-                if r < 0.35: return Tile.TREE
-                if r < 0.40: return Tile.FLOWER
-                if r < 0.43: return Tile.TREASURE
-                if r < 0.45: return Tile.QUESTION_BLOCK
-                if r < 0.465: return Tile.PORTAL
-                return Tile.GRASS
-            case 'LAVA':
-                if r < 0.25: return Tile.LAVA
-                if r < 0.40: return Tile.OBSIDIAN
-                if r < 0.45: return Tile.STONE
-                if r < 0.47: return Tile.TREASURE
-                if r < 0.49: return Tile.CRYSTAL
-                if r < 0.505: return Tile.PORTAL
-                return Tile.BRICK
-            case 'OCEAN':
-                if r < 0.70: return Tile.WATER
-                if r < 0.75: return Tile.LILY_PAD
-                if r < 0.78: return Tile.CORAL
-                if r < 0.80: return Tile.TREASURE
-                if r < 0.815: return Tile.PORTAL
-                return Tile.SAND
-            case 'MUSHROOM_FOREST':
-                if r < 0.20: return Tile.MUSHROOM_RED
-                if r < 0.30: return Tile.MUSHROOM_BLUE
-                if r < 0.50: return Tile.TREE_MUSHROOM
-                if r < 0.60: return Tile.BUSH
-                if r < 0.65: return Tile.TREE_PINE
-                if r < 0.70: return Tile.TREE_OAK
-                if r < 0.72: return Tile.CRATE
-                if r < 0.74: return Tile.SIGN
-                if r < 0.76: return Tile.STONE_BLOCK
-                if r < 0.77: return Tile.TREASURE
-                if r < 0.785: return Tile.PORTAL
-                return Tile.GRASS
-            case 'CRYSTAL':
-                if r < 0.30: return Tile.DARK_STONE
-                if r < 0.40: return Tile.CRYSTAL
-                if r < 0.43: return Tile.TREASURE
-                if r < 0.445: return Tile.PORTAL
-                return Tile.STONE
-            case _:
-                return Tile.GRASS
-
-    def get_tile(self, x, y):
-        key = (x, y)
-        if key in self.world_cache:
-            return self.world_cache[key]
+    def get_tile(self, x, y, dimension=None):
+        """Tile at x, y in dimension, the current one by default; edits win over generated tiles."""
+        key = (x, y, dimension or self.current_dimension)
+        stats = self.cache_stats['world_cache']
+        edited = self.edits.get(key)
+        if edited is not None:
+            stats.hits += 1
+            return edited
+        tile = self.world_cache.get(key)
+        if tile is not None:
+            stats.hits += 1
+            return tile
+        stats.misses += 1
         
-        # Get the biome without triggering tile generation
-        biome = self.get_biome(x, y)
-    
-        # Generate the tile
-        tile = self.generate_tile(x, y, biome)
-        self.world_cache[key] = tile
-        return tile
+        if self.terrain:
+            tile = self.terrain.tile(key[2], x, y)
+            self.world_cache[key] = tile
+            return tile
+
+        tiles = self.generate_chunk(key[2], x // CHUNK_SIZE, y // CHUNK_SIZE)
+        return tiles[(y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE]
+
+    def generate_chunk(self, dimension, cx, cy):
+        """Generate one legacy chunk into world_cache and return its tiles in row-major order.
+
+        Dirt is rolled once for the chunk plus a one-tile margin, and paths
+        grow from that grid, so each tile costs at most two seeded_random
+        calls instead of generate_tile's six. Tiles come out the same as
+        generate_tile's.
+        """
+        x0, y0 = cx * CHUNK_SIZE, cy * CHUNK_SIZE
+        side = CHUNK_SIZE + 2
+        seeded_random, seed = self.seeded_random, self.seed
+        dirt = [seeded_random(x0 + col - 1, y0 + row - 1, seed) < 0.2 for row in range(side) for col in range(side)]
+        tiles = []
+        for row in range(CHUNK_SIZE):
+            y = y0 + row
+            for col in range(CHUNK_SIZE):
+                x = x0 + col
+                i = (row + 1) * side + col + 1
+                if not self.is_valid_position(x, y):
+                    tile = Tile.WATER
+                elif self.get_biome(x, y, dimension) != 'GRASSLAND':
+                    tile = Tile.GRASS
+                elif dirt[i] or (seeded_random(x, y, seed + 1) < 0.5
+                                 and (dirt[i - 1] or dirt[i + 1] or dirt[i - side] or dirt[i + side])):
+                    tile = Tile.DIRT
+                else:
+                    tile = Tile.GRASS
+                self.world_cache[(x, y, dimension)] = tile
+                tiles.append(tile)
+        return tiles
     
     def generate_tile(self, x, y, biome):
         # First check if we're in a valid position
         if not self.is_valid_position(x, y):
             return Tile.WATER  # or whatever default tile for out of bounds
             
-        # Check for nearby dirt tiles without causing recursion
-        nearby_dirt = False
-        for dx, dy in [(-1,0), (1,0), (0,-1), (0,1)]:
-            nx, ny = x + dx, y + dy
-            if (nx, ny) in self.world_cache and self.world_cache[(nx, ny)] == Tile.DIRT:
-                nearby_dirt = True
-                break
-        
         # Rest of your tile generation logic...
         if biome == 'GRASSLAND':
-            if random.random() < 0.2 or (nearby_dirt and random.random() < 0.5):
+            if self.seeded_random(x, y, self.seed) < 0.2:
+                return Tile.DIRT
+            # Paths grow from dirt a neighbour is seeded with, not from whatever happens to be cached,
+            # so tiles come out the same in any order
+            if self.seeded_random(x, y, self.seed + 1) < 0.5 and any(
+                    self.seeded_random(x + dx, y + dy, self.seed) < 0.2
+                    for dx, dy in ((-1, 0), (1, 0), (0, -1), (0, 1))):
                 return Tile.DIRT
             # Rest of your grassland generation...
         
         # Default fallback
         return Tile.GRASS
 
+    def refill_tile(self, x, y, biome):
+        """Ground left behind when a pickup at x, y is taken."""
+        if self.terrain is not None:
+            return self.terrain.base_tile(self.current_dimension, x, y)
+        return self.generate_tile(x, y, biome)
+
+    def get_chunk_tiles(self, cx, cy, dimension=None):
+        """Tile values of one chunk in row-major order, one byte per tile."""
+        x0, y0 = cx * CHUNK_SIZE, cy * CHUNK_SIZE
+        dimension = dimension or self.current_dimension
+        get_tile = self.get_tile
+        return bytes(
+            get_tile(x0 + col, y0 + row, dimension).value
+            for row in range(CHUNK_SIZE) for col in range(CHUNK_SIZE)
+        )
+
     def set_tile(self, x, y, tile):
         key = (x, y, self.current_dimension)
-        self.world_cache[key] = tile
+        self.edits[key] = tile
+        self.dirty_tiles.add(key)
+        self.pathfinder.tile_changed(x, y, tile, key[2])
+        self.lighting.tile_changed(x, y, key[2])
+        self.chunk_images.tile_changed(x, y)
 
     def get_npc(self, x, y):
         key = (x, y, self.current_dimension)
-        if key not in self.npc_cache and self.get_tile(x, y) == Tile.NPC:
+        stats = self.cache_stats['npc_cache']
+        if key in self.npc_cache:
+            stats.hits += 1
+        elif self.get_tile(x, y) == Tile.NPC:
+            stats.misses += 1
             npc_type = self.get_npc_type(x, y)
             self.npc_cache[key] = {**NPC_TYPES[npc_type], 'type': npc_type}
         return self.npc_cache.get(key)
@@ -936,13 +1700,7 @@ class Game:
             self.score += 500
 
         if tile == Tile.PORTAL:
-            r = self.seeded_random(nx, ny, 9999)
-            if r < 0.33:
-                self.travel_dimension('crystal_cave', 'Crystal Cave')
-            elif r < 0.66:
-                self.travel_dimension('nether', 'The Nether')
-            else:
-                self.travel_dimension('mushroom', 'Mushroom Realm')
+            self.travel_dimension(*self.portal_destination(nx, ny))
             return
 
         if tile == Tile.NPC:
@@ -955,17 +1713,18 @@ class Game:
                 self.active_npc = {'npc': npc, 'x': nx, 'y': ny}
             return
 
-        if tile in WALKABLE:
+        if WALKABLE_TABLE[tile.value]:
             self.player_x, self.player_y = nx, ny
+            self.step_taken(dx)
             if tile == Tile.TREASURE:
                 self.coins += 10
                 self.score += 100
-                self.set_tile(nx, ny, self.generate_tile(nx, ny, biome))
+                self.set_tile(nx, ny, self.refill_tile(nx, ny, biome))
                 self.add_message("+10 Coins!")
             elif tile == Tile.CRYSTAL:
                 self.coins += 25
                 self.score += 250
-                self.set_tile(nx, ny, self.generate_tile(nx, ny, biome))
+                self.set_tile(nx, ny, self.refill_tile(nx, ny, biome))
                 self.add_message("+25 Coins!")
             elif tile == Tile.QUESTION_BLOCK:
                 r = self.seeded_random(nx, ny, 777)
@@ -980,37 +1739,192 @@ class Game:
             elif tile == Tile.KEY_ITEM:
                 self.has_key = True
                 self.score += 200
-                self.set_tile(nx, ny, self.generate_tile(nx, ny, biome))
+                self.set_tile(nx, ny, self.refill_tile(nx, ny, biome))
                 self.add_message("Got Key!")
         elif tile in [Tile.WATER, Tile.LAVA]:
             self.health = max(0, self.health - 1)
             self.add_message("Burning!" if tile == Tile.LAVA else "Ouch!")
 
+    def step_taken(self, dx):
+        """Walk, or run when steps come quickly, facing the way the player moved."""
+        now = self.scheduler.now[REAL_CLOCK]
+        running = now - self.last_step_ms < RUN_STEP_MS
+        self.last_step_ms = now
+        player_animations.play('run' if running else 'walk', dx)
+
     def travel_dimension(self, dim, name):
         self.current_dimension = dim
         self.player_x = self.player_y = 0
         self.score += 3000
         self.add_message(f"Entered {name}!")
 
-    def handle_trade(self, cost, reward):
-        if self.coins >= cost:
-            self.coins -= cost
-            if reward == 'health':
-                self.health = min(3, self.health + 1)
-                self.add_message("+1 Health!")
-            elif reward == 'map':
-                new_biomes = [b for b in BIOMES.keys() if b not in self.biomes_discovered]
-                if new_biomes:
-                    revealed = random.sample(new_biomes, min(3, len(new_biomes)))
-                    self.biomes_discovered.extend(revealed)
-                    self.add_message(f"Revealed {len(revealed)} biomes!")
-            elif reward == 'teleport':
-                self.add_message("Teleport unlocked!")
-            elif reward == 'coins':
-                self.coins += 15
-                self.add_message("+15 Coins!")
-            elif reward == 'protection':
-                self.add_message("Protection charm!")
+    def explore_view(self):
+        """Mark everything in the viewport as explored when the view has changed."""
+        view = (self.current_dimension, *self.viewport_rect())
+        if view != self.explored_view:
+            self.explored_view = view
+            self.exploration.mark(*view)
+
+    def portal_destination(self, x, y):
+        """(dimension, name) that the portal tile at (x, y) leads to."""
+        r = self.seeded_random(x, y, 9999)
+        if r < 0.33:
+            return 'crystal_cave', 'Crystal Cave'
+        if r < 0.66:
+            return 'nether', 'The Nether'
+        return 'mushroom', 'Mushroom Realm'
+
+    def watch_portals(self):
+        """Queue warm-up of the spawn area behind every portal in the viewport."""
+        position = (self.player_x, self.player_y, self.current_dimension)
+        if position == self.portal_scan:
+            return
+        self.portal_scan = position
+        start_x = self.player_x - VIEWPORT_WIDTH // 2
+        start_y = self.player_y - VIEWPORT_HEIGHT // 2
+        for wy in range(start_y, start_y + VIEWPORT_HEIGHT):
+            for wx in range(start_x, start_x + VIEWPORT_WIDTH):
+                if self.get_tile(wx, wy) != Tile.PORTAL:
+                    continue
+                dim = self.portal_destination(wx, wy)[0]
+                if dim != self.current_dimension and dim not in self.warmed_dimensions:
+                    self.warmed_dimensions.add(dim)
+                    self.queue_warm_up(dim)
+
+    def queue_warm_up(self, dim):
+        # travel_dimension always lands at (0, 0): warm the chunks the creature
+        # spawner and pathfinder read first, then the lighting of the viewport
+        for cy in range(-CREATURE_SPAWN_RADIUS, CREATURE_SPAWN_RADIUS + 1):
+            for cx in range(-CREATURE_SPAWN_RADIUS, CREATURE_SPAWN_RADIUS + 1):
+                self.warm_up.append((dim, 'tiles', cx, cy))
+        for cy in range(-1, 1):
+            for cx in range(-1, 1):
+                self.warm_up.append((dim, 'light', cx, cy))
+
+    def warm_up_step(self):
+        """Prepare one queued destination chunk; one per frame keeps replays deterministic."""
+        if not self.warm_up:
+            return
+        dim, kind, cx, cy = self.warm_up.popleft()
+        if kind == 'light':
+            self.lighting.chunk_light(dim, cx, cy)
+            return
+        self.pathfinder.bitmap(dim, cx, cy)
+        if self.zoom:
+            # Chunk images draw through draw_tile, which reads the current dimension;
+            # every cache it fills is keyed by dimension, so switching briefly is safe
+            previous = self.current_dimension
+            self.current_dimension = dim
+            try:
+                self.chunk_images.get(cx, cy, ZOOM_LEVELS[self.zoom])
+            finally:
+                self.current_dimension = previous
+
+    def update(self, dt):
+        """Advance the world by one frame of dt milliseconds."""
+        paused = self.in_battle or bool(self.active_npc)
+        if not paused:
+            self.game_time += self.time_speed
+            if self.game_time >= 1440:  # 1440 minutes in a day
+                self.game_time -= 1440
+                self.game_day += 1
+        self.scheduler.advance(dt, self.get_total_minutes(), paused)
+        self.update_wild_creatures()
+        self.weather.update(dt)
+        self.watch_portals()
+        self.warm_up_step()
+        self.explore_view()
+        if self.scheduler.now[REAL_CLOCK] - self.last_step_ms > IDLE_AFTER_MS:
+            player_animations.play('idle')
+
+    def next_anim_frame(self):
+        self.anim_frame = (self.anim_frame + 1) % 4
+
+    def update_wild_creatures(self):
+        """Move roaming creatures and start a battle when one reaches the player."""
+        if self.in_battle or self.active_npc:
+            return
+        self.wild.spawn_around(self.player_x, self.player_y)
+        i = self.wild.update()
+        if i is not None and self.creatures:
+            ctype = CREATURE_TYPE_KEYS[self.wild.types[i]]
+            self.wild.remove(i)
+            self.path = []
+            self.start_battle(Creature(ctype, self.rng))
+
+    def farm_action(self):
+        """Harvest the crop under the player, or plant one on open ground."""
+        x, y = self.player_x, self.player_y
+        now = self.get_total_minutes()
+        harvested = self.farm.harvest(x, y, now)
+        if harvested:
+            ctype, state = harvested
+            crop = CROP_TYPES[ctype]
+            if state == CROP_RIPE:
+                self.coins += crop['value']
+                self.score += crop['value'] * 10
+                self.add_message(f"Harvested {crop['name']}! +{crop['value']} Coins")
+            elif state == CROP_WITHERED:
+                self.add_message(f"The {crop['name']} had withered.")
+            else:
+                self.add_message(f"Pulled up unripe {crop['name']}.")
+            return
+
+        if self.get_tile(x, y) not in PLANTABLE:
+            self.add_message("Can't plant here!")
+            return
+        if self.coins < SEED_COST:
+            self.add_message("Not enough coins for seeds!")
+            return
+        ctype = BIOME_CROPS.get(self.get_biome(x, y), 'WHEAT')
+        self.coins -= SEED_COST
+        self.set_tile(x, y, Tile.FARMLAND)
+        self.farm.plant(x, y, ctype, now)
+        self.add_message(f"Planted {CROP_TYPES[ctype]['name']}")
+
+    def walk_to(self, x, y):
+        """Start walking towards a tile along the shortest known path."""
+        path = self.pathfinder.find_path((self.player_x, self.player_y), (x, y))
+        if path is None:
+            self.add_message("Can't get there!")
+            path = []
+        self.path = path
+        if self.path_timer:
+            self.path_timer.cancel()
+        self.path_timer = self.scheduler.call_every(PATH_STEP_MS, self.follow_path) if path else None
+
+    def follow_path(self):
+        """Take the next step of a click-to-move path; runs every PATH_STEP_MS of play."""
+        if not self.path:
+            self.path_timer.cancel()
+            self.path_timer = None
+            return
+        nx, ny = self.path.pop(0)
+        dimension = self.current_dimension
+        self.move_player(nx - self.player_x, ny - self.player_y)
+        # Anything that stops the step (damage, NPC, portal) ends the walk
+        if (self.player_x, self.player_y) != (nx, ny) or self.current_dimension != dimension:
+            self.path = []
+
+    def handle_trade(self, cost, reward):
+        if self.coins >= cost:
+            self.coins -= cost
+            if reward == 'health':
+                self.health = min(3, self.health + 1)
+                self.add_message("+1 Health!")
+            elif reward == 'map':
+                new_biomes = [b for b in BIOMES.keys() if b not in self.biomes_discovered]
+                if new_biomes:
+                    revealed = self.rng.sample(new_biomes, min(3, len(new_biomes)))
+                    self.biomes_discovered.extend(revealed)
+                    self.add_message(f"Revealed {len(revealed)} biomes!")
+            elif reward == 'teleport':
+                self.add_message("Teleport unlocked!")
+            elif reward == 'coins':
+                self.coins += 15
+                self.add_message("+15 Coins!")
+            elif reward == 'protection':
+                self.add_message("Protection charm!")
                 self.score += 500
             elif reward == 'upgrade':
                 self.add_message("Equipment upgraded!")
@@ -1024,6 +1938,10 @@ class Game:
         center = rect.center
 
         if is_player:
+            frame = player_animations.get_current_frame()
+            if frame:
+                surface.blit(frame, rect)
+                return
             jump = -2 if self.anim_frame % 4 < 2 else 0
             pygame.draw.rect(surface, (220, 50, 50), rect.inflate(-4, -4))
             pygame.draw.rect(surface, (180, 0, 0), rect.inflate(-4, -4), 3)
@@ -1037,152 +1955,28 @@ class Game:
             if npc:
                 pygame.draw.rect(surface, (34, 197, 94), rect)
                 pygame.draw.rect(surface, (22, 163, 74), rect, 2)
-                icon = font.render(npc['icon'], True, WHITE)
+                icon = NPC_ICONS.get(npc['type']) or font.render(npc['icon'], True, WHITE)
                 surface.blit(icon, icon.get_rect(center=center))
             return
 
         # Try to get tile image first, fall back to colors
         tile_image = tile_sprites.get_tile_image(tile, x + y)  # Use position for variant
         if tile_image:
-            # Scale image to fit the tile
-            scaled_image = pygame.transform.scale(tile_image, (TILE_SIZE, TILE_SIZE))
-            surface.blit(scaled_image, rect)
+            surface.blit(tile_image, rect)
             return
             
         # Default tile drawing (fallback if no image found)
-        colors = {
-            Tile.GRASS: (34, 197, 94),
-            Tile.DIRT: (146, 64, 14),
-            Tile.STONE: (156, 163, 175),
-            Tile.WATER: (59, 130, 246),
-            Tile.TREE: (34, 197, 94),
-            Tile.FLOWER: (34, 197, 94),
-            Tile.TREASURE: (34, 197, 94),
-            Tile.KEY_ITEM: (34, 197, 94),
-            Tile.BRICK: (217, 119, 6),
-            Tile.QUESTION_BLOCK: (251, 191, 36),
-            Tile.ICE: (219, 234, 254),
-            Tile.SNOW: (240, 249, 255),
-            Tile.SAND: (254, 243, 199),
-            Tile.CACTUS: (254, 243, 199),
-            Tile.LAVA: (249, 115, 22),
-            Tile.OBSIDIAN: (31, 41, 55),
-            Tile.PORTAL: (139, 92, 246),
-            Tile.CRYSTAL: (34, 197, 94),
-            Tile.MUSHROOM_BLOCK: (220, 38, 38),  # Red mushroom block
-            Tile.LILY_PAD: (59, 130, 246),
-            # Mushroom Forest Tiles - Colors are fallbacks if images fail to load
-            Tile.MUSHROOM_RED: (220, 38, 38),      # Red
-            Tile.MUSHROOM_BLUE: (59, 130, 246),    # Blue
-            Tile.BUSH: (22, 101, 52),              # Dark green
-            Tile.CRATE: (146, 64, 14),             # Brown
-            Tile.SIGN: (253, 230, 138),            # Light yellow
-            Tile.STONE_BLOCK: (107, 114, 128),     # Gray
-            Tile.TREE_PINE: (22, 101, 52),         # Dark green
-            Tile.TREE_OAK: (34, 197, 94),          # Green
-            Tile.TREE_MUSHROOM: (147, 51, 234),    # Purple
-            Tile.VINE: (34, 197, 94),
-            Tile.DARK_STONE: (55, 65, 81),
-            Tile.CORAL: (59, 130, 246),
-            Tile.TREE_PINE: (22, 101, 52),  # Dark green
-            Tile.TREE_OAK: (22, 101, 52),  # Dark green
-            Tile.TREE_MUSHROOM: (147, 51, 234),  # Purple
-        }
-
-        color = colors.get(tile, (100, 100, 100))
-        pygame.draw.rect(surface, color, rect)
-        if tile in [Tile.BRICK, Tile.OBSIDIAN, Tile.STONE, Tile.DARK_STONE]:
-            pygame.draw.rect(surface, (0, 0, 0), rect, 2)
-
-        # Icons
-        icons = {
-            Tile.TREE: '🌲', 
-            Tile.FLOWER: '🌸', 
-            Tile.TREASURE: '$', 
-            Tile.KEY_ITEM: '🔑',
-            Tile.QUESTION_BLOCK: '?', 
-            Tile.CACTUS: '🌵', 
-            Tile.LAVA: '🔥', 
-            Tile.PORTAL: '🌀',
-            Tile.CRYSTAL: '💎', 
-            Tile.MUSHROOM_BLOCK: '🍄', 
-            Tile.LILY_PAD: '🪷',
-            Tile.VINE: '🌿', 
-            Tile.CORAL: '🪸',
-            # Mushroom Forest icons
-            Tile.MUSHROOM_RED: '🍄',
-            Tile.MUSHROOM_BLUE: '🍄',
-            Tile.BUSH: '🌿',
-            Tile.CRATE: '📦',
-            Tile.SIGN: '📜',
-            Tile.STONE_BLOCK: '🪨',
-            Tile.TREE_PINE: '🌲',
-            Tile.TREE_OAK: '🌳',
-            Tile.TREE_MUSHROOM: '🍄'
-        }
-        if tile in icons:
-            text = font.render(icons[tile], True, WHITE if tile not in [Tile.TREASURE, Tile.QUESTION_BLOCK] else BLACK)
-            surface.blit(text, text.get_rect(center=center))
-
-        if tile == Tile.QUESTION_BLOCK:
-            pygame.draw.rect(surface, (217, 119, 6), rect, 3)
+        value = tile.value
+        pygame.draw.rect(surface, TILE_COLORS[value], rect)
+        icon = TILE_ICONS[value]
+        if icon:
+            surface.blit(icon, icon.get_rect(center=center))
+        border = TILE_BORDERS[value]
+        if border:
+            pygame.draw.rect(surface, border[0], rect, border[1])
 
     def draw_battle_screen(self):
-        # Draw battle background
-        screen.fill((200, 230, 250))  # Light blue background
-        
-        # Draw player creature (right side)
-        player_creature = self.creatures[self.current_creature]
-        pygame.draw.rect(screen, (150, 200, 150), (SCREEN_WIDTH - 200, 200, 150, 100))
-        self.draw_text(player_creature.name, SCREEN_WIDTH - 180, 210, (0, 0, 0))
-        self.draw_text(f"Lv{player_creature.level}", SCREEN_WIDTH - 100, 210, (0, 0, 0))
-        
-        # Draw health bar
-        health_ratio = player_creature.health / player_creature.max_health
-        health_color = (0, 255, 0) if health_ratio > 0.5 else (255, 200, 0) if health_ratio > 0.2 else (255, 0, 0)
-        pygame.draw.rect(screen, (100, 100, 100), (SCREEN_WIDTH - 180, 230, 120, 15))
-        pygame.draw.rect(screen, health_color, (SCREEN_WIDTH - 180, 230, int(120 * health_ratio), 15))
-        self.draw_text(f"HP: {player_creature.health}/{player_creature.max_health}", SCREEN_WIDTH - 175, 230, (255, 255, 255))
-        
-        # Draw wild creature (left side)
-        pygame.draw.rect(screen, (200, 150, 150), (50, 50, 150, 100))
-        self.draw_text(f"Wild {self.wild_creature.name}", 70, 60, (0, 0, 0))
-        self.draw_text(f"Lv{self.wild_creature.level}", 150, 60, (0, 0, 0))
-        
-        # Draw health bar for wild creature
-        wild_health_ratio = self.wild_creature.health / self.wild_creature.max_health
-        wild_health_color = (0, 255, 0) if wild_health_ratio > 0.5 else (255, 200, 0) if wild_health_ratio > 0.2 else (255, 0, 0)
-        pygame.draw.rect(screen, (100, 100, 100), (70, 80, 120, 10))
-        pygame.draw.rect(screen, wild_health_color, (70, 80, int(120 * wild_health_ratio), 10))
-        
-        # Draw HUD
-        pygame.draw.rect(screen, (50, 50, 50), (0, SCREEN_HEIGHT - 40, SCREEN_WIDTH, 40))
-        screen.blit(font.render(f'Coins: {self.coins}', True, YELLOW), (10, SCREEN_HEIGHT - 35))
-        screen.blit(font.render(f'Health: {self.health}', True, RED), (150, SCREEN_HEIGHT - 35))
-        screen.blit(font.render(f'Score: {self.score}', True, WHITE), (300, SCREEN_HEIGHT - 35))
-        
-        # Show active creature if any
-        if self.creatures and not self.in_battle:
-            active = self.creatures[0]  # Show first creature in party
-            health_ratio = active.health / active.max_health
-            health_color = (0, 255, 0) if health_ratio > 0.5 else (255, 200, 0) if health_ratio > 0.2 else (255, 0, 0)
-            
-            # Draw creature info
-            pygame.draw.rect(screen, (80, 80, 80), (SCREEN_WIDTH - 200, SCREEN_HEIGHT - 60, 180, 50))
-            self.draw_text(f"{active.name} Lv{active.level}", SCREEN_WIDTH - 190, SCREEN_HEIGHT - 55, (255, 255, 255))
-            
-            # Health bar
-            pygame.draw.rect(screen, (50, 50, 50), (SCREEN_WIDTH - 190, SCREEN_HEIGHT - 35, 160, 10))
-            pygame.draw.rect(screen, health_color, (SCREEN_WIDTH - 190, SCREEN_HEIGHT - 35, int(160 * health_ratio), 10))
-            self.draw_text(f"HP: {active.health}/{active.max_health}", SCREEN_WIDTH - 185, SCREEN_HEIGHT - 35, (255, 255, 255))
-
-        # Draw move options
-        for i, move in enumerate(player_creature.moves[:2]):  # Show first 2 moves
-            move_text = f"{i+1}. {move['name']} ({move['pp']}/{move['pp']})"
-            self.draw_text(move_text, 20 + (i % 2) * 200, SCREEN_HEIGHT - 60 + (i // 2) * 30, (0, 0, 0))
-        
-        # Add more options (Run, Bag, etc.)
-        self.draw_text("R. Run", SCREEN_WIDTH - 150, SCREEN_HEIGHT - 60, (0, 0, 0))
+        self.battle_renderer.draw(self)
 
     def start_battle(self, wild_creature=None):
         if not self.creatures:
@@ -1192,28 +1986,15 @@ class Game:
         if wild_creature is None:
             # Random wild creature based on biome
             biome = self.get_biome(self.player_x, self.player_y)
-            creature_types = {
-                'GRASSLAND': 'GRASS',
-                'DESERT': 'GROUND',
-                'SNOW': 'WATER',
-                'FOREST': 'GRASS',
-                'LAVA': 'FIRE',
-                'OCEAN': 'WATER',
-                'SWAMP': 'GRASS',
-                'MOUNTAIN': 'GROUND',
-                'JUNGLE': 'GRASS',
-                'MUSHROOM': 'GRASS',
-                'CRYSTAL': 'ELECTRIC',
-                'WASTELAND': 'GROUND'
-            }
-            ctype = creature_types.get(biome, random.choice(list(CREATURE_TYPES.keys())))
-            self.wild_creature = Creature(ctype)
+            ctype = BIOME_CREATURE_TYPES.get(biome, self.rng.choice(list(CREATURE_TYPES.keys())))
+            self.wild_creature = Creature(ctype, self.rng)
         else:
             self.wild_creature = wild_creature
             
         self.in_battle = True
         self.battle_turn = 'player'
-        self.battle_messages = [f"A wild {self.wild_creature.name} appeared!"]
+        self.battle_messages = deque([f"A wild {self.wild_creature.name} appeared!"], maxlen=BATTLE_LOG_LIMIT)
+        self.battle_log_scroll = 0
         
         # If no creature is selected, use the first one
         if self.current_creature is None:
@@ -1222,15 +2003,20 @@ class Game:
         return True
     
     def end_battle(self, player_won):
+        message = None
         if player_won:
             exp_gain = self.wild_creature.level * 5
             message = self.creatures[self.current_creature].gain_experience(exp_gain)
             self.battle_messages.append(f"{self.creatures[self.current_creature].name} gained {exp_gain} EXP!")
             
-            # Chance to catch the wild creature if player has less than 6
-            if len(self.creatures) < 6 and random.random() < 0.3:  # 30% catch rate
-                self.creatures.append(self.wild_creature)
-                self.battle_messages.append(f"You caught {self.wild_creature.name}!")
+            # Chance to catch the wild creature; it goes to the box when the party is full
+            if self.rng.random() < 0.3:  # 30% catch rate
+                if len(self.creatures) < PARTY_SIZE:
+                    self.creatures.append(self.wild_creature)
+                    self.battle_messages.append(f"You caught {self.wild_creature.name}!")
+                else:
+                    self.box.add(self.wild_creature)
+                    self.battle_messages.append(f"You caught {self.wild_creature.name}! Sent to the box.")
                 
         self.in_battle = False
         self.wild_creature = None
@@ -1245,10 +2031,19 @@ class Game:
             self.in_battle = False
             self.wild_creature = None
             return True
-            
+
+        # Scroll the message log
+        if key == pygame.K_UP:
+            self.battle_log_scroll = min(self.battle_log_scroll + 1, max(0, len(self.battle_messages) - BATTLE_LOG_LINES))
+            return True
+        if key == pygame.K_DOWN:
+            self.battle_log_scroll = max(0, self.battle_log_scroll - 1)
+            return True
+
         if key == pygame.K_1 and len(self.creatures[self.current_creature].moves) > 0:
             # Use first move
-            message = self.creatures[self.current_creature].attack_move(0, self.wild_creature)
+            self.battle_log_scroll = 0  # New messages jump back to the bottom of the log
+            message = self.creatures[self.current_creature].attack_move(0, self.wild_creature, self.rng)
             self.battle_messages.append(message)
             
             if self.wild_creature.is_fainted():
@@ -1257,8 +2052,8 @@ class Game:
                 return True
                 
             # Enemy's turn
-            enemy_move = random.randint(0, len(self.wild_creature.moves) - 1)
-            message = self.wild_creature.attack_move(enemy_move, self.creatures[self.current_creature])
+            enemy_move = self.battle_ai.choose_move(self.wild_creature, self.creatures[self.current_creature])
+            message = self.wild_creature.attack_move(enemy_move, self.creatures[self.current_creature], self.rng)
             self.battle_messages.append(f"Wild {self.wild_creature.name} {message}")
             
             if self.creatures[self.current_creature].is_fainted():
@@ -1279,15 +2074,20 @@ class Game:
         return True
     
     def add_message(self, text):
-        """Add a message to the message log"""
+        """Add a message to the message log; it expires after MESSAGE_LIFETIME_MS of play"""
         self.messages.append(text)
         if len(self.messages) > 5:  # Keep only the last 5 messages
             self.messages.pop(0)
+        self.scheduler.call_later(MESSAGE_LIFETIME_MS, self.expire_message, text)
+
+    def expire_message(self, text):
+        if text in self.messages:
+            self.messages.remove(text)
 
     def handle_event(self, event):
         if event.type == pygame.KEYDOWN:
             if self.in_battle:
-                self.handle_battle_input(event)
+                self.handle_battle_input(event.key)
             elif event.key == pygame.K_ESCAPE:
                 return False
             elif event.key == pygame.K_m:
@@ -1327,9 +2127,13 @@ class Game:
                     self.handle_battle_input(event.key)
 
     def draw(self):
-        # Update time
-        self.game_time = (self.game_time + self.time_speed) % 1440  # 1440 minutes in a day
-        
+        # If in battle, draw battle screen instead of the world; it covers the whole screen
+        if self.in_battle:
+            self.draw_battle_screen()
+            if self.show_debug:
+                self.draw_debug()
+            return
+
         # Get time of day
         hours, minutes = self.get_time_of_day()
         light_level = self.get_light_level()
@@ -1340,28 +2144,18 @@ class Game:
         # Darken the background based on time of day
         bg_color = [int(c * light_level) for c in bg_color]
         screen.fill(tuple(bg_color))
-        
-        # If in battle, draw battle screen instead of the world
-        if self.in_battle:
-            self.draw_battle_screen()
-            return
 
         # Viewport
-        start_x = self.player_x - VIEWPORT_WIDTH // 2
-        start_y = self.player_y - VIEWPORT_HEIGHT // 2
+        start_x, start_y, _, _ = self.viewport_rect()
         viewport_surface = pygame.Surface((SCREEN_WIDTH, VIEWPORT_HEIGHT * TILE_SIZE))
         viewport_surface.fill((50, 50, 50))
 
-        for row in range(VIEWPORT_HEIGHT):
-            for col in range(VIEWPORT_WIDTH):
-                wx = start_x + col
-                wy = start_y + row
-                tile = self.get_tile(wx, wy)
-                is_player = (wx == self.player_x and wy == self.player_y)
-                self.draw_tile(viewport_surface, tile, col, row, is_player)
+        if self.zoom:
+            self.draw_zoomed(viewport_surface, start_x, start_y)
+        else:
+            self.draw_world(viewport_surface, start_x, start_y, light_level)
 
         screen.blit(viewport_surface, (0, 80))
-
         # HUD
         hud_y = 10
         pygame.draw.rect(screen, BLACK, (0, 0, SCREEN_WIDTH, 70), border_radius=10)
@@ -1385,93 +2179,74 @@ class Game:
         if self.show_map:
             self.draw_map()
 
+        if self.show_box:
+            self.draw_box()
+
+        if self.show_debug:
+            self.draw_debug()
+
+    def draw_world(self, viewport_surface, start_x, start_y, light_level):
+        for row in range(VIEWPORT_HEIGHT):
+            for col in range(VIEWPORT_WIDTH):
+                wx = start_x + col
+                wy = start_y + row
+                self.draw_tile(viewport_surface, self.get_tile(wx, wy), col, row, False)
+        self.farm.draw(viewport_surface, start_x, start_y, self.get_total_minutes())
+        self.wild.draw(viewport_surface, start_x, start_y)
+        # The knight stands on the tile and crops under it, and weather and darkness fall over it
+        self.draw_tile(viewport_surface, None, self.player_x - start_x, self.player_y - start_y, True)
+        self.weather.draw(viewport_surface)
+        self.lighting.draw(viewport_surface, start_x, start_y, light_level)
+
+    def draw_zoomed(self, viewport_surface, start_x, start_y):
+        tile_size = ZOOM_LEVELS[self.zoom]
+        self.chunk_images.draw(viewport_surface, start_x, start_y, tile_size)
+        marker = pygame.Rect((self.player_x - start_x) * tile_size, (self.player_y - start_y) * tile_size,
+                             tile_size, tile_size)
+        pygame.draw.rect(viewport_surface, (220, 50, 50), marker.inflate(4, 4))
+
+    def viewport_rect(self):
+        """(start_x, start_y, width, height) in tiles of the area shown at the current zoom."""
+        tile_size = ZOOM_LEVELS[self.zoom]
+        width = SCREEN_WIDTH // tile_size
+        height = VIEWPORT_HEIGHT * TILE_SIZE // tile_size
+        return self.player_x - width // 2, self.player_y - height // 2, width, height
+
+    def change_zoom(self, step):
+        zoom = max(0, min(len(ZOOM_LEVELS) - 1, self.zoom + step))
+        if zoom != self.zoom:
+            self.zoom = zoom
+            width, height = self.viewport_rect()[2:]
+            self.add_message(f"Zoom: {width}x{height} tiles")
+
     def draw_text(self, text, x, y, color):
         rendered = font.render(text, True, color)
         screen.blit(rendered, (x, y))
 
     def draw_npc_dialogue(self):
+        renderer = self.dialogue_renderer
         # Semi-transparent overlay
-        overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-        overlay.fill((0, 0, 0, 180))
-        screen.blit(overlay, (0, 0))
+        screen.blit(renderer.get_overlay(), (0, 0))
 
-        # Dialog box with modern design
-        dialog_height = 180 if not hasattr(self, 'show_npc_buttons') or not self.show_npc_buttons else 250
+        show_buttons = bool(self.show_npc_buttons)
+        npc_type, npc = renderer.resolve_npc(self.active_npc)
+        panel = renderer.get_panel(npc_type, npc, self.dialogue_index, show_buttons)
+        dialog_height = panel.get_height() - 5
         dialog_rect = pygame.Rect(50, SCREEN_HEIGHT - dialog_height - 20, SCREEN_WIDTH - 100, dialog_height)
-        
-        # Shadow effect
-        shadow_rect = dialog_rect.move(5, 5)
-        pygame.draw.rect(screen, (0, 0, 0, 100), shadow_rect, border_radius=12)
-        
-        # Main dialog box
-        pygame.draw.rect(screen, (40, 40, 60), dialog_rect, border_radius=10)
-        pygame.draw.rect(screen, (80, 80, 120), dialog_rect, 2, border_radius=10)
+        screen.blit(panel, dialog_rect.topleft)
 
-        # NPC info
-        npc_type = self.active_npc
-        npc = None
-        
-        # Find NPC data from NPC_TYPES
-        for npc_key, npc_data in NPC_TYPES.items():
-            if npc_key == npc_type or (isinstance(npc_data, dict) and npc_data.get('name', '').upper() == npc_type):
-                npc = npc_data if isinstance(npc_data, dict) else {'name': str(npc_type), 'color': (200, 200, 200)}
-                break
-        
-        if npc is None:
-            # Default NPC data if not found
-            npc = {'name': str(npc_type), 'color': (200, 200, 200), 'icon': '?'}
-        
-        # Portrait area
+        # Portrait follows the NPC's idle animation, so only the scaled frames are cached
         portrait_rect = pygame.Rect(dialog_rect.x + 15, dialog_rect.y + 15, 80, 80)
-        pygame.draw.rect(screen, (30, 30, 40), portrait_rect, border_radius=8)
-        pygame.draw.rect(screen, (100, 100, 150), portrait_rect, 2, border_radius=8)
-        
-        # Get NPC sprite - use the 'type' key from the npc dictionary
-        npc_sprite = npc_sprites.get(npc_type['type'] if isinstance(npc_type, dict) and 'type' in npc_type else str(npc_type))
-        
-        # Draw NPC sprite if available, otherwise use icon
+        npc_sprite = npc_sprites.get(npc_type)
         if npc_sprite:
-            # Scale the sprite to fit the portrait
-            npc_sprite = pygame.transform.scale(npc_sprite, (70, 70))
-            screen.blit(npc_sprite, (portrait_rect.x + 5, portrait_rect.y + 5))
+            screen.blit(renderer.get_portrait(npc_sprite), (portrait_rect.x + 5, portrait_rect.y + 5))
         else:
             # Fallback to text icon
             icon = font.render(npc.get('icon', '?'), True, npc.get('color', (255, 255, 255)))
             screen.blit(icon, (portrait_rect.x + 25, portrait_rect.y + 20))
-        
-        # Name plate
-        name_bg = pygame.Rect(portrait_rect.right + 10, portrait_rect.y, 200, 25)
-        pygame.draw.rect(screen, npc.get('color', (200, 200, 200)), name_bg, border_radius=4)
-        name_surf = pixel_font.render(npc.get('name', 'Unknown'), True, (240, 240, 240))
-        screen.blit(name_surf, (name_bg.x + 10, name_bg.y + 5))
-        
-        # Dialog text with word wrapping
-        dialogue = npc.get('dialogue', ["..."])
-        if not dialogue:  # In case dialogue is empty
-            dialogue = ["..."]
-            
-        text = dialogue[self.dialogue_index % len(dialogue)]
-        words = text.split(' ')
-        lines = []
-        current_line = []
-        
-        for word in words:
-            test_line = ' '.join(current_line + [word])
-            if small_font.size(test_line)[0] < dialog_rect.width - 150:
-                current_line.append(word)
-            else:
-                lines.append(' '.join(current_line))
-                current_line = [word]
-        if current_line:
-            lines.append(' '.join(current_line))
-        
-        # Draw each line of text
-        for i, line in enumerate(lines):
-            text_surf = small_font.render(line, True, (240, 240, 240))
-            screen.blit(text_surf, (portrait_rect.right + 15, dialog_rect.y + 50 + i * 20))
-        
+
         # Draw buttons if in interaction mode
-        if hasattr(self, 'show_npc_buttons') and self.show_npc_buttons:
+        if show_buttons:
             btn_y = dialog_rect.y + 120
             
             # Different buttons based on NPC type
@@ -1487,7 +2262,8 @@ class Game:
         else:
             # Animated continue prompt
             prompt_alpha = 128 + int(127 * (math.sin(pygame.time.get_ticks() * 0.003) + 1) / 2)
-            prompt_surf = small_font.render('Press SPACE to continue...', True, (200, 200, 200, prompt_alpha))
+            prompt_surf = renderer.get_prompt()
+            prompt_surf.set_alpha(prompt_alpha)
             prompt_rect = prompt_surf.get_rect(bottomright=(dialog_rect.right - 15, dialog_rect.bottom - 15))
             screen.blit(prompt_surf, prompt_rect)
     
@@ -1525,7 +2301,7 @@ class Game:
                 "Different biomes have different creatures.",
                 "Collect coins to buy useful items."
             ]
-            self.add_message(random.choice(hints))
+            self.add_message(self.rng.choice(hints))
         else:
             self.add_message("Not enough coins!")
     
@@ -1537,11 +2313,65 @@ class Game:
         btn = pygame.Rect(x, y, 400, 40)
         pygame.draw.rect(screen, color, btn, border_radius=8)
         self.draw_text(text, x + 20, y + 10, WHITE)
-        mouse = pygame.mouse.get_pos()
-        click = pygame.mouse.get_pressed()
+        mouse, click = self.input.get_mouse()
         if btn.collidepoint(mouse) and click[0]:
             action()
 
+    def box_listing(self):
+        return self.box.list(BOX_SORTS[self.box_sort], self.box_type, page=self.box_page)
+
+    def handle_box_input(self, key):
+        """Page, sort and filter the box; number keys swap a listed creature into the party."""
+        slots, total = self.box_listing()
+        pages = max(1, (total + BOX_PAGE_SIZE - 1) // BOX_PAGE_SIZE)
+        if key in (pygame.K_c, pygame.K_ESCAPE):
+            self.show_box = False
+        elif key in (pygame.K_RIGHT, pygame.K_d):
+            self.box_page = min(self.box_page + 1, pages - 1)
+        elif key in (pygame.K_LEFT, pygame.K_a):
+            self.box_page = max(self.box_page - 1, 0)
+        elif key == pygame.K_TAB:
+            self.box_sort = (self.box_sort + 1) % len(BOX_SORTS)
+            self.box_page = 0
+        elif key == pygame.K_t:
+            types = [None] + CREATURE_TYPE_KEYS
+            self.box_type = types[(types.index(self.box_type) + 1) % len(types)]
+            self.box_page = 0
+        elif pygame.K_0 <= key <= pygame.K_9:
+            row = (key - pygame.K_0 - 1) % 10  # 1-9, then 0 for the tenth row
+            if row < len(slots):
+                if len(self.creatures) < PARTY_SIZE:
+                    creature = self.box.remove(slots[row])
+                    self.creatures.append(creature)
+                else:
+                    party_index = self.current_creature or 0
+                    self.box.swap(slots[row], self.creatures, party_index)
+                    creature = self.creatures[party_index]
+                if self.current_creature is None:
+                    self.current_creature = 0
+                self.add_message(f"{creature.name} joined the party!")
+
+    def draw_box(self):
+        overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+        overlay.set_alpha(200)
+        overlay.fill(BLACK)
+        screen.blit(overlay, (0, 0))
+
+        box = pygame.Rect(50, 90, SCREEN_WIDTH - 100, 420)
+        pygame.draw.rect(screen, (30, 30, 30), box, border_radius=15)
+
+        slots, total = self.box_listing()
+        pages = max(1, (total + BOX_PAGE_SIZE - 1) // BOX_PAGE_SIZE)
+        filter_name = CREATURE_TYPES[self.box_type]['name'] if self.box_type else 'All'
+        self.draw_text(f"Box: {total} creatures ({filter_name}, by {BOX_SORTS[self.box_sort]})", 80, 105, WHITE)
+        y = 140
+        for row, slot in enumerate(slots):
+            creature = self.box.creatures[slot]
+            color = CREATURE_TYPES[creature.type]['color']
+            self.draw_text(f"{(row + 1) % 10}. {creature.name} Lv{creature.level}", 80, y, color)
+            y += 30
+        self.draw_text(f"Page {self.box_page + 1}/{pages}  <- ->  TAB sort  T type", 80, box.bottom - 40, (180, 180, 180))
+
     def draw_map(self):
         overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
         overlay.set_alpha(200)
@@ -1560,55 +2390,1807 @@ class Game:
             self.draw_text(f"{biome['icon']} {name}", 80, y, color)
             y += 30
 
-# Main Game
-game = Game()
+        # Explored area around the player; unexplored tiles stay covered
+        tile_size = ZOOM_LEVELS[-1]
+        area = pygame.Surface((200, 200))
+        tiles = area.get_width() // tile_size
+        start_x, start_y = self.player_x - tiles // 2, self.player_y - tiles // 2
+        self.chunk_images.draw(area, start_x, start_y, tile_size)
+        self.exploration.draw_fog(area, self.current_dimension, start_x, start_y, tile_size)
+        pygame.draw.rect(area, (220, 50, 50), ((tiles // 2) * tile_size, (tiles // 2) * tile_size, tile_size, tile_size))
+        screen.blit(area, (box.right - 230, 160))
+        explored = self.exploration.percent_explored(self.current_dimension, start_x, start_y, tiles, tiles)
+        self.draw_text(f"Explored nearby: {explored:.0f}%", box.right - 230, 370, WHITE)
 
-# Animation timer
-anim_timer = 0
+    def memory_report(self):
+        """Entries, estimated bytes and hit/miss/eviction counts per cache, and asset surface memory."""
+        caches = {
+            'world_cache': (self.world_cache, self.cache_stats['world_cache']),
+            'edits': (self.edits, None),
+            'npc_cache': (self.npc_cache, self.cache_stats['npc_cache']),
+            'chunk_images': (self.chunk_images.images, self.chunk_images.stats),
+            'light_sources': (self.lighting.sources, self.lighting.source_stats),
+            'light_chunks': (self.lighting.chunks, self.lighting.chunk_stats),
+            'path_bitmaps': (self.pathfinder.bitmaps, self.pathfinder.stats['bitmaps']),
+            'path_borders': (self.pathfinder.borders, self.pathfinder.stats['borders']),
+            'path_graphs': (self.pathfinder.graphs, self.pathfinder.stats['graphs']),
+            'explored_chunks': (self.exploration.chunks, None),
+            'crops': (self.farm.crops, None),
+            'boxed_creatures': (self.box.stored(), None),
+            'battle_messages': (self.battle_messages, None),
+            'dialogue_panels': (self.dialogue_renderer.panels, None),
+            'battle_layers': (self.battle_renderer.layers, None),
+        }
+        if self.terrain:
+            caches['terrain_chunks'] = (self.terrain.chunks, self.terrain.chunk_stats)
+            caches['terrain_lattice'] = (self.terrain.lattice, self.terrain.lattice_stats)
 
-running = True
-while running:
-    dt = clock.tick(60)
-    dt_seconds = dt / 1000.0  # Convert to seconds for consistent timing
-    anim_timer += dt
-    
-    # Update NPC animations
-    npc_sprites.update(dt_seconds)
-    
-    if anim_timer > 200:
-        game.anim_frame = (game.anim_frame + 1) % 4
-        anim_timer = 0
-
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        if event.type == pygame.USEREVENT + 1:
-            game.messages.pop(0)
-        if event.type == pygame.KEYDOWN:
-            if game.active_npc:
-                if event.key == pygame.K_ESCAPE:
-                    game.active_npc = None
+        report = {'caches': {}, 'timers': self.scheduler.pending()}
+        for name, (cache, stats) in caches.items():
+            entry = {'entries': len(cache), 'bytes': estimate_bytes(cache)}
+            if stats:
+                lookups = stats.hits + stats.misses
+                entry.update(hits=stats.hits, misses=stats.misses, evictions=stats.evictions,
+                             hit_rate=stats.hits / lookups if lookups else None)
+            report['caches'][name] = entry
+        report['assets'] = asset_memory()
+        report['cache_bytes'] = sum(entry['bytes'] for entry in report['caches'].values())
+        report['asset_bytes'] = sum(folder['bytes'] for folder in report['assets'].values())
+        return report
+
+    def toggle_debug(self):
+        self.show_debug = not self.show_debug
+        if self.debug_timer:
+            self.debug_timer.cancel()
+            self.debug_timer = None
+        if self.show_debug:
+            self.refresh_debug()
+            self.debug_timer = self.scheduler.call_every(DEBUG_REFRESH_MS, self.refresh_debug, clock=REAL_CLOCK)
+
+    def refresh_debug(self):
+        report = self.memory_report()
+        lines = [f"Caches {report['cache_bytes'] / 2 ** 20:.1f} MB, assets {report['asset_bytes'] / 2 ** 20:.1f} MB,"
+                 f" {report['timers']} timers"]
+        for name, cache in report['caches'].items():
+            line = f"{name}: {cache['entries']} entries, {cache['bytes'] / 1024:.0f} KB"
+            if cache.get('hit_rate') is not None:
+                line += f", {cache['hit_rate']:.1%} hits, {cache['evictions']} evicted"
+            lines.append(line)
+        for folder, usage in list(report['assets'].items())[:DEBUG_ASSET_ROWS]:
+            lines.append(f"{folder}: {usage['surfaces']} images, {usage['bytes'] / 2 ** 20:.1f} MB")
+        self.debug_report = [pixel_font.render(line, True, WHITE) for line in lines]
+
+    def draw_debug(self):
+        if not self.debug_report:
+            return
+        width = max(line.get_width() for line in self.debug_report) + 20
+        panel = pygame.Surface((width, len(self.debug_report) * 14 + 10), pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 190))
+        for i, line in enumerate(self.debug_report):
+            panel.blit(line, (10, 5 + i * 14))
+        screen.blit(panel, (10, 80))
+
+    def start_metrics(self, path, every_ms=METRICS_EVERY_MS):
+        """Append memory_report to path as one JSON line every every_ms of real time."""
+        self.metrics_path = path
+        self.scheduler.call_every(every_ms, self.dump_metrics, clock=REAL_CLOCK)
+
+    def dump_metrics(self):
+        record = {'ticks': pygame.time.get_ticks(), 'dimension': self.current_dimension, **self.memory_report()}
+        with open(self.metrics_path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def state_checksum(self):
+        """Hash the simulation state so two runs can be compared cheaply."""
+        state = {
+            'player': [self.player_x, self.player_y, self.current_dimension],
+            'stats': [self.coins, self.health, self.score, self.has_key, self.game_day, self.game_time],
+            'crops': sorted([*key, *crop] for key, crop in self.farm.crops.items()),
+            'biomes': self.biomes_discovered,
+            'npcs_met': sorted(str(npc) for npc in self.npcs_met),
+            'messages': self.messages,
+            'creatures': [creature.__dict__ for creature in self.creatures],
+            'box': [creature.__dict__ for creature in self.box.stored()],
+            'edits': sorted((repr(key), tile.value) for key, tile in self.edits.items()),
+        }
+        return hashlib.sha256(json.dumps(state, sort_keys=True).encode('utf-8')).hexdigest()
+
+# Save System
+DIMENSIONS = ['overworld', 'crystal_cave', 'nether', 'mushroom']
+TILE_BY_VALUE = {tile.value: tile for tile in Tile}
+
+AUTOSAVE_INTERVAL = 30000  # ms between autosaves
+JOURNAL_COMPACT_RECORDS = 50000  # Fold the journal into the base file past this many edits
+
+# One edited tile: x, y, dimension index, tile value
+TILE_RECORD = struct.Struct('<iiBB')
+
+
+class SaveManager:
+    """Persists game state without blocking the frame loop.
+
+    Only tiles changed through set_tile are stored; generated terrain is
+    rebuilt from the seed. Edits are appended to a journal by a background
+    thread and periodically folded into a compacted base file.
+    """
+
+    def __init__(self, save_dir='saves'):
+        self.save_dir = save_dir
+        self.meta_path = os.path.join(save_dir, 'game.json')
+        self.base_path = os.path.join(save_dir, 'tiles.base')
+        self.journal_path = os.path.join(save_dir, 'tiles.journal')
+        self.explored_path = os.path.join(save_dir, 'explored.bin')
+        self.journal_records = 0
+        self.last_save = 0
+        self.jobs = queue.Queue()
+        self.worker = threading.Thread(target=self.run, name='autosave', daemon=True)
+        self.worker.start()
+
+    def snapshot(self, game):
+        """Copy the state to save. Runs on the main thread, so keep it cheap."""
+        edits = [(key, game.edits[key]) for key in game.dirty_tiles]
+        game.dirty_tiles.clear()
+        explored = None
+        if game.exploration.dirty:
+            explored = dict(game.exploration.chunks)
+            game.exploration.dirty = False
+        meta = {
+            'seed': game.seed,
+            'terrain_generator': game.terrain_generator,
+            'player_x': game.player_x,
+            'player_y': game.player_y,
+            'coins': game.coins,
+            'health': game.health,
+            'score': game.score,
+            'has_key': game.has_key,
+            'current_dimension': game.current_dimension,
+            'biomes_discovered': list(game.biomes_discovered),
+            'npcs_met': sorted(str(npc) for npc in game.npcs_met),
+            'game_time': game.game_time,
+            'game_day': game.game_day,
+            # Converted to JSON on the writer thread; this is just a shallow copy
+            'crops': list(game.farm.crops.items()),
+            'creatures': [
+                {**creature.__dict__, 'moves': [dict(move) for move in creature.moves]}
+                for creature in game.creatures
+            ],
+            'current_creature': game.current_creature,
+            # Copied like the party, since a swap with the party can change a boxed creature mid-write
+            'box': [
+                {**creature.__dict__, 'moves': [dict(move) for move in creature.moves]}
+                for creature in game.box.stored()
+            ],
+        }
+        return meta, edits, explored
+
+    def save(self, game):
+        """Queue a snapshot for the background writer."""
+        self.jobs.put(self.snapshot(game))
+        self.last_save = pygame.time.get_ticks()
+
+    def autosave(self, game):
+        if pygame.time.get_ticks() - self.last_save >= AUTOSAVE_INTERVAL:
+            self.save(game)
+
+    def close(self, game):
+        """Write a final snapshot and wait for the writer to finish."""
+        self.save(game)
+        self.jobs.put(None)
+        self.worker.join()
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            try:
+                self.write(*job)
+            except OSError as e:
+                print(f'Autosave failed: {e}')
+
+    def write(self, meta, edits, explored):
+        os.makedirs(self.save_dir, exist_ok=True)
+        meta = {
+            **meta,
+            'crops': [[*key, *crop] for key, crop in meta['crops']],
+        }
+        if edits:
+            with open(self.journal_path, 'ab') as journal:
+                journal.write(b''.join(
+                    TILE_RECORD.pack(x, y, DIMENSIONS.index(dim), tile.value)
+                    for (x, y, dim), tile in edits
+                ))
+            self.journal_records += len(edits)
+        if explored is not None:
+            self.replace_file(self.explored_path, Exploration.to_bytes(explored))
+        self.replace_file(self.meta_path, json.dumps(meta).encode('utf-8'))
+        if self.journal_records >= JOURNAL_COMPACT_RECORDS:
+            self.compact()
+
+    def replace_file(self, path, data):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def read_records(self, path):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return b''
+        # Drop a record torn by a crash mid-append
+        return data[:len(data) - len(data) % TILE_RECORD.size]
+
+    def compact(self):
+        """Merge base and journal so each edited tile appears only once."""
+        edits = {}
+        for data in (self.read_records(self.base_path), self.read_records(self.journal_path)):
+            for x, y, dim, value in TILE_RECORD.iter_unpack(data):
+                edits[(x, y, dim)] = value
+        self.replace_file(self.base_path, b''.join(
+            TILE_RECORD.pack(x, y, dim, value) for (x, y, dim), value in edits.items()
+        ))
+        open(self.journal_path, 'wb').close()
+        self.journal_records = 0
+
+    def load(self, game):
+        """Restore a previous session into game. Returns False if there is no save."""
+        try:
+            with open(self.meta_path, 'rb') as f:
+                meta = json.loads(f.read())
+        except (FileNotFoundError, ValueError):
+            return False
+
+        journal = self.read_records(self.journal_path)
+        self.journal_records = len(journal) // TILE_RECORD.size
+        edits = game.edits
+        for data in (self.read_records(self.base_path), journal):
+            for x, y, dim, value in TILE_RECORD.iter_unpack(data):
+                edits[(x, y, DIMENSIONS[dim])] = TILE_BY_VALUE[value]
+
+        creatures = []
+        for data in meta.pop('creatures'):
+            creature = Creature.__new__(Creature)
+            creature.__dict__.update(data)
+            creatures.append(creature)
+        game.creatures = creatures
+        for data in meta.pop('box', ()):
+            creature = Creature.__new__(Creature)
+            creature.__dict__.update(data)
+            game.box.add(creature)
+        game.npcs_met = set(meta.pop('npcs_met'))
+        try:
+            with open(self.explored_path, 'rb') as f:
+                game.exploration.load_bytes(f.read())
+        except (FileNotFoundError, zlib.error):
+            pass
+        for x, y, dimension, planted_at, ctype in meta.pop('crops', ()):
+            game.farm.add((x, y, dimension), planted_at, ctype)
+        terrain = meta.pop('terrain_generator', 'legacy')  # Saves from before noise terrain
+        for name, value in meta.items():
+            setattr(game, name, value)
+        # Everything seeded from the world seed follows the save, not the session that loaded it
+        game.rng = random.Random(game.seed)
+        game.wild.rng = random.Random(game.seed + 1)
+        game.weather.seed = game.seed
+        game.weather.start(None)  # The next update restarts the biome's weather from the new seed
+        game.set_terrain(terrain)
+        return True
+
+# Pathfinding
+# Tiles a path may cross. NPCs and portals are walkable but stop movement, so they only work as goals.
+PASSABLE_TABLE = bytes(
+    0 if value in (Tile.NPC.value, Tile.PORTAL.value) else walkable
+    for value, walkable in enumerate(WALKABLE_TABLE)
+)
+PATH_STEP_MS = 120           # Time between steps when walking a path
+PATH_MAX_EXPANSIONS = 20000  # Abstract nodes searched before giving up
+PATH_CHUNK_MARGIN = 4        # Chunks a search may stray outside the box around start and goal
+PATH_CACHE_CHUNKS = 4096     # Bitmaps, graphs and each side's borders kept per cache
+
+
+class Pathfinder:
+    """Hierarchical (HPA*-style) pathfinding over per-chunk walkability bitmaps.
+
+    Each chunk keeps a bitmap of passable tiles. Runs of open tiles along
+    a chunk border become entrances, and the entrances inside a chunk are
+    linked by precomputed local paths. Long searches run on that small
+    graph and are stitched back together from the stored local paths.
+    set_tile reports changes through tile_changed, which only throws away
+    the data of the chunk (and borders) the tile belongs to.
+    """
+
+    NEIGHBOURS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+    def __init__(self, game):
+        self.game = game
+        self.bitmaps = OrderedDict()  # (dimension, cx, cy) -> bytearray, 1 = passable
+        self.borders = OrderedDict()  # (dimension, cx, cy, 'E' | 'S') -> [(inside tile, outside tile)]
+        self.graphs = OrderedDict()   # (dimension, cx, cy) -> (local paths, links across borders)
+        self.stats = {name: CacheStats() for name in ('bitmaps', 'borders', 'graphs')}
+
+    def bitmap(self, dimension, cx, cy):
+        key = (dimension, cx, cy)
+        bitmap = lru_get(self.bitmaps, key, self.stats['bitmaps'])
+        if bitmap is None:
+            bitmap = lru_put(self.bitmaps, key,
+                             bytearray(self.game.get_chunk_tiles(cx, cy, dimension).translate(PASSABLE_TABLE)),
+                             PATH_CACHE_CHUNKS, self.stats['bitmaps'])
+        return bitmap
+
+    def is_passable(self, x, y, dimension=None):
+        bitmap = self.bitmap(dimension or self.game.current_dimension, x // CHUNK_SIZE, y // CHUNK_SIZE)
+        return bitmap[(y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE]
+
+    def tile_changed(self, x, y, tile, dimension=None):
+        dimension = dimension or self.game.current_dimension
+        cx, cy = x // CHUNK_SIZE, y // CHUNK_SIZE
+        bitmap = self.bitmaps.get((dimension, cx, cy))
+        if bitmap is not None:
+            i = (y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE
+            passable = PASSABLE_TABLE[tile.value]
+            if bitmap[i] == passable:
+                return
+            bitmap[i] = passable
+        # Without the bitmap there is no telling what changed, and borders and
+        # graphs can outlive the bitmap they were built from
+        self.graphs.pop((dimension, cx, cy), None)
+        lx, ly = x % CHUNK_SIZE, y % CHUNK_SIZE
+        # Border tiles also change the entrances shared with the neighbouring chunk
+        if lx == CHUNK_SIZE - 1:
+            self.borders.pop((dimension, cx, cy, 'E'), None)
+            self.graphs.pop((dimension, cx + 1, cy), None)
+        if lx == 0:
+            self.borders.pop((dimension, cx - 1, cy, 'E'), None)
+            self.graphs.pop((dimension, cx - 1, cy), None)
+        if ly == CHUNK_SIZE - 1:
+            self.borders.pop((dimension, cx, cy, 'S'), None)
+            self.graphs.pop((dimension, cx, cy + 1), None)
+        if ly == 0:
+            self.borders.pop((dimension, cx, cy - 1, 'S'), None)
+            self.graphs.pop((dimension, cx, cy - 1), None)
+
+    def border(self, dimension, cx, cy, side):
+        """Entrances between a chunk and its east ('E') or south ('S') neighbour."""
+        key = (dimension, cx, cy, side)
+        entrances = lru_get(self.borders, key, self.stats['borders'])
+        if entrances is not None:
+            return entrances
+        inside = self.bitmap(dimension, cx, cy)
+        x0, y0 = cx * CHUNK_SIZE, cy * CHUNK_SIZE
+        last = CHUNK_SIZE - 1
+        if side == 'E':
+            outside = self.bitmap(dimension, cx + 1, cy)
+            open_cells = [inside[i * CHUNK_SIZE + last] and outside[i * CHUNK_SIZE] for i in range(CHUNK_SIZE)]
+            pair = lambda i: ((x0 + last, y0 + i), (x0 + CHUNK_SIZE, y0 + i))
+        else:
+            outside = self.bitmap(dimension, cx, cy + 1)
+            open_cells = [inside[last * CHUNK_SIZE + i] and outside[i] for i in range(CHUNK_SIZE)]
+            pair = lambda i: ((x0 + i, y0 + last), (x0 + i, y0 + CHUNK_SIZE))
+
+        entrances = []
+        i = 0
+        while i < CHUNK_SIZE:
+            if not open_cells[i]:
+                i += 1
+                continue
+            start = i
+            while i < CHUNK_SIZE and open_cells[i]:
+                i += 1
+            # Short openings get one entrance in the middle, long ones one at each end
+            if i - start <= 5:
+                entrances.append(pair((start + i - 1) // 2))
             else:
-                if event.key in (pygame.K_w, pygame.K_UP):
-                    game.move_player(0, -1)
-                if event.key in (pygame.K_s, pygame.K_DOWN):
-                    game.move_player(0, 1)
-                if event.key in (pygame.K_a, pygame.K_LEFT):
-                    game.move_player(-1, 0)
-                if event.key in (pygame.K_d, pygame.K_RIGHT):
-                    game.move_player(1, 0)
-                if event.key == pygame.K_m:
-                    game.show_map = not game.show_map
-                if event.key == pygame.K_e and game.current_dimension != 'overworld':
-                    game.current_dimension = 'overworld'
-                    game.add_message("Returned to Overworld!")
-
-    # Close map with click outside
-    if game.show_map and pygame.mouse.get_pressed()[0]:
-        game.show_map = False
-
-    game.draw()
-    pygame.display.flip()
-
-pygame.quit()
-sys.exit()
\ No newline at end of file
+                entrances.append(pair(start))
+                entrances.append(pair(i - 1))
+        return lru_put(self.borders, key, entrances, 2 * PATH_CACHE_CHUNKS, self.stats['borders'])
+
+    def local_paths(self, dimension, cx, cy, source, targets):
+        """BFS inside one chunk from source; returns {target: steps after source}."""
+        bitmap = self.bitmap(dimension, cx, cy)
+        x0, y0 = cx * CHUNK_SIZE, cy * CHUNK_SIZE
+        start = (source[1] - y0) * CHUNK_SIZE + source[0] - x0
+        wanted = {(ty - y0) * CHUNK_SIZE + tx - x0: (tx, ty) for tx, ty in targets}
+        parents = {start: None}
+        frontier = [start]
+        found = {}
+        while frontier and len(found) < len(wanted):
+            next_frontier = []
+            for i in frontier:
+                if i in wanted:
+                    found[i] = wanted[i]
+                lx, ly = i % CHUNK_SIZE, i // CHUNK_SIZE
+                for dx, dy in self.NEIGHBOURS:
+                    nx, ny = lx + dx, ly + dy
+                    if 0 <= nx < CHUNK_SIZE and 0 <= ny < CHUNK_SIZE:
+                        j = ny * CHUNK_SIZE + nx
+                        # Targets may be impassable goals such as NPCs
+                        if j not in parents and (bitmap[j] or j in wanted):
+                            parents[j] = i
+                            if bitmap[j]:
+                                next_frontier.append(j)
+                            elif j in wanted:
+                                found[j] = wanted[j]
+            frontier = next_frontier
+
+        paths = {}
+        for i, tile in found.items():
+            steps = []
+            while i != start:
+                steps.append((x0 + i % CHUNK_SIZE, y0 + i // CHUNK_SIZE))
+                i = parents[i]
+            steps.reverse()
+            paths[tile] = steps
+        return paths
+
+    def graph(self, dimension, cx, cy):
+        """Local paths between a chunk's entrances and the links leaving it."""
+        key = (dimension, cx, cy)
+        graph = lru_get(self.graphs, key, self.stats['graphs'])
+        if graph is not None:
+            return graph
+        links = {}
+        for inside, outside in self.border(dimension, cx, cy, 'E') + self.border(dimension, cx, cy, 'S'):
+            links.setdefault(inside, []).append(outside)
+        for outside, inside in self.border(dimension, cx - 1, cy, 'E') + self.border(dimension, cx, cy - 1, 'S'):
+            links.setdefault(inside, []).append(outside)
+        nodes = list(links)
+        paths = {node: self.local_paths(dimension, cx, cy, node, nodes) for node in nodes}
+        return lru_put(self.graphs, key, (paths, links), PATH_CACHE_CHUNKS, self.stats['graphs'])
+
+    def find_path(self, start, goal):
+        """List of tiles leading from start (exclusive) to goal, or None."""
+        if start == goal:
+            return []
+        dimension = self.game.current_dimension
+        if not (self.game.is_valid_position(*start) and self.game.is_valid_position(*goal)):
+            return None
+        # Water, lava and walls can never be reached; NPCs and portals can, as goals
+        if not WALKABLE_TABLE[self.game.get_tile(*goal, dimension).value]:
+            return None
+        start_chunk = (start[0] // CHUNK_SIZE, start[1] // CHUNK_SIZE)
+        goal_chunk = (goal[0] // CHUNK_SIZE, goal[1] // CHUNK_SIZE)
+        if start_chunk == goal_chunk:
+            direct = self.local_paths(dimension, *start_chunk, start, [goal]).get(goal)
+            if direct is not None:
+                return direct
+
+        # Connect start and goal to the entrances of their own chunks
+        start_paths, _ = self.graph(dimension, *start_chunk)
+        exits = self.local_paths(dimension, *start_chunk, start, list(start_paths))
+        goal_paths, _ = self.graph(dimension, *goal_chunk)
+        entries = {
+            # Walk the goal-to-entrance path backwards, ending on the goal itself
+            node: path[-2::-1] + [goal] if path else []
+            for node, path in self.local_paths(dimension, *goal_chunk, goal, list(goal_paths)).items()
+        }
+        if not exits or not entries:
+            return None  # Walled in on one end; searching the rest of the world cannot help
+        # Chunks the search may enter, so a goal that turns out unreachable costs a bounded area
+        left = min(start_chunk[0], goal_chunk[0]) - PATH_CHUNK_MARGIN
+        right = max(start_chunk[0], goal_chunk[0]) + PATH_CHUNK_MARGIN
+        top = min(start_chunk[1], goal_chunk[1]) - PATH_CHUNK_MARGIN
+        bottom = max(start_chunk[1], goal_chunk[1]) + PATH_CHUNK_MARGIN
+
+        # A* over entrances; costs are local path lengths plus one per border crossing
+        gx, gy = goal
+        open_heap = []
+        best = {}
+        came_from = {}
+        for node, path in exits.items():
+            cost = len(path)
+            best[node] = cost
+            came_from[node] = (None, path)
+            heapq.heappush(open_heap, (cost + abs(node[0] - gx) + abs(node[1] - gy), cost, node))
+
+        expansions = 0
+        while open_heap and expansions < PATH_MAX_EXPANSIONS:
+            _, cost, node = heapq.heappop(open_heap)
+            if cost > best.get(node, cost):
+                continue
+            expansions += 1
+            if node in entries:
+                segments = [entries[node]]
+                while node is not None:
+                    previous, path = came_from[node]
+                    segments.append(path)
+                    node = previous
+                return [step for path in reversed(segments) for step in path]
+            node_chunk = (node[0] // CHUNK_SIZE, node[1] // CHUNK_SIZE)
+            paths, links = self.graph(dimension, *node_chunk)
+            moves = [(other, path) for other, path in paths[node].items() if other != node]
+            moves.extend((outside, [outside]) for outside in links.get(node, ()))
+            for other, path in moves:
+                new_cost = cost + len(path)
+                if (new_cost < best.get(other, new_cost + 1) and self.game.is_valid_position(*other)
+                        and left <= other[0] // CHUNK_SIZE <= right and top <= other[1] // CHUNK_SIZE <= bottom):
+                    best[other] = new_cost
+                    came_from[other] = (node, path)
+                    heapq.heappush(open_heap, (new_cost + abs(other[0] - gx) + abs(other[1] - gy), new_cost, other))
+        return None
+
+# Wild Creatures
+CREATURE_TYPE_KEYS = list(CREATURE_TYPES.keys())
+CREATURE_CELL = 8             # Spatial hash cell size in tiles
+CREATURE_SPAWN_RADIUS = 2     # Chunks around the player that get populated
+CREATURE_MAX = 5000
+CREATURE_MOVE_FRAMES = 30     # Average frames between steps for creatures near the player
+CREATURE_NEAR_MARGIN = 4      # Tiles beyond the viewport that count as near
+CREATURE_BUDGET_MS = 1.0      # Per-frame time allowed for creatures away from the player
+CREATURE_FAR_BATCH = 256      # Max far creatures per frame, the only limit in deterministic runs
+
+
+class WildCreatures:
+    """Roaming wild creatures stored as parallel arrays with a spatial hash.
+
+    Creatures near the player step every frame they are due. The rest are
+    visited round-robin with whatever is left of a small per-frame time
+    budget, so thousands of them never cost more than a fixed slice.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.rng = random.Random(game.seed + 1)
+        self.deterministic = False  # Replays swap the time budget for a fixed batch size
+        self.frame = 0
+        self.xs = array('i')
+        self.ys = array('i')
+        self.dims = array('B')
+        self.types = array('B')
+        self.next_move = array('I')  # Frame of each creature's next step
+        self.alive = bytearray()
+        self.free = []               # Dead slots ready for reuse
+        self.count = 0
+        self.cells = {}              # (dimension, cell x, cell y) -> set of slots
+        self.spawned_chunks = set()
+        self.far_cursor = 0
+
+    def cell_key(self, dim, x, y):
+        return (dim, x // CREATURE_CELL, y // CREATURE_CELL)
+
+    def add(self, dim, x, y, ctype):
+        if self.free:
+            i = self.free.pop()
+            self.xs[i], self.ys[i], self.dims[i], self.types[i] = x, y, dim, ctype
+            self.next_move[i] = self.frame + self.rng.randrange(CREATURE_MOVE_FRAMES)
+            self.alive[i] = 1
+        else:
+            i = len(self.xs)
+            self.xs.append(x)
+            self.ys.append(y)
+            self.dims.append(dim)
+            self.types.append(ctype)
+            self.next_move.append(self.frame + self.rng.randrange(CREATURE_MOVE_FRAMES))
+            self.alive.append(1)
+        self.cells.setdefault(self.cell_key(dim, x, y), set()).add(i)
+        self.count += 1
+        return i
+
+    def remove(self, i):
+        cell = self.cells[self.cell_key(self.dims[i], self.xs[i], self.ys[i])]
+        cell.discard(i)
+        if not cell:
+            del self.cells[self.cell_key(self.dims[i], self.xs[i], self.ys[i])]
+        self.alive[i] = 0
+        self.free.append(i)
+        self.count -= 1
+
+    def move(self, i, x, y):
+        dim = self.dims[i]
+        old_key = self.cell_key(dim, self.xs[i], self.ys[i])
+        new_key = self.cell_key(dim, x, y)
+        if old_key != new_key:
+            cell = self.cells[old_key]
+            cell.discard(i)
+            if not cell:
+                del self.cells[old_key]
+            self.cells.setdefault(new_key, set()).add(i)
+        self.xs[i] = x
+        self.ys[i] = y
+
+    def in_rect(self, dim, left, top, right, bottom):
+        """Slots of creatures inside the tile rectangle [left, right) x [top, bottom)."""
+        found = []
+        for cx in range(left // CREATURE_CELL, (right - 1) // CREATURE_CELL + 1):
+            for cy in range(top // CREATURE_CELL, (bottom - 1) // CREATURE_CELL + 1):
+                for i in self.cells.get((dim, cx, cy), ()):
+                    if left <= self.xs[i] < right and top <= self.ys[i] < bottom:
+                        found.append(i)
+        return found
+
+    def at(self, dim, x, y):
+        for i in self.cells.get(self.cell_key(dim, x, y), ()):
+            if self.xs[i] == x and self.ys[i] == y:
+                return i
+        return None
+
+    def spawn_around(self, x, y):
+        """Populate chunks near the player the first time they come into range."""
+        game = self.game
+        dimension = game.current_dimension
+        dim = DIMENSIONS.index(dimension)
+        pcx, pcy = x // CHUNK_SIZE, y // CHUNK_SIZE
+        for cx in range(pcx - CREATURE_SPAWN_RADIUS, pcx + CREATURE_SPAWN_RADIUS + 1):
+            for cy in range(pcy - CREATURE_SPAWN_RADIUS, pcy + CREATURE_SPAWN_RADIUS + 1):
+                key = (dim, cx, cy)
+                if key in self.spawned_chunks or self.count >= CREATURE_MAX:
+                    continue
+                self.spawned_chunks.add(key)
+                for n in range(int(game.seeded_random(cx, cy, game.seed + 5 + dim) * 4)):
+                    tx = cx * CHUNK_SIZE + int(game.seeded_random(cx, cy, n * 2 + 101) * CHUNK_SIZE)
+                    ty = cy * CHUNK_SIZE + int(game.seeded_random(cx, cy, n * 2 + 102) * CHUNK_SIZE)
+                    if game.is_valid_position(tx, ty) and game.pathfinder.is_passable(tx, ty, dimension):
+                        ctype = BIOME_CREATURE_TYPES.get(game.get_biome(tx, ty, dimension))
+                        if ctype is None:
+                            ctype = self.rng.choice(CREATURE_TYPE_KEYS)
+                        self.add(dim, tx, ty, CREATURE_TYPE_KEYS.index(ctype))
+
+    def step(self, i):
+        """Move one creature a random tile, staying on passable ground in its own dimension."""
+        dx, dy = Pathfinder.NEIGHBOURS[self.rng.randrange(4)]
+        x, y = self.xs[i] + dx, self.ys[i] + dy
+        pathfinder = self.game.pathfinder
+        dimension = DIMENSIONS[self.dims[i]]
+        if self.game.is_valid_position(x, y):
+            bitmap = pathfinder.bitmap(dimension, x // CHUNK_SIZE, y // CHUNK_SIZE)
+            if bitmap[(y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE]:
+                self.move(i, x, y)
+
+    def update(self):
+        """Advance one frame. Returns the slot of a creature on the player's tile, if any."""
+        self.frame += 1
+        game = self.game
+        dim = DIMENSIONS.index(game.current_dimension)
+        left = game.player_x - VIEWPORT_WIDTH // 2 - CREATURE_NEAR_MARGIN
+        top = game.player_y - VIEWPORT_HEIGHT // 2 - CREATURE_NEAR_MARGIN
+        near = self.in_rect(dim, left, top, left + VIEWPORT_WIDTH + 2 * CREATURE_NEAR_MARGIN,
+                            top + VIEWPORT_HEIGHT + 2 * CREATURE_NEAR_MARGIN)
+        for i in sorted(near):
+            if self.next_move[i] <= self.frame:
+                self.step(i)
+                self.next_move[i] = self.frame + CREATURE_MOVE_FRAMES // 2 + self.rng.randrange(CREATURE_MOVE_FRAMES)
+
+        # Far creatures take turns in a budgeted round-robin sweep
+        near = set(near)
+        slots = len(self.xs)
+        deadline = time.perf_counter() + CREATURE_BUDGET_MS / 1000
+        for visited in range(min(slots, CREATURE_FAR_BATCH)):
+            i = self.far_cursor
+            self.far_cursor = (self.far_cursor + 1) % slots
+            if self.alive[i] and i not in near:
+                self.step(i)
+            if not self.deterministic and visited % 32 == 31 and time.perf_counter() > deadline:
+                break
+
+        return self.at(dim, game.player_x, game.player_y)
+
+    def draw(self, surface, start_x, start_y):
+        dim = DIMENSIONS.index(self.game.current_dimension)
+        for i in self.in_rect(dim, start_x, start_y, start_x + VIEWPORT_WIDTH, start_y + VIEWPORT_HEIGHT):
+            center = ((self.xs[i] - start_x) * TILE_SIZE + TILE_SIZE // 2,
+                      (self.ys[i] - start_y) * TILE_SIZE + TILE_SIZE // 2)
+            pygame.draw.circle(surface, CREATURE_TYPES[CREATURE_TYPE_KEYS[self.types[i]]]['color'], center, TILE_SIZE // 3)
+            pygame.draw.circle(surface, BLACK, center, TILE_SIZE // 3, 2)
+
+# Creature Storage
+PARTY_SIZE = 6
+BOX_PAGE_SIZE = 10
+BOX_SORTS = ['level', 'name', 'type']
+
+
+class CreatureBox:
+    """Caught creatures that are not in the party, stored column by column.
+
+    Type, level and name sit in parallel columns next to the Creature
+    objects themselves, each with a bucket index. Listings walk the buckets
+    in sort order and skip whole buckets before the requested page, so
+    paging through thousands of creatures never sorts all of them. Swapping
+    with the party exchanges object references in place.
+    """
+
+    def __init__(self):
+        self.creatures = []      # slot -> Creature, None for a free slot
+        self.types = array('B')  # Index into CREATURE_TYPE_KEYS
+        self.levels = array('H')
+        self.names = []
+        self.free = []
+        self.count = 0
+        self.by_type = {}        # type index -> set of slots
+        self.by_level = {}       # level -> set of slots
+        self.by_name = {}        # name -> set of slots
+
+    def index(self, i, creature):
+        self.types[i] = CREATURE_TYPE_KEYS.index(creature.type)
+        self.levels[i] = creature.level
+        self.names[i] = creature.name
+        self.by_type.setdefault(self.types[i], set()).add(i)
+        self.by_level.setdefault(self.levels[i], set()).add(i)
+        self.by_name.setdefault(self.names[i], set()).add(i)
+
+    def unindex(self, i):
+        for buckets, key in ((self.by_type, self.types[i]), (self.by_level, self.levels[i]),
+                             (self.by_name, self.names[i])):
+            bucket = buckets[key]
+            bucket.discard(i)
+            if not bucket:
+                del buckets[key]
+
+    def add(self, creature):
+        if self.free:
+            i = self.free.pop()
+        else:
+            i = len(self.creatures)
+            self.creatures.append(None)
+            self.types.append(0)
+            self.levels.append(0)
+            self.names.append(None)
+        self.creatures[i] = creature
+        self.index(i, creature)
+        self.count += 1
+        return i
+
+    def remove(self, i):
+        creature = self.creatures[i]
+        self.unindex(i)
+        self.creatures[i] = None
+        self.names[i] = None
+        self.free.append(i)
+        self.count -= 1
+        return creature
+
+    def swap(self, i, party, party_index):
+        """Exchange box slot i with party[party_index]."""
+        self.unindex(i)
+        self.creatures[i], party[party_index] = party[party_index], self.creatures[i]
+        self.index(i, self.creatures[i])
+
+    def stored(self):
+        return [creature for creature in self.creatures if creature is not None]
+
+    def list(self, sort='level', ctype=None, level=None, name=None, page=0, page_size=BOX_PAGE_SIZE):
+        """One page of slots matching the filters in sort order, and the number of matches."""
+        if sort == 'level':
+            buckets = [self.by_level[key] for key in sorted(self.by_level, reverse=True)]
+        elif sort == 'name':
+            buckets = [self.by_name[key] for key in sorted(self.by_name)]
+        else:
+            buckets = [self.by_type[key] for key in sorted(self.by_type)]
+
+        filters = []
+        if ctype is not None:
+            filters.append(self.by_type.get(CREATURE_TYPE_KEYS.index(ctype), set()))
+        if level is not None:
+            filters.append(self.by_level.get(level, set()))
+        if name is not None:
+            filters.append(self.by_name.get(name, set()))
+
+        offset = page * page_size
+        slots = []
+        total = 0
+        for bucket in buckets:
+            for matches in filters:
+                bucket = bucket & matches
+            if total + len(bucket) > offset and len(slots) < page_size:
+                # Within a bucket, creatures stay in the order they were stored
+                ordered = sorted(bucket)
+                start = max(0, offset - total)
+                slots.extend(ordered[start:start + page_size - len(slots)])
+            total += len(bucket)
+        return slots, total
+
+# Farming
+CROP_TYPES = {
+    'WHEAT':   {'name': 'Wheat',   'color': (234, 179, 8),  'stages': 4, 'grow': 720,  'wither': 1440, 'value': 8},
+    'CARROT':  {'name': 'Carrot',  'color': (249, 115, 22), 'stages': 4, 'grow': 960,  'wither': 1440, 'value': 12},
+    'PUMPKIN': {'name': 'Pumpkin', 'color': (234, 88, 12),  'stages': 5, 'grow': 1800, 'wither': 2880, 'value': 30},
+    'CACTUS_FRUIT': {'name': 'Cactus Fruit', 'color': (219, 39, 119), 'stages': 4, 'grow': 1200, 'wither': 4320, 'value': 20},
+    'GLOWCAP': {'name': 'Glowcap', 'color': (56, 189, 248), 'stages': 3, 'grow': 600,  'wither': 720,  'value': 25},
+}
+# Crop planted by default in each biome
+BIOME_CROPS = {'DESERT': 'CACTUS_FRUIT', 'MUSHROOM': 'GLOWCAP', 'CRYSTAL': 'GLOWCAP', 'FOREST': 'PUMPKIN', 'SWAMP': 'CARROT'}
+SEED_COST = 2
+PLANTABLE = (Tile.GRASS, Tile.DIRT, Tile.FARMLAND)
+
+CROP_GROWING = 'growing'
+CROP_RIPE = 'ripe'
+CROP_WITHERED = 'withered'
+
+
+class Farm:
+    """Crops that grow from a planting time instead of being ticked.
+
+    A crop is only (planted_at, crop type). Its stage is worked out from
+    the game clock when it is drawn or harvested, and ripening and
+    withering are game-clock timers on the scheduler, so a field nobody
+    looks at costs nothing until one of its events comes due.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.crops = {}     # (x, y, dimension) -> (planted_at, crop type)
+        self.by_chunk = {}  # (dimension, cx, cy) -> set of crop keys, for drawing
+        self.sprites = {}   # (crop type, stage or state) -> Surface
+        self.announced = set()
+        self.announced_at = None
+
+    def schedule(self, when, event, key, planted_at):
+        self.game.scheduler.call_at(when, self.crop_event, event, key, planted_at, clock=GAME_CLOCK)
+
+    def add(self, key, planted_at, ctype):
+        self.crops[key] = (planted_at, ctype)
+        x, y, dimension = key
+        self.by_chunk.setdefault((dimension, x // CHUNK_SIZE, y // CHUNK_SIZE), set()).add(key)
+        crop = CROP_TYPES[ctype]
+        self.schedule(planted_at + crop['grow'], CROP_RIPE, key, planted_at)
+        self.schedule(planted_at + crop['grow'] + crop['wither'], CROP_WITHERED, key, planted_at)
+
+    def remove(self, key):
+        del self.crops[key]
+        x, y, dimension = key
+        chunk_key = (dimension, x // CHUNK_SIZE, y // CHUNK_SIZE)
+        self.by_chunk[chunk_key].discard(key)
+        if not self.by_chunk[chunk_key]:
+            del self.by_chunk[chunk_key]
+
+    def state(self, key, now):
+        """Return (stage, state) for the crop at key as of game minute now."""
+        planted_at, ctype = self.crops[key]
+        crop = CROP_TYPES[ctype]
+        age = now - planted_at
+        if age >= crop['grow'] + crop['wither']:
+            return crop['stages'] - 1, CROP_WITHERED
+        if age >= crop['grow']:
+            return crop['stages'] - 1, CROP_RIPE
+        return int(age * (crop['stages'] - 1) / crop['grow']), CROP_GROWING
+
+    def plant(self, x, y, ctype, now):
+        self.add((x, y, self.game.current_dimension), now, ctype)
+
+    def harvest(self, x, y, now):
+        """Remove the crop at (x, y). Returns (crop type, state) or None if there is none."""
+        key = (x, y, self.game.current_dimension)
+        if key not in self.crops:
+            return None
+        _, state = self.state(key, now)
+        ctype = self.crops[key][1]
+        self.remove(key)
+        return ctype, state
+
+    def crop_event(self, event, key, planted_at):
+        """Ripen/wither timer. Timers of replanted or harvested crops are ignored."""
+        crop = self.crops.get(key)
+        if crop is None or crop[0] != planted_at:
+            return
+        game = self.game
+        x, y, dimension = key
+        left = game.player_x - VIEWPORT_WIDTH // 2
+        top = game.player_y - VIEWPORT_HEIGHT // 2
+        if not (dimension == game.current_dimension
+                and left <= x < left + VIEWPORT_WIDTH and top <= y < top + VIEWPORT_HEIGHT):
+            return
+        # A whole field ripening together gets a single message
+        now = game.get_total_minutes()
+        if now != self.announced_at:
+            self.announced = set()
+            self.announced_at = now
+        if (event, crop[1]) not in self.announced:
+            self.announced.add((event, crop[1]))
+            name = CROP_TYPES[crop[1]]['name']
+            game.add_message(f"{name} is ripe!" if event == CROP_RIPE else f"{name} withered...")
+
+    def get_sprite(self, ctype, stage, state):
+        key = (ctype, state if state != CROP_GROWING else stage)
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            crop = CROP_TYPES[ctype]
+            sprite = pygame.Surface((TILE_SIZE, TILE_SIZE), pygame.SRCALPHA)
+            if state == CROP_WITHERED:
+                pygame.draw.line(sprite, (120, 80, 40), (TILE_SIZE // 2, TILE_SIZE - 6), (TILE_SIZE // 2 + 6, TILE_SIZE // 2), 3)
+            elif state == CROP_RIPE:
+                pygame.draw.line(sprite, (22, 101, 52), (TILE_SIZE // 2, TILE_SIZE - 6), (TILE_SIZE // 2, TILE_SIZE // 2), 3)
+                pygame.draw.circle(sprite, crop['color'], (TILE_SIZE // 2, TILE_SIZE // 2 - 4), TILE_SIZE // 4)
+            else:
+                height = 4 + (TILE_SIZE // 2) * stage // max(1, crop['stages'] - 1)
+                pygame.draw.line(sprite, (34, 197, 94), (TILE_SIZE // 2, TILE_SIZE - 6), (TILE_SIZE // 2, TILE_SIZE - 6 - height), 3)
+            self.sprites[key] = sprite
+        return sprite
+
+    def draw(self, surface, start_x, start_y, now):
+        dimension = self.game.current_dimension
+        for cx in range(start_x // CHUNK_SIZE, (start_x + VIEWPORT_WIDTH - 1) // CHUNK_SIZE + 1):
+            for cy in range(start_y // CHUNK_SIZE, (start_y + VIEWPORT_HEIGHT - 1) // CHUNK_SIZE + 1):
+                for key in self.by_chunk.get((dimension, cx, cy), ()):
+                    x, y, _ = key
+                    if start_x <= x < start_x + VIEWPORT_WIDTH and start_y <= y < start_y + VIEWPORT_HEIGHT:
+                        stage, state = self.state(key, now)
+                        sprite = self.get_sprite(self.crops[key][1], stage, state)
+                        surface.blit(sprite, ((x - start_x) * TILE_SIZE, (y - start_y) * TILE_SIZE))
+
+# Lighting
+LIGHT_MAX = 8  # Light level of a full-strength emitter; drops by one per tile
+DARKNESS_LEVELS = 8  # Distinct overlay strengths, including fully lit
+LIGHT_CACHE_CHUNKS = 1024  # Chunks of sources and of light kept per cache
+
+
+class Lighting:
+    """Light spread from lava, portals and crystals, combined with time of day.
+
+    Each chunk's light is a byte per tile, computed by a bucketed BFS over
+    the chunk and its eight neighbours (light never reaches further than
+    one chunk) and kept until a set_tile nearby invalidates it. Drawing
+    quantises each tile's darkness and blits one of a few prebuilt
+    overlays, so a frame costs a table lookup and a blit per dark tile.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.sources = OrderedDict()  # (dimension, cx, cy) -> (emission bytes, blocking bytes)
+        self.chunks = OrderedDict()   # (dimension, cx, cy) -> light bytes
+        self.source_stats = CacheStats()
+        self.chunk_stats = CacheStats()
+        self.overlays = []
+        for level in range(DARKNESS_LEVELS):
+            overlay = pygame.Surface((TILE_SIZE, TILE_SIZE))
+            overlay.fill(BLACK)
+            overlay.set_alpha(int(255 * level / (DARKNESS_LEVELS - 1)))
+            self.overlays.append(overlay)
+        self.no_light = bytes(CHUNK_SIZE * CHUNK_SIZE)
+
+    def chunk_sources(self, dimension, cx, cy):
+        key = (dimension, cx, cy)
+        sources = lru_get(self.sources, key, self.source_stats)
+        if sources is None:
+            tiles = self.game.get_chunk_tiles(cx, cy, dimension)
+            sources = lru_put(self.sources, key, (tiles.translate(EMISSION_TABLE), tiles.translate(BLOCKING_TABLE)),
+                              LIGHT_CACHE_CHUNKS, self.source_stats)
+        return sources
+
+    def chunk_light(self, dimension, cx, cy):
+        key = (dimension, cx, cy)
+        light = lru_get(self.chunks, key, self.chunk_stats)
+        if light is None:
+            light = lru_put(self.chunks, key, self.compute(dimension, cx, cy), LIGHT_CACHE_CHUNKS, self.chunk_stats)
+        return light
+
+    def compute(self, dimension, cx, cy):
+        window = 3 * CHUNK_SIZE
+        emission = bytearray(window * window)
+        blocking = bytearray(window * window)
+        lit = False
+        for wy in range(3):
+            for wx in range(3):
+                chunk_emission, chunk_blocking = self.chunk_sources(dimension, cx + wx - 1, cy + wy - 1)
+                if chunk_emission.count(0) != len(chunk_emission):
+                    lit = True
+                for row in range(CHUNK_SIZE):
+                    start = (wy * CHUNK_SIZE + row) * window + wx * CHUNK_SIZE
+                    emission[start:start + CHUNK_SIZE] = chunk_emission[row * CHUNK_SIZE:(row + 1) * CHUNK_SIZE]
+                    blocking[start:start + CHUNK_SIZE] = chunk_blocking[row * CHUNK_SIZE:(row + 1) * CHUNK_SIZE]
+        if not lit:
+            return self.no_light
+
+        # Bucketed BFS: brighter light is always spread before dimmer light
+        light = bytearray(emission)
+        buckets = [[] for _ in range(LIGHT_MAX + 1)]
+        for i, level in enumerate(emission):
+            if level:
+                buckets[level].append(i)
+        for level in range(LIGHT_MAX, 1, -1):
+            for i in buckets[level]:
+                if light[i] != level:
+                    continue
+                x, y = i % window, i // window
+                for j, inside in ((i - 1, x > 0), (i + 1, x < window - 1),
+                                  (i - window, y > 0), (i + window, y < window - 1)):
+                    if inside and not blocking[j] and light[j] < level - 1:
+                        light[j] = level - 1
+                        buckets[level - 1].append(j)
+
+        return bytes(
+            b for row in range(CHUNK_SIZE)
+            for b in light[(CHUNK_SIZE + row) * window + CHUNK_SIZE:(CHUNK_SIZE + row) * window + 2 * CHUNK_SIZE]
+        )
+
+    def tile_changed(self, x, y, dimension=None):
+        """Forget light for every chunk the changed tile could have lit."""
+        dimension = dimension or self.game.current_dimension
+        cx, cy = x // CHUNK_SIZE, y // CHUNK_SIZE
+        self.sources.pop((dimension, cx, cy), None)
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                self.chunks.pop((dimension, cx + dx, cy + dy), None)
+
+    def draw(self, surface, start_x, start_y, ambient):
+        """Darken the viewport by ambient time-of-day light and local light sources."""
+        if ambient >= 1.0:
+            return
+        # Darkness overlay for each possible local light level at this time of day
+        levels = [
+            round((1.0 - max(ambient, light / LIGHT_MAX)) * (DARKNESS_LEVELS - 1))
+            for light in range(LIGHT_MAX + 1)
+        ]
+        dimension = self.game.current_dimension
+        overlays = self.overlays
+        blits = []
+        for row in range(VIEWPORT_HEIGHT):
+            wy = start_y + row
+            for col in range(VIEWPORT_WIDTH):
+                wx = start_x + col
+                light = self.chunk_light(dimension, wx // CHUNK_SIZE, wy // CHUNK_SIZE)
+                level = levels[light[(wy % CHUNK_SIZE) * CHUNK_SIZE + wx % CHUNK_SIZE]]
+                if level:
+                    blits.append((overlays[level], (col * TILE_SIZE, row * TILE_SIZE)))
+        surface.blits(blits, doreturn=False)
+
+# Weather
+# Velocities are in pixels per second; sprites are drawn once and reused
+WEATHER_TYPES = {
+    'snow':   {'color': (245, 248, 255), 'size': (3, 3), 'count': 400, 'vx': (-25, 25), 'vy': (40, 80)},
+    'rain':   {'color': (150, 180, 255), 'size': (1, 8), 'count': 600, 'vx': (-30, -20), 'vy': (420, 520)},
+    'ash':    {'color': (70, 60, 60),    'size': (2, 2), 'count': 300, 'vx': (-15, 15), 'vy': (10, 35)},
+    'spores': {'color': (220, 170, 255), 'size': (2, 2), 'count': 200, 'vx': (-12, 12), 'vy': (-25, -8)},
+}
+BIOME_WEATHER = {
+    'SNOW': 'snow',
+    'OCEAN': 'rain',
+    'SWAMP': 'rain',
+    'JUNGLE': 'rain',
+    'LAVA': 'ash',
+    'WASTELAND': 'ash',
+    'MUSHROOM': 'spores',
+}
+WEATHER_TARGET_MS = 1000 / 60 * 1.1  # Smoothed frame time above this sheds particles
+WEATHER_MIN_BUDGET = 0.2             # Never thin weather below this share of its count
+
+
+class Weather:
+    """Snow, rain, ash and spores over the viewport, driven by the player's biome.
+
+    Particle positions and velocities live in NumPy arrays and step in one
+    vectorised update (plain lists when NumPy is missing). Drawing is a single
+    Surface.blits of one pre-rendered sprite. The share of particles drawn
+    shrinks while the smoothed frame time is over target and recovers after.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.width = SCREEN_WIDTH
+        self.height = VIEWPORT_HEIGHT * TILE_SIZE
+        self.kind = None
+        self.sprite = None
+        self.xs = self.ys = self.vxs = self.vys = None
+        self.budget = 1.0
+        self.frame_ms = 1000 / 60
+        self.camera = (game.player_x, game.player_y)
+        self.seed = game.seed
+
+    def start(self, kind):
+        self.kind = kind
+        if kind is None:
+            self.sprite = self.xs = self.ys = self.vxs = self.vys = None
+            return
+        spec = WEATHER_TYPES[kind]
+        self.sprite = pygame.Surface(spec['size'])
+        self.sprite.fill(spec['color'])
+        count = spec['count']
+        if np is not None:
+            rng = np.random.default_rng(self.seed)
+            self.xs = rng.uniform(0, self.width, count).astype(np.float32)
+            self.ys = rng.uniform(0, self.height, count).astype(np.float32)
+            self.vxs = rng.uniform(*spec['vx'], count).astype(np.float32)
+            self.vys = rng.uniform(*spec['vy'], count).astype(np.float32)
+        else:
+            rng = random.Random(self.seed)
+            self.xs = [rng.uniform(0, self.width) for _ in range(count)]
+            self.ys = [rng.uniform(0, self.height) for _ in range(count)]
+            self.vxs = [rng.uniform(*spec['vx']) for _ in range(count)]
+            self.vys = [rng.uniform(*spec['vy']) for _ in range(count)]
+
+    def update(self, dt):
+        """Step particles by dt milliseconds and adjust the particle budget."""
+        kind = BIOME_WEATHER.get(self.game.get_biome(self.game.player_x, self.game.player_y))
+        if kind != self.kind:
+            self.start(kind)
+
+        self.frame_ms += (dt - self.frame_ms) * 0.1
+        if self.frame_ms > WEATHER_TARGET_MS:
+            self.budget = max(WEATHER_MIN_BUDGET, self.budget * 0.95)
+        else:
+            self.budget = min(1.0, self.budget + 0.01)
+
+        # Particles stay put in the world while the viewport scrolls past them
+        camera = (self.game.player_x, self.game.player_y)
+        shift_x = (self.camera[0] - camera[0]) * TILE_SIZE
+        shift_y = (self.camera[1] - camera[1]) * TILE_SIZE
+        self.camera = camera
+        if self.kind is None:
+            return
+
+        seconds = dt / 1000
+        if np is not None:
+            self.xs += self.vxs * seconds + shift_x
+            self.ys += self.vys * seconds + shift_y
+            np.mod(self.xs, self.width, out=self.xs)
+            np.mod(self.ys, self.height, out=self.ys)
+        else:
+            self.xs = [(x + vx * seconds + shift_x) % self.width for x, vx in zip(self.xs, self.vxs)]
+            self.ys = [(y + vy * seconds + shift_y) % self.height for y, vy in zip(self.ys, self.vys)]
+
+    def draw(self, surface):
+        if self.kind is None:
+            return
+        count = int(len(self.xs) * self.budget)
+        if np is not None:
+            xs = self.xs[:count].astype(np.int32).tolist()
+            ys = self.ys[:count].astype(np.int32).tolist()
+        else:
+            xs = [int(x) for x in self.xs[:count]]
+            ys = [int(y) for y in self.ys[:count]]
+        sprite = self.sprite
+        surface.blits([(sprite, position) for position in zip(xs, ys)], doreturn=False)
+
+# Level of Detail
+ZOOM_LEVELS = [TILE_SIZE, 20, 10, 5]  # Pixels per tile; index 0 is the normal tile view
+LOD_CACHE_BYTES = 48 * 1024 * 1024    # Memory budget for cached chunk images
+LOD_BUILD_MS = 4.0                    # Time per frame spent rendering missing chunk images
+
+
+class ChunkImages:
+    """Pre-rendered chunk images for the zoomed-out views.
+
+    A chunk is drawn once at full size with draw_tile, halved with
+    smoothscale down to the requested tiles size and kept in an LRU cache
+    bounded by LOD_CACHE_BYTES. A zoomed frame is one blit per visible
+    chunk; chunks not built yet are filled with their biome colour and
+    rendered a few at a time within LOD_BUILD_MS per frame.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.images = OrderedDict()  # (dimension, cx, cy, tile_size) -> Surface
+        self.bytes = 0
+        self.stats = CacheStats()
+        self.scratch = None
+
+    def build(self, cx, cy, tile_size):
+        if self.scratch is None:
+            self.scratch = pygame.Surface((CHUNK_SIZE * TILE_SIZE, CHUNK_SIZE * TILE_SIZE))
+        game = self.game
+        x0, y0 = cx * CHUNK_SIZE, cy * CHUNK_SIZE
+        for row in range(CHUNK_SIZE):
+            for col in range(CHUNK_SIZE):
+                game.draw_tile(self.scratch, game.get_tile(x0 + col, y0 + row), col, row, False)
+        image = self.scratch
+        size = CHUNK_SIZE * TILE_SIZE
+        while size > CHUNK_SIZE * tile_size:
+            size //= 2
+            image = pygame.transform.smoothscale(image, (size, size))
+        return image
+
+    def get(self, cx, cy, tile_size, build=True):
+        key = (self.game.current_dimension, cx, cy, tile_size)
+        image = self.images.get(key)
+        if image is not None:
+            self.stats.hits += 1
+            self.images.move_to_end(key)
+            return image
+        if not build:
+            return None
+        self.stats.misses += 1
+        image = self.build(cx, cy, tile_size)
+        self.images[key] = image
+        self.bytes += image.get_width() * image.get_height() * image.get_bytesize()
+        while self.bytes > LOD_CACHE_BYTES and len(self.images) > 1:
+            _, old = self.images.popitem(last=False)
+            self.bytes -= old.get_width() * old.get_height() * old.get_bytesize()
+            self.stats.evictions += 1
+        return image
+
+    def tile_changed(self, x, y):
+        dimension = self.game.current_dimension
+        cx, cy = x // CHUNK_SIZE, y // CHUNK_SIZE
+        for tile_size in ZOOM_LEVELS[1:]:
+            old = self.images.pop((dimension, cx, cy, tile_size), None)
+            if old is not None:
+                self.bytes -= old.get_width() * old.get_height() * old.get_bytesize()
+
+    def draw(self, surface, start_x, start_y, tile_size):
+        """Draw the world from tile (start_x, start_y) at tile_size pixels per tile."""
+        width, height = surface.get_size()
+        chunk_pixels = CHUNK_SIZE * tile_size
+        deadline = time.perf_counter() + LOD_BUILD_MS / 1000
+        blits = []
+        for cy in range(start_y // CHUNK_SIZE, (start_y + height // tile_size) // CHUNK_SIZE + 1):
+            for cx in range(start_x // CHUNK_SIZE, (start_x + width // tile_size) // CHUNK_SIZE + 1):
+                position = ((cx * CHUNK_SIZE - start_x) * tile_size, (cy * CHUNK_SIZE - start_y) * tile_size)
+                image = self.get(cx, cy, tile_size, build=time.perf_counter() < deadline)
+                if image is not None:
+                    blits.append((image, position))
+                else:
+                    biome = self.game.get_biome(cx * CHUNK_SIZE, cy * CHUNK_SIZE)
+                    surface.fill(BIOMES[biome]['color'], (position, (chunk_pixels, chunk_pixels)))
+        surface.blits(blits, doreturn=False)
+
+# Exploration
+ROW_BITS = (1 << CHUNK_SIZE) - 1
+EXPLORED_FULL = (1 << CHUNK_SIZE * CHUNK_SIZE) - 1
+EXPLORED_BYTES = CHUNK_SIZE * CHUNK_SIZE // 8
+# One chunk in the save file: cx, cy, dimension index, then its EXPLORED_BYTES of bits
+EXPLORED_RECORD = struct.Struct('<iiB')
+FOG_COLOR = (15, 15, 20)
+
+
+class Exploration:
+    """Tiles the player has seen, one CHUNK_SIZE * CHUNK_SIZE bit set per chunk.
+
+    Bit row * CHUNK_SIZE + col of a chunk's int is set once that tile has
+    been in view. Marking a rectangle ORs in one precomputed mask per
+    chunk, and counting is int.bit_count, so neither touches single tiles.
+    Only chunks the player has seen are stored: 32 bytes of bits each.
+    """
+
+    def __init__(self):
+        self.chunks = {}  # (dimension, cx, cy) -> int bit set
+        self.dirty = False
+
+    def chunk_masks(self, x, y, width, height):
+        """Yield (cx, cy, mask) for the chunks overlapping a tile rectangle."""
+        for cy in range(y // CHUNK_SIZE, (y + height - 1) // CHUNK_SIZE + 1):
+            top = max(y, cy * CHUNK_SIZE) - cy * CHUNK_SIZE
+            bottom = min(y + height, (cy + 1) * CHUNK_SIZE) - cy * CHUNK_SIZE
+            # A 1 at the start of every row from top to bottom
+            rows = ((1 << CHUNK_SIZE * (bottom - top)) - 1) // ROW_BITS << CHUNK_SIZE * top
+            for cx in range(x // CHUNK_SIZE, (x + width - 1) // CHUNK_SIZE + 1):
+                left = max(x, cx * CHUNK_SIZE) - cx * CHUNK_SIZE
+                right = min(x + width, (cx + 1) * CHUNK_SIZE) - cx * CHUNK_SIZE
+                yield cx, cy, rows * (((1 << (right - left)) - 1) << left)
+
+    def mark(self, dimension, x, y, width, height):
+        chunks = self.chunks
+        for cx, cy, mask in self.chunk_masks(x, y, width, height):
+            key = (dimension, cx, cy)
+            bits = chunks.get(key, 0)
+            if bits | mask != bits:
+                chunks[key] = bits | mask
+                self.dirty = True
+
+    def is_explored(self, dimension, x, y):
+        bits = self.chunks.get((dimension, x // CHUNK_SIZE, y // CHUNK_SIZE), 0)
+        return bits >> ((y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE) & 1
+
+    def explored_count(self, dimension, x=None, y=None, width=None, height=None):
+        """Explored tiles in a rectangle, or in the whole dimension when no rectangle is given."""
+        if x is None:
+            return sum(bits.bit_count() for (dim, _, _), bits in self.chunks.items() if dim == dimension)
+        chunks = self.chunks
+        return sum(
+            (chunks.get((dimension, cx, cy), 0) & mask).bit_count()
+            for cx, cy, mask in self.chunk_masks(x, y, width, height)
+        )
+
+    def percent_explored(self, dimension, x, y, width, height):
+        return 100 * self.explored_count(dimension, x, y, width, height) / (width * height)
+
+    @staticmethod
+    def to_bytes(chunks):
+        """Compressed save data for a copy of Exploration.chunks; safe to call off the main thread."""
+        return zlib.compress(b''.join(
+            EXPLORED_RECORD.pack(cx, cy, DIMENSIONS.index(dim)) + bits.to_bytes(EXPLORED_BYTES, 'little')
+            for (dim, cx, cy), bits in chunks.items()
+        ))
+
+    def load_bytes(self, data):
+        data = zlib.decompress(data)
+        size = EXPLORED_RECORD.size + EXPLORED_BYTES
+        for pos in range(0, len(data) - size + 1, size):
+            cx, cy, dim = EXPLORED_RECORD.unpack_from(data, pos)
+            bits = int.from_bytes(data[pos + EXPLORED_RECORD.size:pos + size], 'little')
+            self.chunks[(DIMENSIONS[dim], cx, cy)] = bits
+
+    def draw_fog(self, surface, dimension, start_x, start_y, tile_size):
+        """Cover every tile of surface not explored yet, one fill per unexplored run."""
+        width, height = surface.get_size()
+        width, height = width // tile_size, height // tile_size
+        for cx, cy, mask in self.chunk_masks(start_x, start_y, width, height):
+            hidden = mask & ~self.chunks.get((dimension, cx, cy), 0)
+            if not hidden:
+                continue
+            x0 = (cx * CHUNK_SIZE - start_x) * tile_size
+            y0 = (cy * CHUNK_SIZE - start_y) * tile_size
+            for row in range(CHUNK_SIZE):
+                row_bits = hidden >> row * CHUNK_SIZE & ROW_BITS
+                col = 0
+                while row_bits:
+                    if not row_bits & 1:
+                        skip = (row_bits & -row_bits).bit_length() - 1
+                        row_bits >>= skip
+                        col += skip
+                        continue
+                    run = (~row_bits & (row_bits + 1)).bit_length() - 1
+                    surface.fill(FOG_COLOR, (x0 + col * tile_size, y0 + row * tile_size, run * tile_size, tile_size))
+                    row_bits >>= run
+                    col += run
+
+# Terrain
+TERRAIN_GENERATORS = ['legacy', 'noise']
+# Per noise field: (lattice cell size in tiles, octaves). Cells are powers of two
+# so a chunk always falls inside one cached lattice block.
+TERRAIN_FIELDS = {
+    'elevation': (64, 4),
+    'moisture': (128, 3),
+    'temperature': (256, 2),
+    'detail': (8, 1),       # Decides where trees, cacti and other features sit
+    'rivers': (128, 2),
+    'lava': (32, 2),
+    'paths': (64, 2),
+}
+TERRAIN_BLOCK = 16          # Lattice cells per side of one cached gradient block
+TERRAIN_LATTICE_CACHE = 512
+TERRAIN_CHUNK_CACHE = 1024
+SEA_LEVEL = -0.25           # Elevation below which the overworld is ocean
+SHORE_LEVEL = -0.18         # Elevation below which land is beach sand
+# Biome of every tile in the other dimensions, as get_biome reports it
+DIMENSION_BIOMES = {'crystal_cave': 'CRYSTAL', 'nether': 'LAVA', 'mushroom': 'MUSHROOM'}
+# Per biome: ground tile, feature tile, and the detail noise above which the feature replaces the ground
+TERRAIN_TILES = {
+    'GRASSLAND': (Tile.GRASS, Tile.TREE, 0.35),
+    'DESERT': (Tile.SAND, Tile.CACTUS, 0.4),
+    'SNOW': (Tile.SNOW, Tile.ICE, 0.2),
+    'FOREST': (Tile.GRASS, Tile.TREE, -0.05),
+    'LAVA': (Tile.OBSIDIAN, Tile.LAVA, 0.15),
+    'OCEAN': (Tile.WATER, Tile.LILY_PAD, 0.5),
+    'SWAMP': (Tile.GRASS, Tile.WATER, 0.1),
+    'MOUNTAIN': (Tile.DARK_STONE, Tile.STONE, 0.05),
+    'JUNGLE': (Tile.GRASS, Tile.TREE_OAK, -0.15),
+    'MUSHROOM': (Tile.GRASS, Tile.TREE_MUSHROOM, 0.1),
+    'CRYSTAL': (Tile.DARK_STONE, Tile.CRYSTAL, 0.35),
+    'WASTELAND': (Tile.DIRT, Tile.STONE, 0.3),
+}
+TERRAIN_BIOMES = list(TERRAIN_TILES)
+# Scattered on open ground: (tile, cumulative chance)
+TERRAIN_SCATTER = [(Tile.NPC, 0.004), (Tile.TREASURE, 0.012), (Tile.QUESTION_BLOCK, 0.016), (Tile.PORTAL, 0.018)]
+TERRAIN_SCATTER_SALT = 1000  # Kept apart from the noise field salts
+# Rivers, lava flows and paths follow the zero contour of their noise field, drawn in this
+# order so paths ford rivers: (field, half width in tiles, biomes crossed, tile)
+TERRAIN_CONTOURS = [
+    ('rivers', 1.2, ('GRASSLAND', 'FOREST', 'JUNGLE', 'SWAMP', 'SNOW', 'MOUNTAIN', 'WASTELAND'), Tile.WATER),
+    ('lava', 1.0, ('LAVA',), Tile.LAVA),
+    ('paths', 0.6, ('GRASSLAND', 'FOREST', 'DESERT', 'SNOW', 'JUNGLE', 'WASTELAND'), Tile.DIRT),
+]
+
+
+def hash_unit(salt, xs, ys):
+    """Uniform floats in [0, 1) for integer coordinate arrays, the same wherever they are computed."""
+    h = xs.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    h ^= ys.astype(np.uint64) * np.uint64(0xC2B2AE3D27D4EB4F)
+    h ^= np.uint64(salt & 0xFFFFFFFFFFFFFFFF)
+    # splitmix64 finaliser
+    h ^= h >> np.uint64(30)
+    h *= np.uint64(0xBF58476D1CE4E5B9)
+    h ^= h >> np.uint64(27)
+    h *= np.uint64(0x94D049BB133111EB)
+    h ^= h >> np.uint64(31)
+    return (h >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+
+class Terrain:
+    """Coherent overworld terrain from gradient noise, a chunk at a time.
+
+    Elevation, moisture and temperature are octaves of Perlin noise,
+    evaluated for a whole chunk at once with NumPy and turned into a biome
+    and a tile per position. Rivers, lava flows and paths are then drawn
+    along the zero contours of their own noise fields. Lattice gradients come from a hash of their
+    coordinates and are cached in blocks, so neighbouring chunks reuse
+    them and the world does not depend on the order chunks are made in.
+    """
+
+    def __init__(self, seed):
+        self.seed = seed
+        self.lattice = OrderedDict()  # (field, octave, bx, by) -> (gx, gy) gradient arrays
+        self.chunks = OrderedDict()  # (dimension, cx, cy) -> (biome indices, tile values), row-major bytes
+        self.lattice_stats = CacheStats()
+        self.chunk_stats = CacheStats()
+        self.ground = np.array([TERRAIN_TILES[b][0].value for b in TERRAIN_BIOMES], dtype=np.uint8)
+        self.feature = np.array([TERRAIN_TILES[b][1].value for b in TERRAIN_BIOMES], dtype=np.uint8)
+        self.threshold = np.array([TERRAIN_TILES[b][2] for b in TERRAIN_BIOMES])
+        self.scatter_chances = np.array([chance for _, chance in TERRAIN_SCATTER])
+        self.scatter_tiles = np.array([tile.value for tile, _ in TERRAIN_SCATTER], dtype=np.uint8)
+        offsets = np.arange(CHUNK_SIZE)
+        self.cols, self.rows = np.meshgrid(offsets, offsets)
+
+    def salt(self, *parts):
+        salt = self.seed
+        for part in parts:
+            salt = salt * 1000003 + part
+        return salt
+
+    def gradients(self, field, octave, bx, by):
+        key = (field, octave, bx, by)
+        block = self.lattice.get(key)
+        if block is not None:
+            self.lattice_stats.hits += 1
+            self.lattice.move_to_end(key)
+            return block
+        self.lattice_stats.misses += 1
+        points = np.arange(TERRAIN_BLOCK + 1)
+        xs, ys = np.meshgrid(points + bx * TERRAIN_BLOCK, points + by * TERRAIN_BLOCK)
+        angle = hash_unit(self.salt(field, octave), xs, ys) * (2 * math.pi)
+        block = (np.cos(angle), np.sin(angle))
+        self.lattice[key] = block
+        if len(self.lattice) > TERRAIN_LATTICE_CACHE:
+            self.lattice.popitem(last=False)
+            self.lattice_stats.evictions += 1
+        return block
+
+    def perlin(self, field, octave, cell, x0, y0, dx=0.5, dy=0.5):
+        """One octave of gradient noise over the chunk starting at x0, y0, sampled dx, dy into each tile."""
+        span = cell * TERRAIN_BLOCK
+        bx, by = x0 // span, y0 // span
+        gx, gy = self.gradients(field, octave, bx, by)
+        px = (x0 - bx * span + self.cols + dx) / cell
+        py = (y0 - by * span + self.rows + dy) / cell
+        # Samples on the far edge of the block belong to its last cell
+        ix = np.minimum(px.astype(np.intp), TERRAIN_BLOCK - 1)
+        iy = np.minimum(py.astype(np.intp), TERRAIN_BLOCK - 1)
+        fx, fy = px - ix, py - iy
+
+        def corner(dx, dy):
+            return gx[iy + dy, ix + dx] * (fx - dx) + gy[iy + dy, ix + dx] * (fy - dy)
+
+        u = fx * fx * fx * (fx * (fx * 6 - 15) + 10)
+        v = fy * fy * fy * (fy * (fy * 6 - 15) + 10)
+        top = corner(0, 0) + u * (corner(1, 0) - corner(0, 0))
+        bottom = corner(0, 1) + u * (corner(1, 1) - corner(0, 1))
+        return (top + v * (bottom - top)) * math.sqrt(2)  # Roughly -1 to 1
+
+    def field(self, name, x0, y0, dx=0.5, dy=0.5):
+        cell, octaves = TERRAIN_FIELDS[name]
+        field = list(TERRAIN_FIELDS).index(name)
+        total = 0.0
+        amplitude = 1.0
+        for octave in range(octaves):
+            total = total + amplitude * self.perlin(field, octave, max(1, cell >> octave), x0, y0, dx, dy)
+            amplitude /= 2
+        return total / (2 - 2 * amplitude)  # Sum of the amplitudes used
+
+    def contour(self, name, x0, y0, half_width):
+        """Tiles within half_width tiles of the zero contour of a noise field.
+
+        The distance is the value at the tile centre over the field's
+        gradient, taken from samples on the tile's edges, so lines keep
+        their width whatever the local slope and join up across chunks.
+        """
+        value = self.field(name, x0, y0)
+        slope_x = self.field(name, x0, y0, 1, 0.5) - self.field(name, x0, y0, 0, 0.5)
+        slope_y = self.field(name, x0, y0, 0.5, 1) - self.field(name, x0, y0, 0.5, 0)
+        return np.abs(value) < half_width * np.hypot(slope_x, slope_y)
+
+    def classify(self, elevation, moisture, temperature):
+        """Biome index per tile."""
+        index = TERRAIN_BIOMES.index
+        conditions = [
+            elevation < SEA_LEVEL,
+            elevation > 0.45,
+            temperature < -0.3,
+            (temperature > 0.35) & (elevation > 0.25),
+            (temperature > 0.3) & (moisture < -0.1),
+            (temperature > 0.2) & (moisture < -0.3),
+            (moisture > 0.3) & (elevation < -0.05),
+            (moisture > 0.25) & (temperature > 0.1),
+            (moisture > 0.35) & (temperature < -0.1),
+            moisture > 0.1,
+        ]
+        choices = [index(b) for b in (
+            'OCEAN', 'MOUNTAIN', 'SNOW', 'LAVA', 'DESERT', 'WASTELAND', 'SWAMP', 'JUNGLE', 'MUSHROOM', 'FOREST')]
+        return np.select(conditions, choices, default=index('GRASSLAND'))
+
+    def chunk(self, dimension, cx, cy):
+        key = (dimension, cx, cy)
+        chunk = self.chunks.get(key)
+        if chunk is not None:
+            self.chunk_stats.hits += 1
+            self.chunks.move_to_end(key)
+            return chunk
+        self.chunk_stats.misses += 1
+        x0, y0 = cx * CHUNK_SIZE, cy * CHUNK_SIZE
+        elevation = self.field('elevation', x0, y0)
+        detail = self.field('detail', x0, y0)
+        if dimension == 'overworld':
+            biomes = self.classify(elevation, self.field('moisture', x0, y0), self.field('temperature', x0, y0))
+        else:
+            biomes = np.full(elevation.shape, TERRAIN_BIOMES.index(DIMENSION_BIOMES[dimension]))
+
+        tiles = np.where(detail > self.threshold[biomes], self.feature[biomes], self.ground[biomes])
+        open_ground = biomes != TERRAIN_BIOMES.index('OCEAN')
+        if dimension == 'overworld':
+            shore = open_ground & (elevation < SHORE_LEVEL)
+            tiles[shore] = Tile.SAND.value
+        for name, half_width, crossed, tile in TERRAIN_CONTOURS:
+            crossed = np.isin(biomes, [TERRAIN_BIOMES.index(biome) for biome in crossed])
+            if crossed.any():
+                tiles[crossed & self.contour(name, x0, y0, half_width)] = tile.value
+        open_ground &= tiles == self.ground[biomes]
+        r = hash_unit(self.salt(TERRAIN_SCATTER_SALT, DIMENSIONS.index(dimension)),
+                      self.cols + x0, self.rows + y0)
+        # The first scatter entry whose cumulative chance is above r, if any
+        scatter = np.searchsorted(self.scatter_chances, r, side='right')
+        scattered = open_ground & (scatter < len(TERRAIN_SCATTER))
+        tiles[scattered] = self.scatter_tiles[scatter[scattered]]
+
+        chunk = (biomes.astype(np.uint8).tobytes(), tiles.astype(np.uint8).tobytes())
+        self.chunks[key] = chunk
+        if len(self.chunks) > TERRAIN_CHUNK_CACHE:
+            self.chunks.popitem(last=False)
+            self.chunk_stats.evictions += 1
+        return chunk
+
+    def biome(self, x, y):
+        biomes, _ = self.chunk('overworld', x // CHUNK_SIZE, y // CHUNK_SIZE)
+        return TERRAIN_BIOMES[biomes[(y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE]]
+
+    def tile(self, dimension, x, y):
+        _, tiles = self.chunk(dimension, x // CHUNK_SIZE, y // CHUNK_SIZE)
+        return TILE_BY_VALUE[tiles[(y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE]]
+
+    def base_tile(self, dimension, x, y):
+        """The biome's ground at x, y, the tile scatter and features were placed on."""
+        biomes, _ = self.chunk(dimension, x // CHUNK_SIZE, y // CHUNK_SIZE)
+        return TILE_BY_VALUE[self.ground[biomes[(y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE]]]
+
+# Input Recording
+RECORDING_VERSION = 2
+RECORDED_EVENTS = {pygame.QUIT, pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN}
+
+
+class InputRecorder:
+    """Reads input from pygame, optionally logging it for a later replay.
+
+    Every event is stored with the frame it arrived on, and each frame's
+    length so timers fire on the same frames in a replay. The mouse is
+    polled once per frame and only logged when its state changes.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.frame = 0
+        self.frame_times = []
+        self.events = []
+        self.mouse_changes = []
+        self.mouse = ((0, 0), (False, False, False))
+
+    def frame_time(self, dt):
+        return dt
+
+    def begin_frame(self, frame, dt):
+        self.frame = frame
+        if self.path:
+            self.frame_times.append(dt)
+        mouse = (pygame.mouse.get_pos(), pygame.mouse.get_pressed())
+        if self.path and mouse != self.mouse:
+            self.mouse_changes.append([frame, list(mouse[0]), list(mouse[1])])
+        self.mouse = mouse
+
+    def get_events(self):
+        events = pygame.event.get()
+        if self.path:
+            for event in events:
+                if event.type in RECORDED_EVENTS:
+                    data = {name: event.dict[name] for name in ('key', 'mod', 'pos', 'button') if name in event.dict}
+                    self.events.append([self.frame, event.type, data])
+        return events
+
+    def get_mouse(self):
+        return self.mouse
+
+    def close(self, game):
+        if not self.path:
+            return
+        recording = {
+            'version': RECORDING_VERSION,
+            'seed': game.seed,
+            'terrain': game.terrain_generator,
+            'frames': self.frame + 1,
+            'frame_times': self.frame_times,
+            'events': self.events,
+            'mouse': self.mouse_changes,
+            'checksum': game.state_checksum(),
+        }
+        with open(self.path, 'w') as f:
+            json.dump(recording, f)
+        print(f'Recorded {recording["frames"]} frames to {self.path}')
+
+
+class InputReplayer:
+    """Feeds a recording back in place of live input."""
+
+    def __init__(self, path):
+        with open(path) as f:
+            recording = json.load(f)
+        if recording.get('version') != RECORDING_VERSION:
+            raise ValueError(f'Unsupported recording version in {path}')
+        self.seed = recording['seed']
+        self.terrain = recording.get('terrain', 'legacy')
+        self.frames = recording['frames']
+        self.frame_times = recording['frame_times']
+        self.checksum = recording.get('checksum')
+        self.events = recording['events']
+        self.mouse_changes = recording['mouse']
+        self.next_event = 0
+        self.next_mouse = 0
+        self.frame = 0
+        self.mouse = ((0, 0), (False, False, False))
+
+    def frame_time(self, dt):
+        """The recorded length of the current frame, whatever the replay really took."""
+        return self.frame_times[self.frame]
+
+    def begin_frame(self, frame, dt):
+        self.frame = frame
+        while self.next_mouse < len(self.mouse_changes) and self.mouse_changes[self.next_mouse][0] <= frame:
+            _, pos, pressed = self.mouse_changes[self.next_mouse]
+            self.mouse = (tuple(pos), tuple(pressed))
+            self.next_mouse += 1
+
+    def get_events(self):
+        pygame.event.pump()  # Keep SDL happy; live input is ignored
+        events = []
+        while self.next_event < len(self.events) and self.events[self.next_event][0] <= self.frame:
+            _, event_type, data = self.events[self.next_event]
+            if 'pos' in data:
+                data = {**data, 'pos': tuple(data['pos'])}
+            events.append(pygame.event.Event(event_type, data))
+            self.next_event += 1
+        if self.frame >= self.frames - 1:
+            events.append(pygame.event.Event(pygame.QUIT))
+        return events
+
+    def get_mouse(self):
+        return self.mouse
+
+    def close(self, game):
+        pass
+
+
+def write_replay_report(path, replayer, game, frame_times):
+    """Summarise replay frame timing and whether the final state matched the recording."""
+    frame_times = sorted(frame_times)
+
+    def percentile(p):
+        return frame_times[min(len(frame_times) - 1, int(len(frame_times) * p))] * 1000
+
+    checksum = game.state_checksum()
+    report = {
+        'frames': len(frame_times),
+        'total_seconds': sum(frame_times),
+        'mean_ms': sum(frame_times) / len(frame_times) * 1000,
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'max_ms': frame_times[-1] * 1000,
+        'checksum': checksum,
+        'recorded_checksum': replayer.checksum,
+        'checksum_match': checksum == replayer.checksum,
+    }
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Replayed {report["frames"]} frames: mean {report["mean_ms"]:.2f} ms, '
+          f'p99 {report["p99_ms"]:.2f} ms, checksum {"OK" if report["checksum_match"] else "MISMATCH"}')
+    return report
+
+# Main Game
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Infinite Exploration Game')
+    parser.add_argument('--seed', type=int, help='session seed for all randomness')
+    parser.add_argument('--terrain', choices=TERRAIN_GENERATORS, default='legacy',
+                        help='terrain generator for a new world; saved worlds keep their own')
+    parser.add_argument('--record', metavar='FILE', help='record input to FILE for later replay')
+    parser.add_argument('--replay', metavar='FILE', help='replay a recording headless at full speed')
+    parser.add_argument('--report', metavar='FILE', help='where to write the replay report')
+    parser.add_argument('--metrics', metavar='FILE', help='append cache and memory metrics to FILE as JSON lines')
+    parser.add_argument('--metrics-every', type=float, default=METRICS_EVERY_MS / 1000, metavar='SECONDS')
+    args = parser.parse_args()
+
+    if args.terrain == 'noise' and np is None:
+        parser.error('--terrain noise needs NumPy')
+
+    replayer = InputReplayer(args.replay) if args.replay else None
+    if replayer:
+        game = Game(seed=replayer.seed, terrain=replayer.terrain)
+    else:
+        game = Game(seed=args.seed, terrain=args.terrain)
+    game.input = replayer or InputRecorder(args.record)
+    game.wild.deterministic = bool(args.record or args.replay)
+    game.battle_ai.deterministic = bool(args.record or args.replay)
+    if args.metrics:
+        game.start_metrics(args.metrics, args.metrics_every * 1000)
+
+    # Recorded and replayed sessions must start from a fresh world
+    save_manager = None
+    if not (args.record or args.replay):
+        save_manager = SaveManager()
+        if save_manager.load(game):
+            game.add_message("Save loaded!")
+
+    frame = 0
+    frame_times = []
+
+    running = True
+    while running:
+        frame_start = time.perf_counter()
+        # Replays run uncapped but simulate the frame lengths that were recorded
+        dt = clock.tick() if replayer else clock.tick(60)
+        game.input.begin_frame(frame, dt)
+        dt = game.input.frame_time(dt)
+
+        for event in game.input.get_events():
+            if event.type == pygame.QUIT:
+                running = False
+            if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                if not (game.active_npc or game.show_map or game.in_battle):
+                    # The viewport is drawn 80px below the top of the screen
+                    tile_size = ZOOM_LEVELS[game.zoom]
+                    start_x, start_y, width, height = game.viewport_rect()
+                    col, row = event.pos[0] // tile_size, (event.pos[1] - 80) // tile_size
+                    if 0 <= col < width and 0 <= row < height:
+                        game.walk_to(start_x + col, start_y + row)
+            if event.type == pygame.KEYDOWN:
+                if event.key == DEBUG_KEY:
+                    game.toggle_debug()
+                elif game.in_battle:
+                    game.handle_battle_input(event.key)
+                elif game.show_box:
+                    game.handle_box_input(event.key)
+                elif game.active_npc:
+                    if event.key == pygame.K_ESCAPE:
+                        game.active_npc = None
+                else:
+                    game.path = []  # Keyboard movement cancels click-to-move
+                    if event.key in (pygame.K_w, pygame.K_UP):
+                        game.move_player(0, -1)
+                    if event.key in (pygame.K_s, pygame.K_DOWN):
+                        game.move_player(0, 1)
+                    if event.key in (pygame.K_a, pygame.K_LEFT):
+                        game.move_player(-1, 0)
+                    if event.key in (pygame.K_d, pygame.K_RIGHT):
+                        game.move_player(1, 0)
+                    if event.key == pygame.K_m:
+                        game.show_map = not game.show_map
+                    if event.key == pygame.K_f:
+                        game.farm_action()
+                    if event.key == pygame.K_c:
+                        game.show_box = True
+                        game.box_page = 0
+                    if event.key == pygame.K_MINUS:
+                        game.change_zoom(1)
+                    if event.key == pygame.K_EQUALS:
+                        game.change_zoom(-1)
+                    if event.key == pygame.K_e and game.current_dimension != 'overworld':
+                        game.current_dimension = 'overworld'
+                        game.add_message("Returned to Overworld!")
+
+        game.update(dt)
+
+        # Close map with click outside
+        if game.show_map and game.input.get_mouse()[1][0]:
+            game.show_map = False
+
+        game.draw()
+        pygame.display.flip()
+        if save_manager:
+            save_manager.autosave(game)
+        frame_times.append(time.perf_counter() - frame_start)
+        frame += 1
+
+    game.input.close(game)
+    if replayer:
+        write_replay_report(args.report or args.replay + '.report.json', replayer, game, frame_times)
+    if save_manager:
+        save_manager.close(game)
+    pygame.quit()
+    sys.exit()
+
+
+if __name__ == '__main__':
+    main()
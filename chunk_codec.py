@@ -0,0 +1,220 @@
+"""Versioned binary format for one chunk of tiles.
+
+A chunk is CHUNK_SIZE x CHUNK_SIZE tile values (one byte each, the Tile
+enum value) plus optional set_tile edits and NPC types inside it. Tile
+bytes are stored as whichever is smallest of a single fill value,
+run-length pairs, or the raw bytes, so the long ocean and sand runs from
+generate_tile shrink to a handful of bytes.
+
+Layout (little endian):
+    header   magic 'CK', version, encoding, cx (i32), cy (i32), dimension
+    tiles    FILL: value | RLE: run count (u16), (value, length - 1) pairs | RAW: tile bytes
+    edits    count (u16), (offset, value) pairs
+    npcs     count (u8), (offset, name length, utf-8 name) entries
+    crc32    of everything before it
+
+Run `python chunk_codec.py` for a round-trip check and throughput numbers.
+"""
+import struct
+import zlib
+from collections import namedtuple
+
+CHUNK_SIZE = 16  # Must match app.CHUNK_SIZE
+CHUNK_TILES = CHUNK_SIZE * CHUNK_SIZE
+
+MAGIC = b'CK'
+VERSION = 1
+
+ENCODING_FILL = 0
+ENCODING_RLE = 1
+ENCODING_RAW = 2
+
+HEADER = struct.Struct('<2sBBiiB')
+COUNT16 = struct.Struct('<H')
+CRC = struct.Struct('<I')
+
+# One full-length run per byte value, sliced by decode so runs need no allocation
+RUNS = [bytes((value,)) * 256 for value in range(256)]
+
+ChunkData = namedtuple('ChunkData', 'cx cy dimension tiles edits npcs')
+
+
+class ChunkFormatError(ValueError):
+    pass
+
+
+def encode_runs(tiles):
+    runs = bytearray()
+    count = 0
+    start = 0
+    while start < CHUNK_TILES:
+        value = tiles[start]
+        end = start + 1
+        while end < CHUNK_TILES and tiles[end] == value and end - start < 256:
+            end += 1
+        runs.append(value)
+        runs.append(end - start - 1)
+        count += 1
+        start = end
+    return COUNT16.pack(count) + runs
+
+
+def encode_chunk(cx, cy, dimension, tiles, edits=(), npcs=()):
+    """Encode a chunk.
+
+    tiles is any CHUNK_TILES-long bytes-like object, edits an iterable of
+    (offset, value) and npcs an iterable of (offset, npc type name).
+    """
+    tiles = memoryview(tiles).cast('B')
+    if len(tiles) != CHUNK_TILES:
+        raise ChunkFormatError(f'expected {CHUNK_TILES} tiles, got {len(tiles)}')
+
+    first = tiles[0]
+    if tiles.tobytes().count(first) == CHUNK_TILES:
+        encoding, body = ENCODING_FILL, bytes((first,))
+    else:
+        body = encode_runs(tiles)
+        encoding = ENCODING_RLE
+        if len(body) >= CHUNK_TILES:
+            encoding, body = ENCODING_RAW, tiles.tobytes()
+
+    out = bytearray(HEADER.pack(MAGIC, VERSION, encoding, cx, cy, dimension))
+    out += body
+
+    edits = list(edits)
+    out += COUNT16.pack(len(edits))
+    for offset, value in edits:
+        out.append(offset)
+        out.append(value)
+
+    npcs = list(npcs)
+    out.append(len(npcs))
+    for offset, name in npcs:
+        name = name.encode('utf-8')
+        out.append(offset)
+        out.append(len(name))
+        out += name
+
+    out += CRC.pack(zlib.crc32(out))
+    return bytes(out)
+
+
+def decode_chunk(data, out=None):
+    """Decode a chunk, writing tile values straight into out when given.
+
+    out can be any writable CHUNK_TILES-long buffer (bytearray, array('B'),
+    a memoryview into a larger store); no intermediate tile list is built.
+    """
+    data = memoryview(data).cast('B')
+    if len(data) < HEADER.size + CRC.size:
+        raise ChunkFormatError('chunk data truncated')
+    if CRC.unpack_from(data, len(data) - CRC.size)[0] != zlib.crc32(data[:-CRC.size]):
+        raise ChunkFormatError('chunk checksum mismatch')
+    magic, version, encoding, cx, cy, dimension = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ChunkFormatError('not a chunk')
+    if version != VERSION:
+        raise ChunkFormatError(f'unsupported chunk version {version}')
+
+    if out is None:
+        out = bytearray(CHUNK_TILES)
+    tiles = memoryview(out).cast('B')
+    pos = HEADER.size
+    if encoding == ENCODING_FILL:
+        value = data[pos]
+        tiles[:] = bytes((value,)) * CHUNK_TILES
+        pos += 1
+    elif encoding == ENCODING_RLE:
+        (count,) = COUNT16.unpack_from(data, pos)
+        pos += COUNT16.size
+        start = 0
+        for i in range(pos, pos + 2 * count, 2):
+            length = data[i + 1] + 1
+            tiles[start:start + length] = RUNS[data[i]][:length]
+            start += length
+        if start != CHUNK_TILES:
+            raise ChunkFormatError('runs do not cover the chunk')
+        pos += 2 * count
+    elif encoding == ENCODING_RAW:
+        tiles[:] = data[pos:pos + CHUNK_TILES]
+        pos += CHUNK_TILES
+    else:
+        raise ChunkFormatError(f'unknown tile encoding {encoding}')
+
+    (count,) = COUNT16.unpack_from(data, pos)
+    pos += COUNT16.size
+    edits = [(data[i], data[i + 1]) for i in range(pos, pos + 2 * count, 2)]
+    pos += 2 * count
+
+    npcs = []
+    count = data[pos]
+    pos += 1
+    for _ in range(count):
+        offset, length = data[pos], data[pos + 1]
+        npcs.append((offset, data[pos + 2:pos + 2 + length].tobytes().decode('utf-8')))
+        pos += 2 + length
+
+    return ChunkData(cx, cy, dimension, out, edits, npcs)
+
+
+def main():
+    import pickle
+    import random
+    import time
+
+    rng = random.Random(1)
+    samples = []
+    for i in range(2000):
+        kind = i % 4
+        if kind == 0:    # open ocean
+            tiles = bytes([4]) * CHUNK_TILES
+        elif kind == 1:  # ocean with scattered sand and lily pads
+            tiles = bytes(4 if rng.random() < 0.85 else rng.choice((16, 24)) for _ in range(CHUNK_TILES))
+        elif kind == 2:  # sand with long runs
+            tiles = bytes(16 if (j // 37) % 3 else 17 for j in range(CHUNK_TILES))
+        else:            # noisy grassland
+            tiles = bytes(rng.choice((1, 2, 5, 6)) for _ in range(CHUNK_TILES))
+        edits = [(rng.randrange(CHUNK_TILES), 12)] if i % 7 == 0 else []
+        npcs = [(rng.randrange(CHUNK_TILES), 'MERCHANT')] if i % 11 == 0 else []
+        samples.append((i, -i, i % 4, tiles, edits, npcs))
+
+    encoded = [encode_chunk(*sample) for sample in samples]
+    out = bytearray(CHUNK_TILES)
+    for sample, data in zip(samples, encoded):
+        chunk = decode_chunk(data, out)
+        assert (chunk.cx, chunk.cy, chunk.dimension) == sample[:3]
+        assert bytes(chunk.tiles) == sample[3]
+        assert chunk.edits == sample[4] and chunk.npcs == sample[5]
+    try:
+        decode_chunk(encoded[0][:-1] + b'\x00')
+        raise AssertionError('corrupt chunk was accepted')
+    except ChunkFormatError:
+        pass
+    print(f'round trip ok for {len(samples)} chunks')
+
+    rounds = 5
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for sample in samples:
+            encode_chunk(*sample)
+    encode_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for data in encoded:
+            decode_chunk(data, out)
+    decode_time = time.perf_counter() - start
+
+    count = rounds * len(samples)
+    raw_size = len(samples) * CHUNK_TILES
+    encoded_size = sum(map(len, encoded))
+    pickled_size = sum(
+        len(pickle.dumps({(j % CHUNK_SIZE, j // CHUNK_SIZE): value for j, value in enumerate(sample[3])}))
+        for sample in samples[:200]
+    ) * len(samples) // 200
+    print(f'encode {count / encode_time:,.0f} chunks/s, decode {count / decode_time:,.0f} chunks/s')
+    print(f'{encoded_size / len(samples):.0f} bytes/chunk vs {CHUNK_TILES} raw '
+          f'and ~{pickled_size / len(samples):.0f} pickled ({raw_size / encoded_size:.1f}x smaller than raw)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""Headless world map exporter.
+
+Renders a region of every dimension to an image pyramid for the web:
+level 0 holds one PNG per chunk, and each level above joins four images
+of the level below into one at the same size, until one image covers the
+whole region. Images are numbered from the region's first chunk, which
+export.json records as origin_chunk. Chunks are drawn across a process
+pool with the game's own ChunkImages, so the colours and sprites match
+draw_tile.
+
+Files that already exist are skipped, so an interrupted export picks up
+where it stopped when run again with the same options.
+
+Export the default ±1000 region:   python export_map.py --seed 42 --out map
+Export a saved world:              python export_map.py --save saves --out map
+Export a smaller area, one world:  python export_map.py --region -200 -200 200 200 --dimension overworld
+"""
+import os
+import json
+import time
+from multiprocessing import Pool
+
+# The exporter never opens a window; SDL reads the video driver when app initialises it
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame
+
+from app import Game, SaveManager, CHUNK_SIZE, DIMENSIONS, TERRAIN_GENERATORS, ZOOM_LEVELS
+
+WORLD_BOUNDS = (-1000, -1000, 1000, 1000)  # The range Game.is_valid_position accepts
+BACKGROUND = (0, 0, 0)
+MANIFEST = 'export.json'
+WORKER_CACHE_TILES = 100000  # Generated tiles a worker keeps before starting over
+
+worker_game = None  # Game owned by one pool process
+
+
+def init_worker(seed, terrain, edits):
+    global worker_game
+    worker_game = Game(seed=seed, terrain=terrain)
+    worker_game.edits = edits
+
+
+def tile_path(out, dimension, level, x, y):
+    return os.path.join(out, dimension, str(level), f'{x}_{y}.png')
+
+
+def save_image(image, path):
+    """Write image to path in one step, so a killed export never leaves half a file behind."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part = path[:-len('.png')] + '.part.png'
+    pygame.image.save(image, part)
+    os.replace(part, path)
+
+
+def render_chunk(job):
+    """Level 0: draw one chunk."""
+    out, dimension, origin, x, y, tile_size = job
+    game = worker_game
+    game.current_dimension = dimension
+    # Each chunk is drawn once, so generated tiles are not worth keeping across a long export
+    if len(game.world_cache) > WORKER_CACHE_TILES:
+        game.world_cache.clear()
+    image = game.chunk_images.build(origin[0] + x, origin[1] + y, tile_size)
+    save_image(image, tile_path(out, dimension, 0, x, y))
+    return dimension
+
+
+def join_children(job):
+    """Levels above 0: shrink the four images below into one."""
+    out, dimension, level, x, y, size = job
+    image = pygame.Surface((size, size))
+    image.fill(BACKGROUND)
+    half = size // 2
+    for dy in (0, 1):
+        for dx in (0, 1):
+            path = tile_path(out, dimension, level - 1, 2 * x + dx, 2 * y + dy)
+            if os.path.exists(path):
+                child = pygame.transform.smoothscale(pygame.image.load(path), (half, half))
+                image.blit(child, (dx * half, dy * half))
+    save_image(image, tile_path(out, dimension, level, x, y))
+    return dimension
+
+
+def check_manifest(out, settings):
+    """Refuse to resume an export that was started with different settings."""
+    path = os.path.join(out, MANIFEST)
+    try:
+        with open(path) as f:
+            previous = json.load(f)
+    except FileNotFoundError:
+        os.makedirs(out, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(settings, f, indent=2)
+        return
+    if previous != settings:
+        raise SystemExit(f'{out} holds an export with other settings; use a new --out directory')
+
+
+def run_jobs(pool, worker, jobs, label):
+    if not jobs:
+        return
+    start = time.perf_counter()
+    for done, _ in enumerate(pool.imap_unordered(worker, jobs, chunksize=16), 1):
+        if done % 500 == 0 or done == len(jobs):
+            print(f'{label}: {done}/{len(jobs)} images, {time.perf_counter() - start:.1f} s')
+
+
+def export(args, seed, terrain, edits):
+    x0, y0, x1, y1 = args.region
+    origin = (x0 // CHUNK_SIZE, y0 // CHUNK_SIZE)
+    columns = x1 // CHUNK_SIZE - origin[0] + 1
+    rows = y1 // CHUNK_SIZE - origin[1] + 1
+    size = CHUNK_SIZE * args.tile_size
+    dimensions = [args.dimension] if args.dimension else DIMENSIONS
+    check_manifest(args.out, {
+        'seed': seed, 'terrain': terrain, 'region': list(args.region), 'origin_chunk': list(origin),
+        'tile_size': args.tile_size, 'image_size': size, 'edits': len(edits),
+    })
+
+    with Pool(args.workers or None, initializer=init_worker, initargs=(seed, terrain, edits)) as pool:
+        jobs = [
+            (args.out, dimension, origin, x, y, args.tile_size)
+            for dimension in dimensions
+            for y in range(rows)
+            for x in range(columns)
+            if not os.path.exists(tile_path(args.out, dimension, 0, x, y))
+        ]
+        run_jobs(pool, render_chunk, jobs, 'level 0')
+
+        level = 0
+        while columns > 1 or rows > 1:
+            level += 1
+            columns, rows = (columns + 1) // 2, (rows + 1) // 2
+            jobs = [
+                (args.out, dimension, level, x, y, size)
+                for dimension in dimensions
+                for y in range(rows)
+                for x in range(columns)
+                if not os.path.exists(tile_path(args.out, dimension, level, x, y))
+            ]
+            run_jobs(pool, join_children, jobs, f'level {level}')
+        # SDL catches SIGTERM in the workers, so let them finish instead of terminating them
+        pool.close()
+        pool.join()
+    print(f'Exported {len(dimensions)} dimension(s) to {args.out}, levels 0-{level}')
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Export world regions to a PNG image pyramid')
+    parser.add_argument('--seed', type=int, default=0, help='world seed')
+    parser.add_argument('--terrain', choices=TERRAIN_GENERATORS, default='legacy')
+    parser.add_argument('--save', metavar='DIR', help='export a saved world, edits included; overrides --seed and --terrain')
+    parser.add_argument('--out', default='map_export', help='output directory')
+    parser.add_argument('--region', type=int, nargs=4, metavar=('X0', 'Y0', 'X1', 'Y1'), default=WORLD_BOUNDS,
+                        help='tile rectangle to export, inclusive')
+    parser.add_argument('--dimension', choices=DIMENSIONS, help='export only this dimension')
+    parser.add_argument('--tile-size', type=int, choices=ZOOM_LEVELS, default=ZOOM_LEVELS[2],
+                        help='pixels per tile at level 0')
+    parser.add_argument('--workers', type=int, help='processes to render with; defaults to one per CPU')
+    args = parser.parse_args()
+
+    seed, terrain, edits = args.seed, args.terrain, {}
+    if args.save:
+        game = Game(seed=seed, terrain=terrain)
+        if not SaveManager(args.save).load(game):
+            parser.error(f'no save found in {args.save}')
+        seed, terrain = game.seed, game.terrain_generator
+        edits = game.edits
+    export(args, seed, terrain, edits)
+
+
+if __name__ == '__main__':
+    main()
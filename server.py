@@ -0,0 +1,527 @@
+"""Authoritative multiplayer server for the exploration game.
+
+The server owns the world: every player gets a Game that shares one
+world_cache, edits and npc_cache, so generated tiles, set_tile edits and NPC
+state are the same for everyone. Clients only send intents (move, trade)
+and receive chunks, tile edits and player positions as small binary
+messages for the chunks around their viewport.
+
+Run a server:            python server.py --port 7777
+Run server + bot swarm:  python server.py --bots 200 --duration 30 (noise terrain, so there is treasure)
+Bots against a server:   python server.py --connect 127.0.0.1:7777 --bots 200
+"""
+import os
+import asyncio
+import random
+import struct
+import sys
+import time
+from collections import defaultdict, deque
+
+# The server never opens a window; SDL reads the video driver when app initialises it
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+from chunk_codec import encode_chunk, decode_chunk
+from app import (
+    Game, Tile, CHUNK_SIZE, DIMENSIONS, TILE_BY_VALUE, WALKABLE, TERRAIN_GENERATORS,
+    VIEWPORT_WIDTH, VIEWPORT_HEIGHT,
+)
+
+# Message framing: type byte + payload length
+HEADER = struct.Struct('<BH')
+
+# Client -> server
+MSG_HELLO = 1
+MSG_MOVE = 2          # dx, dy
+MSG_TRADE = 3         # index into TRADES
+MSG_CLOSE_NPC = 4
+
+# Server -> client
+MSG_WELCOME = 10      # player id, x, y, seed
+MSG_CHUNK = 11        # chunk_codec encoded chunk, NPC types included
+MSG_TILE = 12         # x, y, dimension, tile
+MSG_PLAYER = 13       # player id, x, y, dimension
+MSG_PLAYER_GONE = 14  # player id
+MSG_STATS = 15        # coins, score, health
+MSG_NPC = 16          # NPC type name, utf-8
+
+MOVE = struct.Struct('<bb')
+TRADE = struct.Struct('<B')
+WELCOME = struct.Struct('<Iiii')
+TILE = struct.Struct('<iiBB')
+PLAYER = struct.Struct('<IiiB')
+PLAYER_GONE = struct.Struct('<I')
+STATS = struct.Struct('<iii')
+
+# (reward, cost) pairs offered by NPCs, addressed by index on the wire
+TRADES = [
+    ('health', 20), ('map', 15), ('teleport', 30),
+    ('coins', 10), ('protection', 25), ('upgrade', 40),
+]
+
+TICK_MS = 100        # How often player schedulers (message expiry, crop timers) advance
+INTEREST_MARGIN = 4  # Tiles beyond the viewport a client keeps loaded
+SPAWN_RADIUS = 64    # Players spawn spread out instead of stacked on (0, 0)
+
+
+def pack(msg_type, payload=b''):
+    return HEADER.pack(msg_type, len(payload)) + payload
+
+
+async def read_message(reader):
+    msg_type, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+    payload = await reader.readexactly(length) if length else b''
+    return msg_type, payload
+
+
+def interest_chunks(x, y, dimension):
+    """Chunks overlapping the viewport centred on (x, y), plus a margin."""
+    left = x - VIEWPORT_WIDTH // 2 - INTEREST_MARGIN
+    top = y - VIEWPORT_HEIGHT // 2 - INTEREST_MARGIN
+    right = left + VIEWPORT_WIDTH + 2 * INTEREST_MARGIN
+    bottom = top + VIEWPORT_HEIGHT + 2 * INTEREST_MARGIN
+    return {
+        (dimension, cx, cy)
+        for cx in range(left // CHUNK_SIZE, right // CHUNK_SIZE + 1)
+        for cy in range(top // CHUNK_SIZE, bottom // CHUNK_SIZE + 1)
+    }
+
+
+def chunk_of(x, y, dimension):
+    return (dimension, x // CHUNK_SIZE, y // CHUNK_SIZE)
+
+
+class PlayerSession:
+    def __init__(self, player_id, game, writer):
+        self.id = player_id
+        self.game = game
+        self.writer = writer
+        self.chunks = set()
+
+    def send(self, data):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+    def position_message(self):
+        game = self.game
+        return pack(MSG_PLAYER, PLAYER.pack(
+            self.id, game.player_x, game.player_y, DIMENSIONS.index(game.current_dimension)))
+
+
+class WorldServer:
+    """Owns the shared world and relays changes to interested clients."""
+
+    def __init__(self, seed=None, terrain='legacy'):
+        self.world = Game(seed, terrain, animate=False)
+        self.players = {}
+        self.subscribers = defaultdict(set)  # chunk key -> sessions interested in it
+        self.next_id = 1
+
+    async def tick(self):
+        """Drive every player's scheduler on wall time; the server has no frame loop."""
+        while True:
+            await asyncio.sleep(TICK_MS / 1000)
+            for session in list(self.players.values()):
+                game = session.game
+                game.scheduler.advance(TICK_MS, game.get_total_minutes(), game.in_battle or bool(game.active_npc))
+
+    def create_game(self, player_id):
+        game = Game(self.world.seed, animate=False)
+        # All players see and edit the same world
+        game.terrain_generator, game.terrain = self.world.terrain_generator, self.world.terrain
+        game.world_cache = self.world.world_cache
+        game.edits = self.world.edits
+        game.npc_cache = self.world.npc_cache
+        spawn = random.Random(self.world.seed * 1000003 + player_id)
+        game.player_x = spawn.randint(-SPAWN_RADIUS, SPAWN_RADIUS)
+        game.player_y = spawn.randint(-SPAWN_RADIUS, SPAWN_RADIUS)
+        return game
+
+    async def handle_client(self, reader, writer):
+        try:
+            msg_type, _ = await read_message(reader)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            msg_type = None  # Gone before saying hello
+        if msg_type != MSG_HELLO:
+            writer.close()
+            return
+
+        player_id = self.next_id
+        self.next_id += 1
+        session = PlayerSession(player_id, self.create_game(player_id), writer)
+        self.players[player_id] = session
+        game = session.game
+        session.send(pack(MSG_WELCOME, WELCOME.pack(player_id, game.player_x, game.player_y, game.seed)))
+        self.update_interest(session)
+        self.send_stats(session)
+        self.broadcast_position(session)
+
+        try:
+            while True:
+                msg_type, payload = await read_message(reader)
+                if msg_type == MSG_MOVE:
+                    self.handle_move(session, *MOVE.unpack(payload))
+                elif msg_type == MSG_TRADE:
+                    self.handle_trade(session, TRADE.unpack(payload)[0])
+                elif msg_type == MSG_CLOSE_NPC:
+                    game.active_npc = None
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.disconnect(session)
+
+    def disconnect(self, session):
+        self.players.pop(session.id, None)
+        gone = pack(MSG_PLAYER_GONE, PLAYER_GONE.pack(session.id))
+        game = session.game
+        for other in self.subscribers.get(chunk_of(game.player_x, game.player_y, game.current_dimension), ()):
+            if other is not session:
+                other.send(gone)
+        for key in session.chunks:
+            self.subscribers[key].discard(session)
+            if not self.subscribers[key]:
+                del self.subscribers[key]
+        session.writer.close()
+
+    def handle_move(self, session, dx, dy):
+        game = session.game
+        if abs(dx) + abs(dy) != 1:
+            return
+        before = (game.player_x, game.player_y, game.current_dimension, game.coins, game.score, game.health)
+        game.move_player(dx, dy)
+        self.flush_edits(game)
+
+        if game.current_dimension != before[2]:
+            self.update_interest(session)
+        elif (game.player_x, game.player_y) != before[:2]:
+            old_chunk = chunk_of(before[0], before[1], before[2])
+            if chunk_of(game.player_x, game.player_y, game.current_dimension) != old_chunk:
+                self.update_interest(session)
+        # The mover always gets its own position back, which doubles as a move ack
+        self.broadcast_position(session)
+        if (game.coins, game.score, game.health) != before[3:]:
+            self.send_stats(session)
+        if game.active_npc:
+            session.send(pack(MSG_NPC, game.active_npc['npc']['type'].encode('utf-8')))
+
+    def handle_trade(self, session, index):
+        game = session.game
+        if not game.active_npc or index >= len(TRADES):
+            return
+        reward, cost = TRADES[index]
+        game.handle_trade(cost, reward)
+        self.send_stats(session)
+
+    def flush_edits(self, game):
+        """Send tiles changed by set_tile to every client watching their chunk."""
+        for key in game.dirty_tiles:
+            x, y, dimension = key
+            message = pack(MSG_TILE, TILE.pack(x, y, DIMENSIONS.index(dimension), game.edits[key].value))
+            for other in self.subscribers.get(chunk_of(x, y, dimension), ()):
+                other.send(message)
+        self.world.dirty_tiles |= game.dirty_tiles
+        game.dirty_tiles.clear()
+
+    def update_interest(self, session):
+        game = session.game
+        wanted = interest_chunks(game.player_x, game.player_y, game.current_dimension)
+        for key in session.chunks - wanted:
+            self.subscribers[key].discard(session)
+            if not self.subscribers[key]:
+                del self.subscribers[key]
+        for key in wanted - session.chunks:
+            _, cx, cy = key
+            self.subscribers[key].add(session)
+            session.send(pack(MSG_CHUNK, self.encode_chunk(game, cx, cy)))
+            # Let the newcomer see players already standing in this chunk
+            for other in self.players.values():
+                other_game = other.game
+                if other is not session and chunk_of(other_game.player_x, other_game.player_y,
+                                                     other_game.current_dimension) == key:
+                    session.send(other.position_message())
+        session.chunks = wanted
+
+    def encode_chunk(self, game, cx, cy):
+        tiles = game.get_chunk_tiles(cx, cy)
+        npcs = []
+        start = tiles.find(Tile.NPC.value)
+        while start != -1:
+            npc = game.get_npc(cx * CHUNK_SIZE + start % CHUNK_SIZE, cy * CHUNK_SIZE + start // CHUNK_SIZE)
+            if npc:
+                npcs.append((start, npc['type']))
+            start = tiles.find(Tile.NPC.value, start + 1)
+        return encode_chunk(cx, cy, DIMENSIONS.index(game.current_dimension), tiles, npcs=npcs)
+
+    def broadcast_position(self, session):
+        game = session.game
+        message = session.position_message()
+        session.send(message)
+        for other in self.subscribers.get(chunk_of(game.player_x, game.player_y, game.current_dimension), ()):
+            if other is not session:
+                other.send(message)
+
+    def send_stats(self, session):
+        game = session.game
+        session.send(pack(MSG_STATS, STATS.pack(game.coins, game.score, game.health)))
+
+
+class WorldClient:
+    """Client side of the protocol: keeps the chunks the server streams to it."""
+
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self.player_id = None
+        self.seed = None
+        self.x = self.y = 0
+        self.dimension = 0
+        self.coins = self.score = self.health = 0
+        self.active_npc = None
+        self.chunks = {}   # (dimension, cx, cy) -> bytearray of tile values
+        self.npcs = {}     # (dimension, cx, cy) -> [(offset, npc type)]
+        self.spare_chunks = []  # Evicted arrays, reused by the next chunk decode
+        self.players = {}  # player id -> (x, y, dimension)
+        self.position_acks = 0
+        self.bytes_received = 0
+        self.messages_received = 0
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.writer.write(pack(MSG_HELLO))
+        msg_type, payload = await read_message(self.reader)
+        self.player_id, self.x, self.y, self.seed = WELCOME.unpack(payload)
+
+    def send_move(self, dx, dy):
+        self.writer.write(pack(MSG_MOVE, MOVE.pack(dx, dy)))
+
+    def send_trade(self, index):
+        self.writer.write(pack(MSG_TRADE, TRADE.pack(index)))
+
+    def close_npc(self):
+        self.active_npc = None
+        self.writer.write(pack(MSG_CLOSE_NPC))
+
+    def get_tile(self, x, y):
+        chunk = self.chunks.get((self.dimension, x // CHUNK_SIZE, y // CHUNK_SIZE))
+        if chunk is None:
+            return None
+        return TILE_BY_VALUE[chunk[(y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE]]
+
+    def nearest(self, tiles):
+        """Closest tile of one of these types in the loaded chunks of this dimension, or None."""
+        best, best_distance = None, None
+        for (dimension, cx, cy), chunk in self.chunks.items():
+            if dimension != self.dimension:
+                continue
+            for tile in tiles:
+                i = chunk.find(tile.value)
+                while i != -1:
+                    x, y = cx * CHUNK_SIZE + i % CHUNK_SIZE, cy * CHUNK_SIZE + i // CHUNK_SIZE
+                    distance = abs(x - self.x) + abs(y - self.y)
+                    if best_distance is None or distance < best_distance:
+                        best, best_distance = (x, y), distance
+                    i = chunk.find(tile.value, i + 1)
+        return best
+
+    async def receive(self):
+        """Read one message and apply it. Returns the message type."""
+        msg_type, payload = await read_message(self.reader)
+        self.bytes_received += HEADER.size + len(payload)
+        self.messages_received += 1
+        if msg_type == MSG_CHUNK:
+            out = self.spare_chunks.pop() if self.spare_chunks else None
+            chunk = decode_chunk(payload, out)
+            key = (chunk.dimension, chunk.cx, chunk.cy)
+            if key in self.chunks:
+                self.spare_chunks.append(self.chunks[key])
+            self.chunks[key] = chunk.tiles
+            self.npcs[key] = chunk.npcs
+        elif msg_type == MSG_TILE:
+            x, y, dimension, value = TILE.unpack(payload)
+            chunk = self.chunks.get((dimension, x // CHUNK_SIZE, y // CHUNK_SIZE))
+            if chunk is not None:
+                chunk[(y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE] = value
+        elif msg_type == MSG_PLAYER:
+            player_id, x, y, dimension = PLAYER.unpack(payload)
+            if player_id == self.player_id:
+                if dimension != self.dimension:
+                    for key in [key for key in self.chunks if key[0] != dimension]:
+                        self.spare_chunks.append(self.chunks.pop(key))
+                        self.npcs.pop(key, None)
+                self.x, self.y, self.dimension = x, y, dimension
+                self.position_acks += 1
+            else:
+                self.players[player_id] = (x, y, dimension)
+        elif msg_type == MSG_PLAYER_GONE:
+            self.players.pop(PLAYER_GONE.unpack(payload)[0], None)
+        elif msg_type == MSG_STATS:
+            self.coins, self.score, self.health = STATS.unpack(payload)
+        elif msg_type == MSG_NPC:
+            self.active_npc = payload.decode('utf-8')
+        return msg_type
+
+    def evict_distant_chunks(self):
+        keep = interest_chunks(self.x, self.y, self.dimension)
+        for key in [key for key in self.chunks if key not in keep]:
+            self.spare_chunks.append(self.chunks.pop(key))
+            self.npcs.pop(key, None)
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+
+
+# Load Generator
+class BotStats:
+    def __init__(self):
+        self.moves = 0
+        self.latencies = []
+        self.treasure = 0
+        self.bytes_received = 0
+        self.messages_received = 0
+        self.failures = 0
+
+
+async def run_bot(host, port, stats, stop_at, move_interval, rng):
+    """Random-walk bot that heads for treasure it can see and trades when it meets NPCs."""
+    client = WorldClient()
+    try:
+        await client.connect(host, port)
+    except OSError:
+        stats.failures += 1
+        return
+    pending = deque()  # send times of moves waiting for their position ack
+    last_coins = None
+
+    async def receiver():
+        nonlocal last_coins
+        while True:
+            acks = client.position_acks
+            msg_type = await client.receive()
+            if client.position_acks != acks and pending:
+                # Our own position echo arrives in order, one per move
+                stats.latencies.append(time.perf_counter() - pending.popleft())
+            elif msg_type == MSG_STATS:
+                if last_coins is not None and client.coins > last_coins:
+                    stats.treasure += 1
+                last_coins = client.coins
+
+    receive_task = asyncio.create_task(receiver())
+    try:
+        while time.perf_counter() < stop_at:
+            if client.active_npc:
+                if client.coins >= 20 and rng.random() < 0.5:
+                    client.send_trade(0)
+                client.close_npc()
+            step = None
+            target = client.nearest((Tile.TREASURE, Tile.CRYSTAL))
+            if target is not None:
+                # Greedy walk; a random step below gets it round whatever is in the way
+                dx, dy = target[0] - client.x, target[1] - client.y
+                for move in ((dx and (1 if dx > 0 else -1), 0), (0, dy and (1 if dy > 0 else -1))):
+                    if move != (0, 0) and client.get_tile(client.x + move[0], client.y + move[1]) in WALKABLE:
+                        step = move
+                        break
+            if step is None:
+                step = rng.choice(((1, 0), (-1, 0), (0, 1), (0, -1)))
+                if client.get_tile(client.x + step[0], client.y + step[1]) not in WALKABLE:
+                    step = rng.choice(((1, 0), (-1, 0), (0, 1), (0, -1)))
+            pending.append(time.perf_counter())
+            client.send_move(*step)
+            stats.moves += 1
+            await client.writer.drain()
+            await asyncio.sleep(move_interval * (0.5 + rng.random()))
+            client.evict_distant_chunks()
+    except ConnectionError:
+        stats.failures += 1
+    finally:
+        receive_task.cancel()
+        stats.bytes_received += client.bytes_received
+        stats.messages_received += client.messages_received
+        client.close()
+
+
+async def run_load(host, port, bots, duration, move_interval, seed):
+    stats = BotStats()
+    rng = random.Random(seed)
+    stop_at = time.perf_counter() + duration
+    tasks = []
+    for i in range(bots):
+        tasks.append(asyncio.create_task(
+            run_bot(host, port, stats, stop_at, move_interval, random.Random(rng.random()))))
+        if i % 50 == 49:
+            await asyncio.sleep(0.05)  # Stagger connects so the accept backlog never overflows
+    await asyncio.gather(*tasks)
+    return stats
+
+
+def print_load_report(stats, bots, duration):
+    latencies = sorted(stats.latencies)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+
+    print(f'{bots} bots for {duration:.0f}s: {stats.moves} moves ({stats.moves / duration:.0f}/s), '
+          f'{stats.treasure} pickups, {stats.failures} failures')
+    print(f'move ack latency: p50 {percentile(0.5):.1f} ms, p95 {percentile(0.95):.1f} ms, '
+          f'p99 {percentile(0.99):.1f} ms')
+    print(f'received {stats.messages_received} messages, {stats.bytes_received / 1024:.0f} KiB '
+          f'({stats.bytes_received / max(1, stats.moves):.0f} bytes/move)')
+
+
+async def serve(args):
+    server = WorldServer(args.seed, args.terrain)
+    tcp_server = await asyncio.start_server(server.handle_client, args.host, args.port, backlog=1024)
+    port = tcp_server.sockets[0].getsockname()[1]
+    print(f'World seed {server.world.seed}, listening on {args.host}:{port}')
+    tick_task = asyncio.create_task(server.tick())
+    async with tcp_server:
+        if not args.bots:
+            await tcp_server.serve_forever()
+            return
+        # Local stand-in: server and bot swarm share one process over loopback
+        stats = await run_load(args.host, port, args.bots, args.duration, args.move_interval, args.seed)
+        print_load_report(stats, args.bots, args.duration)
+        print(f'{len(server.world.world_cache)} tiles cached, {len(server.subscribers)} chunks watched')
+        tick_task.cancel()
+        return stats
+    tick_task.cancel()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Multiplayer world server and load generator')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7777, help='0 picks a free port')
+    parser.add_argument('--seed', type=int, help='world seed')
+    # Legacy worlds have no treasure for the bots to collect
+    parser.add_argument('--terrain', choices=TERRAIN_GENERATORS,
+                        help='world generator; noise for bot runs, legacy otherwise')
+    parser.add_argument('--connect', metavar='HOST:PORT', help='run bots against an existing server')
+    parser.add_argument('--bots', type=int, default=0, help='number of bot clients to simulate')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds to run the bots')
+    parser.add_argument('--move-interval', type=float, default=0.2, help='average seconds between bot moves')
+    args = parser.parse_args()
+    if args.terrain is None:
+        args.terrain = 'noise' if args.bots else 'legacy'
+
+    if args.connect:
+        host, port = args.connect.rsplit(':', 1)
+        stats = asyncio.run(run_load(host, int(port), args.bots or 1, args.duration,
+                                     args.move_interval, args.seed))
+        print_load_report(stats, args.bots or 1, args.duration)
+    else:
+        try:
+            stats = asyncio.run(serve(args))
+        except KeyboardInterrupt:
+            stats = None
+    # Bots walk onto every treasure next to them, so none at all means the run tested nothing
+    if stats is not None and not stats.treasure:
+        print('FAIL: bots collected no treasure')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""Long-run stress harness for kiosk builds.
+
+A random-walk bot drives a headless Game for millions of steps: walking
+with move_player, stepping through portals, trading with NPCs and
+fighting battles, with a frame drawn every so often. At intervals it
+samples memory, cache sizes, live surfaces and step latency, and the run
+fails when anything keeps growing past the configured thresholds.
+
+Default run, report next to it:   python stress.py --steps 2000000 --report stress.json
+Quick smoke run:                  python stress.py --steps 20000 --sample-every 2000
+"""
+import os
+import gc
+import json
+import random
+import sys
+import time
+
+# The harness never opens a window; SDL reads the video driver when app initialises it
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame
+
+from app import Game, Creature, TERRAIN_GENERATORS
+
+FRAME_MS = 1000 / 60           # Game time simulated per step
+TURN_CHANCE = 0.2              # Chance the bot picks a new direction each step
+BATTLE_CHANCE = 0.001          # Chance per step to start a battle on top of roaming creatures
+FARM_CHANCE = 0.002
+STARTING_COINS = 50            # The bot is topped up to this so NPC trades keep happening
+DIRECTIONS = [(0, -1), (0, 1), (-1, 0), (1, 0)]
+NPC_ACTIONS = ['buy_health', 'buy_potion', 'buy_map', 'get_hint', 'close_dialogue']
+
+
+def rss_bytes():
+    """Resident set size now; the peak where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def live_surfaces():
+    """(count, pixel bytes) of Surfaces held by any Python container.
+
+    Surfaces are not tracked by the garbage collector themselves, so they
+    are found as referents of the objects that are.
+    """
+    seen = {}
+    for obj in gc.get_objects():
+        for ref in gc.get_referents(obj):
+            if type(ref) is pygame.Surface:
+                seen[id(ref)] = ref
+    return len(seen), sum(s.get_width() * s.get_height() * s.get_bytesize() for s in seen.values())
+
+
+class Bot:
+    """Random walk with some persistence, plus whatever the game puts in its way."""
+
+    def __init__(self, game, seed):
+        self.game = game
+        self.rng = random.Random(seed)
+        self.direction = self.rng.choice(DIRECTIONS)
+        self.counts = {'moves': 0, 'portals': 0, 'trades': 0, 'battles': 0, 'farm': 0, 'revives': 0}
+        game.creatures.append(Creature(rng=game.rng))
+        game.current_creature = 0
+
+    def step(self):
+        game, rng, counts = self.game, self.rng, self.counts
+        if game.in_battle:
+            game.handle_battle_input(pygame.K_1)
+            if not game.in_battle and all(creature.is_fainted() for creature in game.creatures):
+                for creature in game.creatures:  # The kiosk's healing centre
+                    creature.health = creature.max_health
+                counts['revives'] += 1
+            return
+        if game.active_npc:
+            getattr(game, rng.choice(NPC_ACTIONS))()
+            game.close_dialogue()
+            game.show_map = False
+            counts['trades'] += 1
+            return
+
+        if game.health == 0:
+            game.health = 3
+            counts['revives'] += 1
+        if game.coins < STARTING_COINS // 2:
+            game.coins = STARTING_COINS
+        roll = rng.random()
+        if roll < BATTLE_CHANCE:
+            counts['battles'] += game.start_battle()
+            return
+        if roll < BATTLE_CHANCE + FARM_CHANCE:
+            game.farm_action()
+            counts['farm'] += 1
+            return
+        if rng.random() < TURN_CHANCE:
+            self.direction = rng.choice(DIRECTIONS)
+        dimension = game.current_dimension
+        game.move_player(*self.direction)
+        counts['moves'] += 1
+        if game.current_dimension != dimension:
+            counts['portals'] += 1
+
+
+def sample(game, step, window, started):
+    window.sort()
+    count, pixel_bytes = live_surfaces()
+    memory = game.memory_report()
+    caches = {name: cache['entries'] for name, cache in memory['caches'].items()}
+    caches['timers'] = memory['timers']
+    return {
+        'step': step,
+        'elapsed_seconds': time.perf_counter() - started,
+        'rss_mb': rss_bytes() / 2 ** 20,
+        'surfaces': count,
+        'surface_mb': pixel_bytes / 2 ** 20,
+        'cache_mb': memory['cache_bytes'] / 2 ** 20,
+        'asset_mb': memory['asset_bytes'] / 2 ** 20,
+        'caches': caches,
+        'mean_ms': sum(window) / len(window) * 1000,
+        'p99_ms': window[min(len(window) - 1, int(len(window) * 0.99))] * 1000,
+        'max_ms': window[-1] * 1000,
+    }
+
+
+def check(samples, args):
+    """Threshold failures between the first sample after warm-up and the last one."""
+    warm = [s for s in samples if s['step'] >= args.steps * args.warm_up]
+    if len(warm) < 2:
+        return []
+    first, last = warm[0], warm[-1]
+    failures = []
+    rss_growth = last['rss_mb'] - first['rss_mb']
+    if rss_growth > args.max_rss_growth:
+        failures.append(f'RSS grew {rss_growth:.1f} MB after warm-up (limit {args.max_rss_growth} MB)')
+    surface_growth = last['surfaces'] - first['surfaces']
+    if surface_growth > args.max_surface_growth:
+        failures.append(f'{surface_growth} more live surfaces after warm-up (limit {args.max_surface_growth})')
+    for name, size in last['caches'].items():
+        limit = max(first['caches'][name], args.cache_floor) * args.max_cache_growth
+        if size > limit:
+            failures.append(f'{name} grew from {first["caches"][name]} to {size} entries (limit {limit:.0f})')
+    drift = last['mean_ms'] / first['mean_ms']
+    if drift > args.max_latency_drift:
+        failures.append(f'Mean step time drifted {drift:.2f}x (limit {args.max_latency_drift}x)')
+    return failures
+
+
+def run(args):
+    game = Game(seed=args.seed, terrain=args.terrain)
+    bot = Bot(game, game.seed)
+    samples = []
+    window = []
+    started = time.perf_counter()
+    for step in range(1, args.steps + 1):
+        step_start = time.perf_counter()
+        bot.step()
+        game.update(FRAME_MS)
+        if step % args.draw_every == 0:
+            game.draw()
+            pygame.display.flip()
+        window.append(time.perf_counter() - step_start)
+
+        if step % args.sample_every == 0 or step == args.steps:
+            samples.append(sample(game, step, window, started))
+            window = []
+            latest = samples[-1]
+            print(f'step {step}: rss {latest["rss_mb"]:.1f} MB, {latest["surfaces"]} surfaces, '
+                  f'{latest["caches"]["world_cache"]} tiles cached, mean {latest["mean_ms"]:.3f} ms, '
+                  f'p99 {latest["p99_ms"]:.3f} ms')
+
+    failures = check(samples, args)
+    report = {
+        'seed': game.seed,
+        'terrain': game.terrain_generator,
+        'steps': args.steps,
+        'seconds': time.perf_counter() - started,
+        'bot': bot.counts,
+        'thresholds': {
+            'warm_up': args.warm_up,
+            'max_rss_growth_mb': args.max_rss_growth,
+            'max_surface_growth': args.max_surface_growth,
+            'max_cache_growth': args.max_cache_growth,
+            'cache_floor': args.cache_floor,
+            'max_latency_drift': args.max_latency_drift,
+        },
+        'samples': samples,
+        'failures': failures,
+        'passed': not failures,
+    }
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(f'{args.steps} steps in {report["seconds"]:.0f} s: {bot.counts}')
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    print('PASS' if report['passed'] else 'FAILED')
+    return report
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Long-run memory and frame-time drift harness')
+    parser.add_argument('--steps', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=0, help='world and bot seed')
+    # Legacy worlds have no NPCs or portals for the bot to use
+    parser.add_argument('--terrain', choices=TERRAIN_GENERATORS, default='noise')
+    parser.add_argument('--sample-every', type=int, default=10000, help='steps between samples')
+    parser.add_argument('--draw-every', type=int, default=60, help='steps between drawn frames')
+    parser.add_argument('--report', metavar='FILE', help='where to write the JSON report')
+    parser.add_argument('--warm-up', type=float, default=0.1,
+                        help='share of the run before growth is measured')
+    parser.add_argument('--max-rss-growth', type=float, default=256, help='MB')
+    parser.add_argument('--max-surface-growth', type=int, default=500)
+    parser.add_argument('--max-cache-growth', type=float, default=20,
+                        help='allowed size ratio, last sample over first after warm-up')
+    parser.add_argument('--cache-floor', type=int, default=100,
+                        help='caches smaller than this at warm-up are measured against it')
+    parser.add_argument('--max-latency-drift', type=float, default=2.0,
+                        help='allowed mean step time ratio, last sample over first after warm-up')
+    args = parser.parse_args()
+    report = run(args)
+    pygame.quit()
+    sys.exit(0 if report['passed'] else 1)
+
+
+if __name__ == '__main__':
+    main()